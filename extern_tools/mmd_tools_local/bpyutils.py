@@ -105,25 +105,24 @@ def select_object(obj, objects=[]):
     return __SelectObjects(obj, objects)
 
 def duplicateObject(obj, total_len):
-    for i in bpy.context.selected_objects:
-        i.select = False
-    obj.select = True
-    assert(len(bpy.context.selected_objects) == 1)
-    assert(bpy.context.selected_objects[0] == obj)
-    last_selected = objs = [obj]
-    while len(objs) < total_len:
-        bpy.ops.object.duplicate()
-        objs.extend(bpy.context.selected_objects)
-        remain = total_len - len(objs) - len(bpy.context.selected_objects)
-        if remain < 0:
-            last_selected = bpy.context.selected_objects
-            for i in range(-remain):
-                last_selected[i].select = False
-        else:
-            for i in range(min(remain, len(last_selected))):
-                last_selected[i].select = True
-        last_selected = bpy.context.selected_objects
-    assert(len(objs) == total_len)
+    """ Duplicate obj until there are total_len objects, obj is the first one.
+
+     The copies are created through bpy.data instead of the duplicate operator, their object data
+     is copied as well and they are linked to the same scenes and groups/collections as obj,
+     including the rigid body world, so rigid bodies and constraints are duplicated too.
+    """
+    if bpy.app.version < (2, 80, 0):
+        targets = [i.objects for i in obj.users_scene] + [i.objects for i in obj.users_group]
+    else:
+        targets = [i.objects for i in obj.users_collection]
+    objs = [obj]
+    for i in range(total_len - 1):
+        new_obj = obj.copy()
+        if obj.data is not None:
+            new_obj.data = obj.data.copy()
+        for objects in targets:
+            objects.link(new_obj)
+        objs.append(new_obj)
     return objs
 
 def makeCapsuleBak(segment=16, ring_count=8, radius=1.0, height=1.0, target_scene=None):
@@ -10,8 +10,10 @@ from mmd_tools_local.core.morph import FnMorph
 from mmd_tools_local.bpyutils import matmul
 from mmd_tools_local.bpyutils import SceneOp
 
+import itertools
 import logging
 import time
+import numpy as np
 
 
 def isRigidBodyObject(obj):
@@ -24,6 +26,32 @@ def isTemporaryObject(obj):
     return obj and obj.mmd_type in {'TRACK_TARGET', 'NON_COLLISION_CONSTRAINT', 'SPRING_CONSTRAINT', 'SPRING_GOAL'}
 
 
+def _findOverlappingSpheres(locations, radii):
+    """ Index pairs (i, j), i < j, of the spheres which overlap, using a uniform grid as broad phase
+    """
+    if len(radii) < 2 or radii.max() <= 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # a sphere spans at most 9 cells on each axis
+    cell_size = max(radii.mean()*2, radii.max()/4)
+    cells_min = np.floor((locations - radii[:, None])/cell_size).astype(np.int64).tolist()
+    cells_max = np.floor((locations + radii[:, None])/cell_size).astype(np.int64).tolist()
+    grid = {}
+    for i, (lo, hi) in enumerate(zip(cells_min, cells_max)):
+        for cell in itertools.product(*(range(a, b+1) for a, b in zip(lo, hi))):
+            grid.setdefault(cell, []).append(i)
+
+    candidates = set()
+    for members in grid.values():
+        if len(members) > 1:
+            candidates.update(itertools.combinations(members, 2))
+    if not candidates:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.array(sorted(candidates), dtype=np.int64)
+    a, b = pairs[:, 0], pairs[:, 1]
+    overlap = np.linalg.norm(locations[a] - locations[b], axis=1) < radii[a] + radii[b]
+    return pairs[overlap]
+
 def getRigidBodySize(obj):
     assert(obj.mmd_type == 'RIGID_BODY')
 
@@ -146,6 +174,7 @@ class Model:
     def createRigidBodyPool(self, counts):
         if counts < 1:
             return []
+        start_time = time.time()
         obj = bpyutils.createObject(name='Rigidbody', object_data=bpy.data.meshes.new(name='Rigidbody'))
         obj.parent = self.rigidGroupObject()
         obj.mmd_type = 'RIGID_BODY'
@@ -165,9 +194,9 @@ class Model:
             obj.mmd_rigid.shape = 'BOX'
             obj.mmd_rigid.size = (1, 1, 1)
         bpy.ops.rigidbody.object_add(type='ACTIVE')
-        if counts == 1:
-            return [obj]
-        return bpyutils.duplicateObject(obj, counts)
+        objs = bpyutils.duplicateObject(obj, counts)
+        logging.debug(' created %d rigid bodies in %f seconds', counts, time.time() - start_time)
+        return objs
 
     def createRigidBody(self, **kwargs):
         ''' Create a object for MMD rigid body dynamics.
@@ -242,6 +271,7 @@ class Model:
     def createJointPool(self, counts):
         if counts < 1:
             return []
+        start_time = time.time()
         obj = bpyutils.createObject(name='Joint', object_data=None)
         obj.parent = self.jointGroupObject()
         obj.mmd_type = 'JOINT'
@@ -268,9 +298,9 @@ class Model:
             rbc.use_spring_ang_x = True
             rbc.use_spring_ang_y = True
             rbc.use_spring_ang_z = True
-        if counts == 1:
-            return [obj]
-        return bpyutils.duplicateObject(obj, counts)
+        objs = bpyutils.duplicateObject(obj, counts)
+        logging.debug(' created %d joints in %f seconds', counts, time.time() - start_time)
+        return objs
 
     def createJoint(self, **kwargs):
         ''' Create a joint object for MMD rigid body dynamics.
@@ -863,9 +893,6 @@ class Model:
         logging.debug(' Build riggings of rigid bodies')
         logging.debug('--------------------------------')
         rigid_objects = list(self.rigidBodies())
-        rigid_object_groups = [[] for i in range(16)]
-        for i in rigid_objects:
-            rigid_object_groups[i.mmd_rigid.collision_group_number].append(i)
 
         jointMap = {}
         for joint in self.joints():
@@ -876,38 +903,43 @@ class Model:
             jointMap[frozenset((rbc.object1, rbc.object2))] = joint
 
         logging.info('Creating non collision constraints')
+        start_time = time.time()
         # create non collision constraints
-        nonCollisionJointTable = []
-        non_collision_pairs = set()
+        rigid_index = {obj:i for i, obj in enumerate(rigid_objects)}
+        locations = np.array([tuple(i.location) for i in rigid_objects], dtype=np.float64).reshape(-1, 3)
+        ranges = np.array([self.__getRigidRange(i) for i in rigid_objects], dtype=np.float64)
+        group_bits = np.array([1 << i.mmd_rigid.collision_group_number for i in rigid_objects], dtype=np.int64)
+        group_masks = np.array([sum(1 << n for n, ignore in enumerate(i.mmd_rigid.collision_group_mask) if ignore)
+                                for i in rigid_objects], dtype=np.int64)
+
+        joint_pairs = set()
+        for pair, joint in jointMap.items():
+            if len(pair) != 2 or not all(obj in rigid_index for obj in pair):
+                continue
+            a, b = sorted(rigid_index[obj] for obj in pair)
+            joint_pairs.add((a, b))
+            if (group_masks[a] & group_bits[b]) or (group_masks[b] & group_bits[a]):
+                joint.rigid_body_constraint.disable_collisions = True
+
+        pairs = _findOverlappingSpheres(locations, ranges * distance_of_ignore_collisions * 0.5)
+        a, b = pairs[:, 0], pairs[:, 1]
+        ignored = ((group_masks[a] & group_bits[b]) | (group_masks[b] & group_bits[a])) != 0
+        nonCollisionJointTable = [(rigid_objects[a], rigid_objects[b]) for a, b in pairs[ignored].tolist()
+                                  if (a, b) not in joint_pairs]
         rigid_object_cnt = len(rigid_objects)
-        for obj_a in rigid_objects:
-            for n, ignore in enumerate(obj_a.mmd_rigid.collision_group_mask):
-                if not ignore:
-                    continue
-                for obj_b in rigid_object_groups[n]:
-                    if obj_a == obj_b:
-                        continue
-                    pair = frozenset((obj_a, obj_b))
-                    if pair in non_collision_pairs:
-                        continue
-                    if pair in jointMap:
-                        joint = jointMap[pair]
-                        joint.rigid_body_constraint.disable_collisions = True
-                    else:
-                        distance = (obj_a.location - obj_b.location).length
-                        if distance < distance_of_ignore_collisions * (self.__getRigidRange(obj_a) + self.__getRigidRange(obj_b)) * 0.5:
-                            nonCollisionJointTable.append((obj_a, obj_b))
-                    non_collision_pairs.add(pair)
+        logging.info(' - found %d non collision pairs of %d rigid bodies in %f seconds',
+                     len(nonCollisionJointTable), rigid_object_cnt, time.time() - start_time)
+
+        start_time = time.time()
         for cnt, i in enumerate(rigid_objects):
             logging.info('%3d/%3d: Updating rigid body %s', cnt+1, rigid_object_cnt, i.name)
             self.updateRigid(i)
+        logging.info(' - updated %d rigid bodies in %f seconds', rigid_object_cnt, time.time() - start_time)
         self.__createNonCollisionConstraint(nonCollisionJointTable)
         return rigid_objects
 
     def __makeSpring(self, target, base_obj, spring_stiffness):
-        with bpyutils.select_object(target):
-            bpy.ops.object.duplicate()
-            spring_target = SceneOp(bpy.context).active_object
+        spring_target = bpyutils.duplicateObject(target, 2)[1]
         t = spring_target.constraints.get('mmd_tools_rigid_parent')
         if t is not None:
             spring_target.constraints.remove(t)
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import struct
 import os
+import mmap
 import logging
 
+import numpy as np
+
 class InvalidFileError(Exception):
     pass
 class UnsupportedVersionError(Exception):
@@ -40,8 +43,20 @@ class FileStream:
 class FileReadStream(FileStream):
     def __init__(self, path, pmx_header=None):
         self.__fin = open(path, 'rb')
+        self.__map = None
         FileStream.__init__(self, path, self.__fin, pmx_header)
 
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        FileStream.close(self)
+
+    def __mapFile(self):
+        if self.__map is None:
+            self.__map = mmap.mmap(self.__fin.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.__map
+
     def __readIndex(self, size, typedict):
         index = None
         if size in typedict :
@@ -76,6 +91,58 @@ class FileReadStream(FileStream):
     def readMaterialIndex(self):
         return self.__readSignedIndex(self.header().material_index_size)
 
+    # READ methods for whole blocks, decoded straight from the memory mapped file
+    def readVertexIndices(self, count):
+        size = self.header().vertex_index_size
+        dtype = {1:'<u1', 2:'<u2', 4:'<u4'}.get(size, None)
+        if dtype is None:
+            raise ValueError('invalid data size %s'%str(size))
+        buf = self.__mapFile()
+        offset = self.__fin.tell()
+        if offset + count*size > len(buf):
+            raise struct.error('unpack requires a buffer of %d bytes'%(count*size))
+        indices = np.frombuffer(buf, dtype=dtype, count=count, offset=offset).astype(np.int64)
+        self.__fin.seek(offset + count*size)
+        return indices
+
+    def readVertexArrays(self, count):
+        vertex_dtype, weight_dtypes = VertexArrays.recordDtypes(self.header())
+        vertex_size = vertex_dtype.itemsize
+        record_sizes = {k: vertex_size + v.itemsize for k, v in weight_dtypes.items()}
+
+        # The records have different sizes, so only their offsets are collected here, all decoding is done by numpy
+        buf = self.__mapFile()
+        start = offset = self.__fin.tell()
+        offsets = [0] * count
+        try:
+            for i in range(count):
+                offsets[i] = offset
+                offset += record_sizes[buf[offset + vertex_size - 1]]
+        except IndexError:
+            raise struct.error('unpack requires a buffer of %d bytes'%(offset + vertex_size - start))
+        except KeyError:
+            raise ValueError('invalid weight type %s'%str(buf[offset + vertex_size - 1]))
+        if offset > len(buf):
+            raise struct.error('unpack requires a buffer of %d bytes'%(offset - start))
+        self.__fin.seek(offset)
+
+        data = np.frombuffer(buf, dtype=np.uint8, count=offset-start, offset=start)
+        offsets = np.array(offsets, dtype=np.int64) - start
+        vertex_records = self.__gatherRecords(data, offsets, vertex_dtype)
+        weight_records = {}
+        for weight_type in np.unique(vertex_records['weight_type']):
+            indices = np.flatnonzero(vertex_records['weight_type'] == weight_type)
+            weight_records[weight_type] = (indices, self.__gatherRecords(data, offsets[indices] + vertex_size, weight_dtypes[weight_type]))
+        return VertexArrays.fromRecords(vertex_records, weight_records)
+
+    @staticmethod
+    def __gatherRecords(data, offsets, dtype):
+        if len(offsets) < 1:
+            return np.zeros(0, dtype=dtype)
+        # View every byte as the start of a record, so that all records can be copied out with one fancy index
+        windows = np.lib.stride_tricks.as_strided(data, shape=(len(data) - dtype.itemsize + 1, dtype.itemsize), strides=(1, 1), writeable=False)
+        return np.ascontiguousarray(windows[offsets]).view(dtype).reshape(-1)
+
     # READ / WRITE methods for general types
     def readInt(self):
         v, = struct.unpack('<i', self.__fin.read(4))
@@ -113,22 +180,57 @@ class FileReadStream(FileStream):
         return v
 
 class FileWriteStream(FileStream):
+    """ Everything is encoded into a buffer first, which is written to the file in chunks of FLUSH_SIZE bytes
+    Large blocks (vertices, faces, morph offsets) are encoded with numpy record dtypes as a whole
+    """
+    FLUSH_SIZE = 1 << 20
+
+    __INT = struct.Struct('<i')
+    __SHORT = struct.Struct('<h')
+    __UNSIGNED_SHORT = struct.Struct('<H')
+    __FLOAT = struct.Struct('<f')
+    __BYTE = struct.Struct('<B')
+    __SIGNED_BYTE = struct.Struct('<b')
+    __SIGNED_INDEX = { 1 :struct.Struct('<b'), 2 :struct.Struct('<h'), 4 :struct.Struct('<i')}
+    __UNSIGNED_INDEX = { 1 :struct.Struct('<B'), 2 :struct.Struct('<H'), 4 :struct.Struct('<I')}
+    __VECTORS = {size:struct.Struct('<'+'f'*size) for size in range(1, 5)}
+
     def __init__(self, path, pmx_header=None):
         self.__fout = open(path, 'wb')
+        self.__buffer = bytearray()
         FileStream.__init__(self, path, self.__fout, pmx_header)
 
-    def __writeIndex(self, index, size, typedict):
-        if size in typedict :
-            self.__fout.write(struct.pack(typedict[size], int(index)))
+    def close(self):
+        if self.__fout is not None and not self.__fout.closed:
+            self.flush()
+        FileStream.close(self)
+
+    def flush(self):
+        if self.__buffer:
+            self.__fout.write(self.__buffer)
+            self.__buffer = bytearray()
+
+    def __write(self, data):
+        if len(data) >= self.FLUSH_SIZE:
+            self.flush()
+            self.__fout.write(data)
+            return
+        self.__buffer += data
+        if len(self.__buffer) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def __writeIndex(self, index, size, structs):
+        if size in structs :
+            self.__write(structs[size].pack(int(index)))
         else:
             raise ValueError('invalid data size %s'%str(size))
         return
 
     def __writeSignedIndex(self, index, size):
-        return self.__writeIndex(index, size, { 1 :"<b", 2 :"<h", 4 :"<i"})
+        return self.__writeIndex(index, size, self.__SIGNED_INDEX)
 
     def __writeUnsignedIndex(self, index, size):
-        return self.__writeIndex(index, size, { 1 :"<B", 2 :"<H", 4 :"<I"})
+        return self.__writeIndex(index, size, self.__UNSIGNED_INDEX)
 
     # WRITE methods for indexes
     def writeVertexIndex(self, index):
@@ -149,35 +251,100 @@ class FileWriteStream(FileStream):
     def writeMaterialIndex(self, index):
         return self.__writeSignedIndex(index, self.header().material_index_size)
 
+    # WRITE methods for whole blocks, the counts are not written
+    def __vertexIndexType(self):
+        size = self.header().vertex_index_size
+        dtype = {1:'<u1', 2:'<u2', 4:'<u4'}.get(size, None)
+        if dtype is None:
+            raise ValueError('invalid data size %s'%str(size))
+        return dtype
+
+    def writeVertexIndices(self, indices):
+        self.__write(np.asarray(indices).astype(self.__vertexIndexType()).tobytes())
+
+    def writeVertexOffsets(self, indices, offsets, size):
+        """ Writes the (vertex index, offset vector) records of vertex and UV morphs
+        """
+        records = np.zeros(len(indices), dtype=[('index', self.__vertexIndexType()), ('offset', '<f4', (size,))])
+        records['index'] = indices
+        records['offset'] = np.array(offsets, dtype=np.float64).reshape(-1, size)
+        self.__write(records.tobytes())
+
+    def writeVertexArrays(self, arrays, chunk_size=65536):
+        header = self.header()
+        vertex_dtype, weight_dtypes = VertexArrays.recordDtypes(header)
+        vertex_size = vertex_dtype.itemsize
+        record_sizes = np.zeros(256, dtype=np.int64)
+        for weight_type, weight_dtype in weight_dtypes.items():
+            record_sizes[weight_type] = vertex_size + weight_dtype.itemsize
+        max_size = record_sizes.max()
+        uv_count = min(header.additional_uvs, arrays.additional_uvs.shape[1])
+
+        invalid_types = np.flatnonzero(record_sizes[arrays.weight_type] == 0)
+        if len(invalid_types):
+            raise ValueError('invalid weight type %s'%str(arrays.weight_type[invalid_types[0]]))
+
+        # Every chunk is encoded as rows of the largest record size, the rows are then cut to their record sizes
+        for start in range(0, len(arrays), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            weight_type = arrays.weight_type[chunk]
+            count = len(weight_type)
+
+            vertex_records = np.zeros(count, dtype=vertex_dtype)
+            vertex_records['co'] = arrays.co[chunk]
+            vertex_records['normal'] = arrays.normal[chunk]
+            vertex_records['uv'] = arrays.uv[chunk]
+            vertex_records['additional_uvs'][:, :uv_count] = arrays.additional_uvs[chunk, :uv_count]
+            vertex_records['weight_type'] = weight_type
+
+            rows = np.zeros((count, max_size), dtype=np.uint8)
+            rows[:, :vertex_size] = vertex_records.view(np.uint8).reshape(count, vertex_size)
+            for t in np.unique(weight_type):
+                indices = np.flatnonzero(weight_type == t) + start
+                weight_dtype = weight_dtypes[t]
+                weight_records = np.zeros(len(indices), dtype=weight_dtype)
+                weight_records['bones'] = arrays.bones[indices, :weight_dtype['bones'].shape[0]]
+                weight_records['edge_scale'] = arrays.edge_scale[indices]
+                if t == BoneWeight.BDEF4:
+                    weight_records['weights'] = arrays.weights[indices]
+                elif t != BoneWeight.BDEF1: # BDEF2, SDEF
+                    weight_records['weight'] = arrays.weights[indices, 0]
+                    if t == BoneWeight.SDEF:
+                        weight_records['sdef'] = arrays.sdef[indices]
+                rows[indices - start, vertex_size:vertex_size+weight_dtype.itemsize] = weight_records.view(np.uint8).reshape(len(indices), -1)
+            self.__write(rows[np.arange(max_size) < record_sizes[weight_type][:, None]].tobytes())
 
     def writeInt(self, v):
-        self.__fout.write(struct.pack('<i', int(v)))
+        self.__write(self.__INT.pack(int(v)))
 
     def writeShort(self, v):
-        self.__fout.write(struct.pack('<h', int(v)))
+        self.__write(self.__SHORT.pack(int(v)))
 
     def writeUnsignedShort(self, v):
-        self.__fout.write(struct.pack('<H', int(v)))
+        self.__write(self.__UNSIGNED_SHORT.pack(int(v)))
 
     def writeStr(self, v):
         data = v.encode(self.header().encoding.charset)
         self.writeInt(len(data))
-        self.__fout.write(data)
+        self.__write(data)
 
     def writeFloat(self, v):
-        self.__fout.write(struct.pack('<f', float(v)))
+        self.__write(self.__FLOAT.pack(float(v)))
 
     def writeVector(self, v):
-        self.__fout.write(struct.pack('<'+'f'*len(v), *v))
+        packer = self.__VECTORS.get(len(v), None)
+        if packer is None:
+            packer = struct.Struct('<'+'f'*len(v))
+        self.__write(packer.pack(*v))
 
     def writeByte(self, v):
-        self.__fout.write(struct.pack('<B', int(v)))
+        self.__write(self.__BYTE.pack(int(v)))
 
     def writeBytes(self, v):
-        self.__fout.write(v)
+        self.__write(v)
 
     def writeSignedByte(self, v):
-        self.__fout.write(struct.pack('<b', int(v)))
+        self.__write(self.__SIGNED_BYTE.pack(int(v)))
 
 class Encoding:
     _MAP = [
@@ -233,7 +400,7 @@ class Header:
             self.updateIndexSizes(model)
 
     def updateIndexSizes(self, model):
-        self.vertex_index_size = self.__getIndexSize(len(model.vertices), False)
+        self.vertex_index_size = self.__getIndexSize(model.vertexCount(), False)
         self.texture_index_size = self.__getIndexSize(len(model.textures), True)
         self.material_index_size = self.__getIndexSize(len(model.materials), True)
         self.bone_index_size = self.__getIndexSize(len(model.bones), True)
@@ -325,7 +492,8 @@ class Model:
         self.comment = ''
         self.comment_e = ''
 
-        self.vertices = []
+        self.__vertices = []
+        self.__vertex_arrays = None
         self.faces = []
         self.textures = []
         self.materials = []
@@ -347,6 +515,35 @@ class Model:
         self.rigids = []
         self.joints = []
 
+    # Loaded models keep their vertices as VertexArrays, the Vertex objects are only created when they are accessed
+    @property
+    def vertices(self):
+        if self.__vertices is None:
+            self.__vertices = self.__vertex_arrays.toVertices()
+            self.__vertex_arrays = None
+        return self.__vertices
+
+    @vertices.setter
+    def vertices(self, vertices):
+        self.__vertices = vertices
+        self.__vertex_arrays = None
+
+    def vertexCount(self):
+        if self.__vertices is None:
+            return len(self.__vertex_arrays)
+        return len(self.__vertices)
+
+    def vertexArrays(self):
+        """ Returns the vertices as VertexArrays, changes only reach the model through setVertexArrays()
+        """
+        if self.__vertices is None:
+            return self.__vertex_arrays
+        return VertexArrays.fromVertices(self.__vertices)
+
+    def setVertexArrays(self, arrays):
+        self.__vertices = None
+        self.__vertex_arrays = arrays
+
     def load(self, fs):
         self.filepath = fs.path()
         self.header = fs.header()
@@ -367,24 +564,17 @@ class Model:
         logging.info('Load Vertices')
         logging.info('------------------------------')
         num_vertices = fs.readInt()
-        self.vertices = []
-        for i in range(num_vertices):
-            v = Vertex()
-            v.load(fs)
-            self.vertices.append(v)
-        logging.info('----- Loaded %d vertices', len(self.vertices))
+        self.__vertex_arrays = fs.readVertexArrays(num_vertices)
+        self.__vertices = None
+        logging.info('----- Loaded %d vertices', len(self.__vertex_arrays))
 
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Faces')
         logging.info('------------------------------')
         num_faces = fs.readInt()
-        self.faces = []
-        for i in range(int(num_faces/3)):
-            f1 = fs.readVertexIndex()
-            f2 = fs.readVertexIndex()
-            f3 = fs.readVertexIndex()
-            self.faces.append((f3, f2, f1))
+        indices = fs.readVertexIndices(num_faces)
+        self.faces = indices[:len(indices)//3*3].reshape(-1, 3)[:, ::-1].tolist()
         logging.info(' Load %d faces', len(self.faces))
 
         logging.info('')
@@ -576,18 +766,14 @@ comment(english):
 %s
 ''', self.name, self.name_e, self.comment, self.comment_e)
 
-        logging.info('exporting vertices... %d', len(self.vertices))
-        fs.writeInt(len(self.vertices))
-        for i in self.vertices:
-            i.save(fs)
+        logging.info('exporting vertices... %d', self.vertexCount())
+        fs.writeInt(self.vertexCount())
+        fs.writeVertexArrays(self.vertexArrays())
         logging.info('finished exporting vertices.')
 
         logging.info('exporting faces... %d', len(self.faces))
         fs.writeInt(len(self.faces)*3)
-        for f3, f2, f1 in self.faces:
-            fs.writeVertexIndex(f1)
-            fs.writeVertexIndex(f2)
-            fs.writeVertexIndex(f3)
+        fs.writeVertexIndices(np.array(self.faces, dtype=np.int64).reshape(-1, 3)[:, ::-1])
         logging.info('finished exporting faces.')
 
         logging.info('exporting textures... %d', len(self.textures))
@@ -777,6 +963,152 @@ class BoneWeight:
             raise ValueError('invalid weight type %s'%str(self.type))
 
 
+class VertexArrays:
+    """ Columnar vertex data, bones and weights are padded to 4 columns with -1 and 0
+    BDEF2 and SDEF store their weight and its complement, SDEF additionally stores c, r0 and r1 in sdef
+    """
+    def __init__(self, count=0, additional_uvs=0):
+        self.co = np.zeros((count, 3), dtype=np.float32)
+        self.normal = np.zeros((count, 3), dtype=np.float32)
+        self.uv = np.zeros((count, 2), dtype=np.float32)
+        self.additional_uvs = np.zeros((count, additional_uvs, 4), dtype=np.float32)
+        self.weight_type = np.zeros(count, dtype=np.uint8)
+        self.bones = np.full((count, 4), -1, dtype=np.int32)
+        self.weights = np.zeros((count, 4), dtype=np.float32)
+        self.sdef = np.zeros((count, 3, 3), dtype=np.float32)
+        self.edge_scale = np.ones(count, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.weight_type)
+
+    @staticmethod
+    def recordDtypes(header):
+        """ Returns the record dtype of a vertex and the record dtypes of the weight types
+        A vertex record ends with its weight type, which is followed by the record of the weight type
+        """
+        bone_type = { 1 :'<i1', 2 :'<i2', 4 :'<i4'}.get(header.bone_index_size, None)
+        if bone_type is None:
+            raise ValueError('invalid data size %s'%str(header.bone_index_size))
+        vertex_dtype = np.dtype([
+            ('co', '<f4', (3,)), ('normal', '<f4', (3,)), ('uv', '<f4', (2,)),
+            ('additional_uvs', '<f4', (header.additional_uvs, 4)), ('weight_type', 'u1'),
+            ])
+        weight_dtypes = {
+            BoneWeight.BDEF1: np.dtype([('bones', bone_type, (1,)), ('edge_scale', '<f4')]),
+            BoneWeight.BDEF2: np.dtype([('bones', bone_type, (2,)), ('weight', '<f4'), ('edge_scale', '<f4')]),
+            BoneWeight.BDEF4: np.dtype([('bones', bone_type, (4,)), ('weights', '<f4', (4,)), ('edge_scale', '<f4')]),
+            BoneWeight.SDEF: np.dtype([('bones', bone_type, (2,)), ('weight', '<f4'), ('sdef', '<f4', (3, 3)), ('edge_scale', '<f4')]),
+            }
+        return vertex_dtype, weight_dtypes
+
+    def __repr__(self):
+        return '<VertexArrays count %d, additional_uvs %d>'%(len(self), self.additional_uvs.shape[1])
+
+    def take(self, indices):
+        """ Returns a copy of the vertices at the given indices
+        """
+        arrays = VertexArrays()
+        for name, array in vars(self).items():
+            setattr(arrays, name, array[indices])
+        return arrays
+
+    @classmethod
+    def fromRecords(cls, vertex_records, weight_records):
+        """ Creates the arrays from the records of FileReadStream.readVertexArrays()
+        weight_records maps each weight type to the vertex indices and the weight records of that type
+        """
+        arrays = cls(len(vertex_records), vertex_records.dtype['additional_uvs'].shape[0])
+        arrays.co[:] = vertex_records['co']
+        arrays.normal[:] = vertex_records['normal']
+        arrays.uv[:] = vertex_records['uv']
+        arrays.additional_uvs[:] = vertex_records['additional_uvs']
+        arrays.weight_type[:] = vertex_records['weight_type']
+
+        for weight_type, (indices, records) in weight_records.items():
+            bones = records['bones']
+            arrays.bones[indices, :bones.shape[1]] = bones
+            arrays.edge_scale[indices] = records['edge_scale']
+            if weight_type == BoneWeight.BDEF1:
+                arrays.weights[indices, 0] = 1.0
+            elif weight_type == BoneWeight.BDEF4:
+                arrays.weights[indices] = records['weights']
+            else: # BDEF2, SDEF
+                arrays.weights[indices, 0] = records['weight']
+                arrays.weights[indices, 1] = 1.0 - records['weight']
+                if weight_type == BoneWeight.SDEF:
+                    arrays.sdef[indices] = records['sdef']
+        return arrays
+
+    @classmethod
+    def fromVertices(cls, vertices, additional_uvs=None):
+        count = len(vertices)
+        if additional_uvs is None:
+            additional_uvs = max((len(v.additional_uvs) for v in vertices), default=0)
+        arrays = cls(count, additional_uvs)
+        if count < 1:
+            return arrays
+        arrays.co[:] = [tuple(v.co) for v in vertices]
+        arrays.normal[:] = [tuple(v.normal) for v in vertices]
+        arrays.uv[:] = [tuple(v.uv) for v in vertices]
+        arrays.edge_scale[:] = [v.edge_scale for v in vertices]
+        for j in range(additional_uvs):
+            indices = [i for i, v in enumerate(vertices) if len(v.additional_uvs) > j]
+            arrays.additional_uvs[indices, j] = [tuple(vertices[i].additional_uvs[j]) for i in indices]
+
+        weights = [v.weight for v in vertices]
+        arrays.weight_type[:] = [w.type for w in weights]
+        arrays.bones[:] = [(list(w.bones) + [-1, -1, -1])[:4] for w in weights]
+        for weight_type in np.unique(arrays.weight_type).tolist():
+            indices = np.flatnonzero(arrays.weight_type == weight_type)
+            type_weights = [weights[i].weights for i in indices.tolist()]
+            if weight_type == BoneWeight.BDEF1:
+                arrays.weights[indices, 0] = 1.0
+            elif weight_type == BoneWeight.BDEF4:
+                arrays.weights[indices] = [tuple(w) for w in type_weights]
+            elif weight_type == BoneWeight.SDEF:
+                w = np.array([w.weight for w in type_weights], dtype=np.float32)
+                arrays.weights[indices, 0] = w
+                arrays.weights[indices, 1] = 1.0 - w
+                arrays.sdef[indices] = [(tuple(w.c), tuple(w.r0), tuple(w.r1)) for w in type_weights]
+            else:
+                w = np.array([w[0] for w in type_weights], dtype=np.float32)
+                arrays.weights[indices, 0] = w
+                arrays.weights[indices, 1] = 1.0 - w
+        return arrays
+
+    def toVertices(self):
+        def __rows(array):
+            return map(tuple, array.astype(np.float64).tolist())
+
+        vertices = []
+        additional_uvs = [list(map(tuple, uvs)) for uvs in self.additional_uvs.astype(np.float64).tolist()]
+        sdef = self.sdef.astype(np.float64).tolist()
+        for i, (co, normal, uv, weight_type, bones, weights, edge_scale) in enumerate(zip(
+                __rows(self.co), __rows(self.normal), __rows(self.uv), self.weight_type.tolist(),
+                self.bones.tolist(), self.weights.astype(np.float64).tolist(), self.edge_scale.astype(np.float64).tolist())):
+            v = Vertex()
+            v.co = co
+            v.normal = normal
+            v.uv = uv
+            v.additional_uvs = additional_uvs[i]
+            v.edge_scale = edge_scale
+
+            w = v.weight = BoneWeight()
+            w.type = weight_type
+            if weight_type == BoneWeight.BDEF1:
+                w.bones = bones[:1]
+            elif weight_type == BoneWeight.BDEF4:
+                w.bones = bones
+                w.weights = tuple(weights)
+            elif weight_type == BoneWeight.SDEF:
+                w.bones = bones[:2]
+                w.weights = BoneWeightSDEF(weights[0], *map(tuple, sdef[i]))
+            else:
+                w.bones = bones[:2]
+                w.weights = [weights[0]]
+            vertices.append(v)
+        return vertices
+
 class Texture:
     def __init__(self):
         self.path = ''
@@ -1181,6 +1513,9 @@ class Morph:
         fs.writeSignedByte(self.category)
         fs.writeSignedByte(self.type_index())
         fs.writeInt(len(self.offsets))
+        self.saveOffsets(fs)
+
+    def saveOffsets(self, fs):
         for i in self.offsets:
             i.save(fs)
 
@@ -1198,6 +1533,9 @@ class VertexMorph(Morph):
             t.load(fs)
             self.offsets.append(t)
 
+    def saveOffsets(self, fs):
+        fs.writeVertexOffsets([i.index for i in self.offsets], [i.offset for i in self.offsets], 3)
+
 class VertexMorphOffset:
     def __init__(self):
         self.index = 0
@@ -1227,6 +1565,9 @@ class UVMorph(Morph):
             t.load(fs)
             self.offsets.append(t)
 
+    def saveOffsets(self, fs):
+        fs.writeVertexOffsets([i.index for i in self.offsets], [i.offset for i in self.offsets], 4)
+
 class UVMorphOffset:
     def __init__(self):
         self.index = 0
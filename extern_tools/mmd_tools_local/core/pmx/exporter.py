@@ -8,6 +8,7 @@ import time
 import mathutils
 import bpy
 import bmesh
+import numpy as np
 
 from collections import OrderedDict
 from mmd_tools_local.core import pmx
@@ -22,6 +23,29 @@ from mmd_tools_local.bpyutils import matmul
 from mmd_tools_local.operators.misc import MoveObject
 
 
+def _float_bits(values):
+    """ Returns the bit patterns of the float rows, so that rows of floats can be compared as integer keys
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    return values.view(np.int64).reshape(len(values), -1)
+
+def _unique_rows(keys):
+    """ Returns the index of the first row of every distinct row and the id of the distinct row of every row
+    The distinct rows are numbered in the order of their first row
+    """
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    first_rows = order[is_first]
+    first_order = np.argsort(first_rows, kind='mergesort')
+    row_ids = np.empty(len(first_rows), dtype=np.int64)
+    row_ids[first_order] = np.arange(len(first_rows))
+    ids = np.empty(len(keys), dtype=np.int64)
+    ids[order] = row_ids[np.cumsum(is_first) - 1]
+    return first_rows[first_order], ids
+
+
 class _Vertex:
     def __init__(self, co, groups, offsets, edge_scale, vertex_order, uv_offsets):
         self.co = co
@@ -929,11 +953,12 @@ class __PmxExporter:
             quad_method, ngon_method = (1, 1) if bpy.app.version < (2, 80, 0) else ('FIXED', 'EAR_CLIP')
             face_map = bmesh.ops.triangulate(bm, faces=bm.faces, quad_method=quad_method, ngon_method=ngon_method)['face_map']
             logging.debug(' - Remapping custom normals...')
-            loop_normals = []
+            loop_ids = []
             for f in bm.faces:
                 vert_to_loop_id = face_verts_to_loop_id_map[face_map.get(f, f)]
                 for v in f.verts:
-                    loop_normals.append(custom_normals[vert_to_loop_id[v]])
+                    loop_ids.append(vert_to_loop_id[v])
+            loop_normals = custom_normals[np.array(loop_ids, dtype=np.int64)]
             logging.debug('   - Done (faces:%d)', len(bm.faces))
             bm.to_mesh(mesh)
             face_map.clear()
@@ -945,32 +970,63 @@ class __PmxExporter:
 
     @staticmethod
     def __get_normals(mesh, matrix):
-        custom_normals = None
+        loop_count = len(mesh.loops)
+        custom_normals = np.empty(loop_count*3, dtype=np.float32)
         if hasattr(mesh, 'has_custom_normals'):
             logging.debug(' - Calculating normals split...')
             mesh.calc_normals_split()
-            custom_normals = [matmul(matrix, l.normal).normalized() for l in mesh.loops]
+            mesh.loops.foreach_get('normal', custom_normals)
             mesh.free_normals_split()
         elif mesh.use_auto_smooth:
             logging.debug(' - Calculating normals split (angle:%f)...', mesh.auto_smooth_angle)
             mesh.calc_normals_split(mesh.auto_smooth_angle)
-            custom_normals = [matmul(matrix, l.normal).normalized() for l in mesh.loops]
+            mesh.loops.foreach_get('normal', custom_normals)
             mesh.free_normals_split()
         else:
             logging.debug(' - Calculating normals...')
             mesh.calc_normals()
-            #custom_normals = [matmul(matrix, mesh.vertices[l.vertex_index].normal).normalized() for l in mesh.loops]
-            custom_normals = []
-            for f in mesh.polygons:
-                if f.use_smooth:
-                    for v in f.vertices:
-                        custom_normals.append(matmul(matrix, mesh.vertices[v].normal).normalized())
-                else:
-                    for v in f.vertices:
-                        custom_normals.append(matmul(matrix, f.normal).normalized())
+            face_count = len(mesh.polygons)
+            vertex_normals = np.empty(len(mesh.vertices)*3, dtype=np.float32)
+            mesh.vertices.foreach_get('normal', vertex_normals)
+            face_normals = np.empty(face_count*3, dtype=np.float32)
+            mesh.polygons.foreach_get('normal', face_normals)
+            use_smooth = np.empty(face_count, dtype=bool)
+            mesh.polygons.foreach_get('use_smooth', use_smooth)
+            loop_start = np.empty(face_count, dtype=np.int32)
+            mesh.polygons.foreach_get('loop_start', loop_start)
+            loop_total = np.empty(face_count, dtype=np.int32)
+            mesh.polygons.foreach_get('loop_total', loop_total)
+            loop_vertices = np.empty(loop_count, dtype=np.int32)
+            mesh.loops.foreach_get('vertex_index', loop_vertices)
+
+            # smooth faces use the vertex normals, flat faces use the face normal, in the order of the face vertices
+            loop_faces = np.repeat(np.arange(face_count), loop_total)
+            loop_ids = np.arange(loop_count) + np.repeat(loop_start - (np.cumsum(loop_total) - loop_total), loop_total)
+            custom_normals = np.where(use_smooth[loop_faces, None],
+                vertex_normals.reshape(-1, 3)[loop_vertices[loop_ids]],
+                face_normals.reshape(-1, 3)[loop_faces])
+        custom_normals = np.dot(custom_normals.reshape(-1, 3), np.array(matrix, dtype=np.float64).T)
+        lengths = np.linalg.norm(custom_normals, axis=1)
+        np.divide(custom_normals, lengths[:, None], out=custom_normals, where=lengths[:, None] > 0)
         logging.debug('   - Done (polygons:%d)', len(mesh.polygons))
         return custom_normals
 
+    @staticmethod
+    def __get_loop_uvs(uv_layer, loop_count):
+        uvs = np.empty(loop_count*2, dtype=np.float32)
+        if uv_layer is None:
+            uvs.reshape(-1, 2)[:] = (0, 1)
+        else:
+            uv_layer.data.foreach_get('uv', uvs)
+        return uvs.reshape(-1, 2)
+
+    @staticmethod
+    def __get_coordinates(mesh_vertices, matrix):
+        co = np.empty(len(mesh_vertices)*3, dtype=np.float32)
+        mesh_vertices.foreach_get('co', co)
+        matrix = np.array(matrix, dtype=np.float64)
+        return np.dot(co.reshape(-1, 3), matrix[:3, :3].T) + matrix[:3, 3]
+
     def __doLoadMeshData(self, meshObj, bone_map):
         vg_to_bone = {i:bone_map[x.name] for i, x in enumerate(meshObj.vertex_groups) if x.name in bone_map}
         vg_edge_scale = meshObj.vertex_groups.get('mmd_edge_scale', None)
@@ -997,85 +1053,72 @@ class __PmxExporter:
 
         base_mesh = _to_mesh(meshObj)
         loop_normals = self.__triangulate(base_mesh, self.__get_normals(base_mesh, normal_matrix))
-        base_mesh.transform(pmx_matrix)
-
-        def _get_weight(vertex_group_index, vertex, default_weight):
-            for i in vertex.groups:
-                if i.group == vertex_group_index:
-                    return i.weight
-            return default_weight
-
-        get_edge_scale = None
-        if vg_edge_scale:
-            get_edge_scale = lambda x: _get_weight(vg_edge_scale.index, x, 1)
-        else:
-            get_edge_scale = lambda x: 1
+        base_co = self.__get_coordinates(base_mesh.vertices, pmx_matrix)
+        base_co_list = base_co.tolist()
 
-        get_vertex_order = None
+        edge_scale_index = vg_edge_scale.index if vg_edge_scale else None
+        vertex_order_index = None
+        mesh_id = None
         if self.__vertex_order_map: # sort vertices
             mesh_id = self.__vertex_order_map.setdefault('mesh_id', 0)
             self.__vertex_order_map['mesh_id'] += 1
             if vg_vertex_order and self.__vertex_order_map['method'] == 'CUSTOM':
-                get_vertex_order = lambda x: (mesh_id, _get_weight(vg_vertex_order.index, x, 2), x.index)
-            else:
-                get_vertex_order = lambda x: (mesh_id, x.index)
-        else:
-            get_vertex_order = lambda x: None
+                vertex_order_index = vg_vertex_order.index
 
         uv_morph_names = {g.index:(n, x) for g, n, x in FnMorph.get_uv_morph_vertex_groups(meshObj)}
-        def get_uv_offsets(v):
+
+        # the vertex groups can't be read in bulk, so each used vertex reads all of its groups in a single pass
+        mesh_vertices = base_mesh.vertices
+        def _new_vertex(index):
+            groups = []
+            edge_scale = 1
+            order_weight = 2
             uv_offsets = {}
-            for x in v.groups:
-                if x.group in uv_morph_names and x.weight > 0:
-                    name, axis = uv_morph_names[x.group]
+            for x in mesh_vertices[index].groups:
+                group, weight = x.group, x.weight
+                if weight > 0 and group in vg_to_bone:
+                    groups.append((vg_to_bone[group], weight))
+                if group == edge_scale_index:
+                    edge_scale = weight
+                if group == vertex_order_index:
+                    order_weight = weight
+                if weight > 0 and group in uv_morph_names:
+                    name, axis = uv_morph_names[group]
                     d = uv_offsets.setdefault(name, [0, 0, 0, 0])
-                    d['XYZW'.index(axis[1])] += -x.weight if axis[0] == '-' else x.weight
-            return uv_offsets
-
-        base_vertices = {}
-        for v in base_mesh.vertices:
-            base_vertices[v.index] = [_Vertex(
-                v.co.copy(),
-                [(vg_to_bone[x.group], x.weight) for x in v.groups if x.weight > 0 and x.group in vg_to_bone],
-                {},
-                get_edge_scale(v),
-                get_vertex_order(v),
-                get_uv_offsets(v),
-                )]
+                    d['XYZW'.index(axis[1])] += -weight if axis[0] == '-' else weight
+            if mesh_id is None:
+                vertex_order = None
+            elif vertex_order_index is None:
+                vertex_order = (mesh_id, index)
+            else:
+                vertex_order = (mesh_id, order_weight, index)
+            return _Vertex(tuple(base_co_list[index]), groups, {}, edge_scale, vertex_order, uv_offsets)
 
         # load face data
-        class _DummyUV:
-            uv1 = uv2 = uv3 = mathutils.Vector((0, 1))
-            def __init__(self, uvs):
-                self.uv1,  self.uv2, self.uv3 = (v.uv.copy() for v in uvs)
-
-        _UVWrapper = lambda x: (_DummyUV(x[i:i+3]) for i in range(0, len(x), 3))
-
-        material_faces = {}
-        uv_data = base_mesh.uv_layers.active
-        if uv_data:
-            uv_data = _UVWrapper(uv_data.data)
-        else:
-            uv_data = iter(lambda: _DummyUV, None)
-        face_seq = []
-        for face, uv in zip(base_mesh.polygons, uv_data):
-            if len(face.vertices) != 3:
-                raise Exception
-            idx = face.index * 3
-            n1, n2, n3 = loop_normals[idx:idx+3]
-            v1 = self.__convertFaceUVToVertexUV(face.vertices[0], uv.uv1, n1, base_vertices)
-            v2 = self.__convertFaceUVToVertexUV(face.vertices[1], uv.uv2, n2, base_vertices)
-            v3 = self.__convertFaceUVToVertexUV(face.vertices[2], uv.uv3, n3, base_vertices)
-
-            t = _Face([v1, v2, v3])
-            face_seq.append(t)
-            if face.material_index not in material_faces:
-                material_faces[face.material_index] = []
-            material_faces[face.material_index].append(t)
+        face_count = len(base_mesh.polygons)
+        loop_total = np.empty(face_count, dtype=np.int32)
+        base_mesh.polygons.foreach_get('loop_total', loop_total)
+        if np.any(loop_total != 3):
+            raise Exception
+        material_indices = np.empty(face_count, dtype=np.int32)
+        base_mesh.polygons.foreach_get('material_index', material_indices)
+        loop_vertices = np.empty(face_count*3, dtype=np.int32)
+        base_mesh.loops.foreach_get('vertex_index', loop_vertices)
+        loop_uvs = self.__get_loop_uvs(base_mesh.uv_layers.active, len(loop_vertices))
+
+        # vertices are split by UV and normal, only the distinct (vertex, UV, normal) loops are compared
+        loop_keys = np.column_stack((loop_vertices, _float_bits(loop_uvs), _float_bits(loop_normals)))
+        first_loops, loop_ids = _unique_rows(loop_keys)
+        base_vertices = {}
+        split_vertices = []
+        for vi, uv, normal in zip(loop_vertices[first_loops].tolist(), loop_uvs[first_loops].tolist(), loop_normals[first_loops].tolist()):
+            if vi not in base_vertices:
+                base_vertices[vi] = [_new_vertex(vi)]
+            split_vertices.append(self.__convertFaceUVToVertexUV(vi, mathutils.Vector(uv), mathutils.Vector(normal), base_vertices))
 
         _mat_name = lambda x: x.name if x else self.__getDefaultMaterial().name
         material_names = {i:_mat_name(m) for i, m in enumerate(base_mesh.materials)}
-        material_names = {i:material_names.get(i, None) or _mat_name(None) for i in material_faces.keys()}
+        material_names = {i:material_names.get(i, None) or _mat_name(None) for i in np.unique(material_indices).tolist()}
 
         # export add UV
         bl_add_uvs = [i for i in base_mesh.uv_layers[1:] if not i.name.startswith('_')]
@@ -1084,23 +1127,31 @@ class __PmxExporter:
             if uv_n > 3:
                 logging.warning(' * extra addUV%d+ are not supported', uv_n+1)
                 break
-            uv_data = _UVWrapper(uv_tex.data)
             zw_data = base_mesh.uv_layers.get('_'+uv_tex.name, None)
             logging.info(' # exporting addUV%d: %s [zw: %s]', uv_n+1, uv_tex.name, zw_data)
-            if zw_data:
-                zw_data = _UVWrapper(zw_data.data)
-            else:
-                zw_data = iter(lambda: _DummyUV, None)
+            loop_adduvs = self.__get_loop_uvs(uv_tex, len(loop_vertices))
+            loop_addzws = self.__get_loop_uvs(zw_data, len(loop_vertices))
+            loop_keys = np.column_stack((loop_ids, _float_bits(loop_adduvs), _float_bits(loop_addzws)))
+            first_loops, new_loop_ids = _unique_rows(loop_keys)
             rip_vertices_map = {}
-            for f, face, uv, zw in zip(face_seq, base_mesh.polygons, uv_data, zw_data):
-                vertices = [base_vertices[x] for x in face.vertices]
-                rip_vertices = [rip_vertices_map.setdefault(x, [x]) for x in f.vertices]
-                f.vertices[0] = self.__convertAddUV(f.vertices[0], uv.uv1, zw.uv1, uv_n, vertices[0], rip_vertices[0])
-                f.vertices[1] = self.__convertAddUV(f.vertices[1], uv.uv2, zw.uv2, uv_n, vertices[1], rip_vertices[1])
-                f.vertices[2] = self.__convertAddUV(f.vertices[2], uv.uv3, zw.uv3, uv_n, vertices[2], rip_vertices[2])
+            new_split_vertices = []
+            for vi, split_id, adduv, addzw in zip(loop_vertices[first_loops].tolist(), loop_ids[first_loops].tolist(), loop_adduvs[first_loops].tolist(), loop_addzws[first_loops].tolist()):
+                v = split_vertices[split_id]
+                rip_vertices = rip_vertices_map.setdefault(v, [v])
+                new_split_vertices.append(self.__convertAddUV(v, mathutils.Vector(adduv), mathutils.Vector(addzw), uv_n, base_vertices[vi], rip_vertices))
+            split_vertices, loop_ids = new_split_vertices, new_loop_ids
 
         _to_mesh_clear(meshObj, base_mesh)
 
+        if not pmx_matrix.is_negative: # pmx.load/pmx.save reverse face vertices by default
+            loop_ids = loop_ids.reshape(-1, 3)[:, ::-1]
+        loop_vertex_objects = [split_vertices[i] for i in loop_ids.ravel().tolist()]
+        material_faces = {}
+        for i, material_index in enumerate(material_indices.tolist()):
+            if material_index not in material_faces:
+                material_faces[material_index] = []
+            material_faces[material_index].append(_Face(loop_vertex_objects[i*3:i*3+3]))
+
         # calculate offsets
         shape_key_list = []
         if meshObj.data.shape_keys:
@@ -1114,52 +1165,51 @@ class __PmxExporter:
                 else:
                     shape_key_list.append((i, kb))
 
+        # without active modifiers the evaluated shape is the shape key data itself, so there is no need to evaluate the mesh
+        read_shape_key_data = not any(m.show_viewport for m in meshObj.modifiers)
+
+        def _get_shape_key_coordinates(index, kb):
+            if read_shape_key_data and not kb.vertex_group:
+                return self.__get_coordinates(kb.data, pmx_matrix)
+            kb_mute, kb.mute = kb.mute, False
+            meshObj.active_shape_key_index = index
+            mesh = _to_mesh(meshObj)
+            kb.mute = kb_mute
+            co = self.__get_coordinates(mesh.vertices, pmx_matrix)
+            _to_mesh_clear(meshObj, mesh)
+            return co
+
         shape_key_names = []
-        sdef_counts = 0
+        sdef_vertices = []
         for i, kb in shape_key_list:
             shape_key_name = kb.name
             logging.info(' - processing shape key: %s', shape_key_name)
-            kb_mute, kb.mute = kb.mute, False
-            meshObj.active_shape_key_index = i
-            mesh = _to_mesh(meshObj)
-            mesh.transform(pmx_matrix)
-            kb.mute = kb_mute
-            if len(mesh.vertices) != len(base_vertices):
+            co = _get_shape_key_coordinates(i, kb)
+            if len(co) != len(base_co):
                 logging.warning('   * Error! vertex count mismatch!')
                 continue
+            moved = np.flatnonzero(np.linalg.norm(co - base_co, axis=1) >= 0.001)
             if shape_key_name in {'mmd_sdef_c', 'mmd_sdef_r0', 'mmd_sdef_r1'}:
                 if shape_key_name == 'mmd_sdef_c':
-                    for v in mesh.vertices:
-                        base = base_vertices[v.index][0]
-                        if len(base.groups) != 2:
+                    for vi, c_co in zip(moved.tolist(), co[moved].tolist()):
+                        if vi not in base_vertices:
                             continue
-                        base_co = base.co
-                        c_co = v.co
-                        if (c_co - base_co).length < 0.001:
+                        base = base_vertices[vi][0]
+                        if len(base.groups) != 2:
                             continue
-                        base.sdef_data[:] = tuple(c_co), base_co, base_co
-                        sdef_counts += 1
-                    logging.info('   - Restored %d SDEF vertices', sdef_counts)
-                elif sdef_counts > 0:
+                        base.sdef_data[:] = tuple(c_co), base.co, base.co
+                        sdef_vertices.append(vi)
+                    logging.info('   - Restored %d SDEF vertices', len(sdef_vertices))
+                elif sdef_vertices:
                     ri = 1 if shape_key_name == 'mmd_sdef_r0' else 2
-                    for v in mesh.vertices:
-                        sdef_data = base_vertices[v.index][0].sdef_data
-                        if sdef_data:
-                            sdef_data[ri] = tuple(v.co)
+                    for vi, r_co in zip(sdef_vertices, co[sdef_vertices].tolist()):
+                        base_vertices[vi][0].sdef_data[ri] = tuple(r_co)
                     logging.info('   - Updated SDEF data')
             else:
                 shape_key_names.append(shape_key_name)
-                for v in mesh.vertices:
-                    base = base_vertices[v.index][0]
-                    offset = v.co - base.co
-                    if offset.length < 0.001:
-                        continue
-                    base.offsets[shape_key_name] = offset
-            _to_mesh_clear(meshObj, mesh)
-
-        if not pmx_matrix.is_negative: # pmx.load/pmx.save reverse face vertices by default
-            for f in face_seq:
-                f.vertices.reverse()
+                for vi, offset in zip(moved.tolist(), (co[moved] - base_co[moved]).tolist()):
+                    if vi in base_vertices:
+                        base_vertices[vi][0].offsets[shape_key_name] = tuple(offset)
 
         return _Mesh(
             material_faces,
@@ -5,6 +5,8 @@ import logging
 import time
 
 import bpy
+import bmesh
+import numpy as np
 from mathutils import Vector, Matrix
 
 import mmd_tools_local.core.model as mmd_model
@@ -56,7 +58,8 @@ class PMXImporter:
         self.__materialTable = []
         self.__imageTable = {}
 
-        self.__sdefVertices = {} # pmx vertices
+        self.__pmxVertices = None # pmx.VertexArrays
+        self.__sdefVertices = None # (vertex indices, SDEF vectors)
         self.__blender_ik_links = set()
         self.__vertex_map = None
 
@@ -116,67 +119,77 @@ class PMXImporter:
         self.__importVertexGroup()
 
         pmxModel = self.__model
-        pmx_vertices = pmxModel.vertices
-        vertex_count = len(pmx_vertices)
+        pmx_vertices = self.__pmxVertices = pmxModel.vertexArrays()
         vertex_map = self.__vertex_map
         if vertex_map:
             indices = collections.OrderedDict(vertex_map).keys()
-            pmx_vertices = tuple(pmxModel.vertices[x] for x in indices)
-            vertex_count = len(indices)
+            pmx_vertices = pmx_vertices.take(list(indices))
+        vertex_count = len(pmx_vertices)
         if vertex_count < 1:
             return
 
         mesh = self.__meshObj.data
         mesh.vertices.add(count=vertex_count)
-        mesh.vertices.foreach_set('co', tuple(i for pv in pmx_vertices for i in (Vector(pv.co).xzy * self.__scale)))
-
-        vertex_group_table = self.__vertexGroupTable
+        mesh.vertices.foreach_set('co', (pmx_vertices.co[:, (0, 2, 1)].astype(np.float64) * self.__scale).astype(np.float32).ravel())
+
+        bones, weights = pmx_vertices.bones.copy(), pmx_vertices.weights.clip(0.0, 1.0)
+        weight_count = np.array([1, 2, 4, 2])[pmx_vertices.weight_type] # BDEF1, BDEF2, BDEF4, SDEF
+
+        sdef_indices = np.flatnonzero(pmx_vertices.weight_type == pmx.BoneWeight.SDEF)
+        sdef_vectors = pmx_vertices.sdef[sdef_indices]
+        swapped = bones[sdef_indices, 0] > bones[sdef_indices, 1]
+        swapped_indices = sdef_indices[swapped]
+        bones[swapped_indices, :2] = bones[swapped_indices, 1::-1]
+        weights[swapped_indices, :2] = weights[swapped_indices, 1::-1]
+        sdef_vectors[swapped, 1:] = sdef_vectors[swapped, :0:-1]
+        self.__sdefVertices = (sdef_indices, sdef_vectors)
+
+        vertex_group_indices = np.array([vg.index for vg in self.__vertexGroupTable], dtype=np.int64)
+        vertex_groups = np.full(bones.shape, -1, dtype=np.int64)
+        has_bone = bones >= 0
+        vertex_groups[has_bone] = vertex_group_indices[bones[has_bone]]
         vg_edge_scale = self.__meshObj.vertex_groups.new(name='mmd_edge_scale')
         vg_vertex_order = self.__meshObj.vertex_groups.new(name='mmd_vertex_order')
-        for i, pv in enumerate(pmx_vertices):
-            pv_bones, pv_weights, idx = pv.weight.bones, pv.weight.weights, (i,)
-
-            vg_edge_scale.add(index=idx, weight=pv.edge_scale, type='REPLACE')
-            vg_vertex_order.add(index=idx, weight=i/vertex_count, type='REPLACE')
-
-            if isinstance(pv_weights, pmx.BoneWeightSDEF):
-                if pv_bones[0] > pv_bones[1]:
-                    pv_bones.reverse()
-                    pv_weights.weight = 1.0 - pv_weights.weight
-                    pv_weights.r0, pv_weights.r1 = pv_weights.r1, pv_weights.r0
-                vertex_group_table[pv_bones[0]].add(index=idx, weight=pv_weights.weight, type='ADD')
-                vertex_group_table[pv_bones[1]].add(index=idx, weight=1.0-pv_weights.weight, type='ADD')
-                self.__sdefVertices[i] = pv
-            elif len(pv_bones) == 1:
-                bone_index = pv_bones[0]
-                if bone_index >= 0:
-                    vertex_group_table[bone_index].add(index=idx, weight=1.0, type='ADD')
-            elif len(pv_bones) == 2:
-                vertex_group_table[pv_bones[0]].add(index=idx, weight=pv_weights[0], type='ADD')
-                vertex_group_table[pv_bones[1]].add(index=idx, weight=1.0-pv_weights[0], type='ADD')
-            elif len(pv_bones) == 4:
-                for bone, weight in zip(pv_bones, pv_weights):
-                    vertex_group_table[bone].add(index=idx, weight=weight, type='ADD')
-            else:
-                raise Exception('unkown bone weight type.')
+        edge_scale_index, vertex_order_index = vg_edge_scale.index, vg_vertex_order.index
+
+        # Writing the weights through a deform layer saves a VertexGroup.add() call for every single weight
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        deform_layer = bm.verts.layers.deform.verify()
+        for i, (v, groups, group_weights, count, edge_scale) in enumerate(zip(bm.verts, vertex_groups.tolist(), weights.tolist(),
+                weight_count.tolist(), pmx_vertices.edge_scale.clip(0.0, 1.0).tolist())):
+            dv = v[deform_layer]
+            for group, weight in zip(groups[:count], group_weights):
+                if group >= 0:
+                    dv[group] = min(dv.get(group, 0.0) + weight, 1.0)
+            dv[edge_scale_index] = edge_scale
+            dv[vertex_order_index] = i/vertex_count
+        bm.to_mesh(mesh)
+        bm.free()
 
         vg_edge_scale.lock_weight = True
         vg_vertex_order.lock_weight = True
 
+    def __basisShapeKeyCoordinates(self):
+        basis = self.__meshObj.data.shape_keys.key_blocks[0]
+        co = np.empty(len(basis.data)*3, dtype=np.float32)
+        basis.data.foreach_get('co', co)
+        return co.reshape(-1, 3)
+
     def __storeVerticesSDEF(self):
-        if len(self.__sdefVertices) < 1:
+        if self.__sdefVertices is None or len(self.__sdefVertices[0]) < 1:
             return
 
         self.__createBasisShapeKey()
-        sdefC = self.__meshObj.shape_key_add(name='mmd_sdef_c')
-        sdefR0 = self.__meshObj.shape_key_add(name='mmd_sdef_r0')
-        sdefR1 = self.__meshObj.shape_key_add(name='mmd_sdef_r1')
-        for i, pv in self.__sdefVertices.items():
-            w = pv.weight.weights
-            sdefC.data[i].co = Vector(w.c).xzy * self.__scale
-            sdefR0.data[i].co = Vector(w.r0).xzy * self.__scale
-            sdefR1.data[i].co = Vector(w.r1).xzy * self.__scale
-        logging.info('Stored %d SDEF vertices', len(self.__sdefVertices))
+        basis_co = self.__basisShapeKeyCoordinates()
+        sdef_indices, sdef_vectors = self.__sdefVertices
+        sdef_vectors = sdef_vectors[:, :, (0, 2, 1)].astype(np.float64) * self.__scale
+        for i, name in enumerate(('mmd_sdef_c', 'mmd_sdef_r0', 'mmd_sdef_r1')):
+            shapeKey = self.__meshObj.shape_key_add(name=name)
+            co = basis_co.copy()
+            co[sdef_indices] = sdef_vectors[:, i]
+            shapeKey.data.foreach_set('co', co.astype(np.float32).ravel())
+        logging.info('Stored %d SDEF vertices', len(sdef_indices))
 
     def __importTextures(self):
         pmxModel = self.__model
@@ -584,43 +597,48 @@ class PMXImporter:
         pmxModel = self.__model
         mesh = self.__meshObj.data
         vertex_map = self.__vertex_map
+        pmx_vertices = self.__pmxVertices
 
-        loop_indices_orig = tuple(i for f in pmxModel.faces for i in f)
-        loop_indices = tuple(vertex_map[i][1] for i in loop_indices_orig) if vertex_map else loop_indices_orig
-        material_indices = tuple(i for i, c in enumerate(self.__materialFaceCountTable) for x in range(c))
+        loop_indices_orig = np.array(pmxModel.faces, dtype=np.int32).reshape(-1)
+        loop_indices = np.array([x[1] for x in vertex_map], dtype=np.int32)[loop_indices_orig] if vertex_map else loop_indices_orig
+        face_count = len(loop_indices)//3
+        material_indices = np.repeat(np.arange(len(self.__materialFaceCountTable), dtype=np.int32), self.__materialFaceCountTable)
 
-        mesh.loops.add(len(pmxModel.faces)*3)
+        mesh.loops.add(len(loop_indices))
         mesh.loops.foreach_set('vertex_index', loop_indices)
 
-        mesh.polygons.add(len(pmxModel.faces))
-        mesh.polygons.foreach_set('loop_start', tuple(range(0, len(mesh.loops), 3)))
-        mesh.polygons.foreach_set('loop_total', (3,)*len(pmxModel.faces))
-        mesh.polygons.foreach_set('use_smooth', (True,)*len(pmxModel.faces))
+        mesh.polygons.add(face_count)
+        mesh.polygons.foreach_set('loop_start', np.arange(0, len(loop_indices), 3, dtype=np.int32))
+        mesh.polygons.foreach_set('loop_total', np.full(face_count, 3, dtype=np.int32))
+        mesh.polygons.foreach_set('use_smooth', np.ones(face_count, dtype=bool))
         mesh.polygons.foreach_set('material_index', material_indices)
 
+        def flipped_uv(uv):
+            uv = uv.astype(np.float64)
+            uv[:, 1] = 1.0 - uv[:, 1]
+            return uv.astype(np.float32)
+
         uv_textures, uv_layers = getattr(mesh, 'uv_textures', mesh.uv_layers), mesh.uv_layers
         uv_tex = uv_textures.new()
         uv_layer = uv_layers[uv_tex.name]
-        uv_table = {vi:self.flipUV_V(v.uv) for vi, v in enumerate(pmxModel.vertices)}
-        uv_layer.data.foreach_set('uv', tuple(v for i in loop_indices_orig for v in uv_table[i]))
+        uv_layer.data.foreach_set('uv', flipped_uv(pmx_vertices.uv)[loop_indices_orig].ravel())
 
         if hasattr(mesh, 'uv_textures'):
-            for bf, mi in zip(uv_tex.data, material_indices):
+            for bf, mi in zip(uv_tex.data, material_indices.tolist()):
                 bf.image = self.__imageTable.get(mi, None)
 
         if pmxModel.header and pmxModel.header.additional_uvs:
             logging.info('Importing %d additional uvs', pmxModel.header.additional_uvs)
             zw_data_map = collections.OrderedDict()
-            split_uvzw = lambda uvi: (self.flipUV_V(uvi[:2]), uvi[2:])
             for i in range(pmxModel.header.additional_uvs):
                 add_uv = uv_layers[uv_textures.new(name='UV'+str(i+1)).name]
                 logging.info(' - %s...(uv channels)', add_uv.name)
-                uv_table = {vi:split_uvzw(v.additional_uvs[i]) for vi, v in enumerate(pmxModel.vertices)}
-                add_uv.data.foreach_set('uv', tuple(v for i in loop_indices_orig for v in uv_table[i][0]))
-                if not any(any(s[1]) for s in uv_table.values()):
+                uvzw = pmx_vertices.additional_uvs[:, i]
+                add_uv.data.foreach_set('uv', flipped_uv(uvzw[:, :2])[loop_indices_orig].ravel())
+                if not np.any(uvzw[:, 2:]):
                     logging.info('\t- zw are all zeros: %s', add_uv.name)
                 else:
-                    zw_data_map['_'+add_uv.name] = {k:self.flipUV_V(v[1]) for k, v in uv_table.items()}
+                    zw_data_map['_'+add_uv.name] = flipped_uv(uvzw[:, 2:])
             for name, zw_table in zw_data_map.items():
                 logging.info(' - %s...(zw channels of %s)', name, name[1:])
                 add_zw = uv_textures.new(name=name)
@@ -628,7 +646,7 @@ class PMXImporter:
                     logging.warning('\t* Lost zw channels')
                     continue
                 add_zw = uv_layers[add_zw.name]
-                add_zw.data.foreach_set('uv', tuple(v for i in loop_indices_orig for v in zw_table[i]))
+                add_zw.data.foreach_set('uv', zw_table[loop_indices_orig].ravel())
 
         if bpy.app.version >= (2, 80, 0):
             self.__fixOverlappingFaceMaterials(mesh.materials, mesh.vertices, loop_indices, material_indices)
@@ -637,35 +655,49 @@ class PMXImporter:
         # This is not the best way to setup blend_method, might just work for some common cases. And FnMaterial.update_alpha() is still using 'HASHED'.
         # For EEVEE, basically users should know which blend_method is best for each material of their models.
         # For Cycles, users have to offset or delete those z-fighting faces to fix it manually.
-        check = {}
-        mi_skip = -1
-        def _rounded_co(co): return tuple(round(v, 6) for v in co)
         assert(len(loop_indices) == len(material_indices)*3)
-        for i, mi in enumerate(material_indices):
-            if mi > mi_skip:
-                si = 3*i
-                verts = tuple(sorted(_rounded_co(vertices[vi].co) for vi in loop_indices[si:si+3]))
-                if verts not in check:
-                    check[verts] = mi
-                elif check[verts] < mi:
-                    logging.debug(' >> fix blend method of material: %s', materials[mi].name)
-                    materials[mi].blend_method = 'BLEND'
-                    materials[mi].show_transparent_back = False
-                    mi_skip = mi
+        if len(material_indices) < 1:
+            return
+        co = np.empty(len(vertices)*3, dtype=np.float32)
+        vertices.foreach_get('co', co)
+        # Faces overlap when they share the same rounded vertex positions, in any order
+        _, position_ids = np.unique(np.round(co.reshape(-1, 3).astype(np.float64), 6), axis=0, return_inverse=True)
+        face_keys = np.sort(position_ids.reshape(-1)[loop_indices].reshape(-1, 3), axis=1)
+        _, face_ids = np.unique(face_keys, axis=0, return_inverse=True)
+        face_ids = face_ids.reshape(-1)
+
+        # A material has to be blended if one of its faces overlaps a face of a material before it.
+        # The faces of a material after its first overlapping face are not checked against the materials after it
+        key_materials = np.full(face_ids.max() + 1, len(materials), dtype=np.int64)
+        material_starts = np.searchsorted(material_indices, np.arange(len(materials) + 1))
+        for mi in range(len(materials)):
+            keys = face_ids[material_starts[mi]:material_starts[mi+1]]
+            overlaps = np.flatnonzero(key_materials[keys] < mi)
+            if len(overlaps):
+                keys = keys[:overlaps[0]]
+                logging.debug(' >> fix blend method of material: %s', materials[mi].name)
+                materials[mi].blend_method = 'BLEND'
+                materials[mi].show_transparent_back = False
+            key_materials[keys] = np.minimum(key_materials[keys], mi)
 
     def __importVertexMorphs(self):
         mmd_root = self.__root.mmd_root
         categories = self.CATEGORIES
         self.__createBasisShapeKey()
+        basis_co = self.__basisShapeKeyCoordinates().astype(np.float64)
         for morph in (x for x in self.__model.morphs if isinstance(x, pmx.VertexMorph)):
             shapeKey = self.__meshObj.shape_key_add(name=morph.name)
             vtx_morph = mmd_root.vertex_morphs.add()
             vtx_morph.name = morph.name
             vtx_morph.name_e = morph.name_e
             vtx_morph.category = categories.get(morph.category, 'OTHER')
-            for md in morph.offsets:
-                shapeKeyPoint = shapeKey.data[md.index]
-                shapeKeyPoint.co += Vector(md.offset).xzy * self.__scale
+            if not morph.offsets:
+                continue
+            indices = np.array([md.index for md in morph.offsets], dtype=np.int64)
+            offsets = np.array([md.offset for md in morph.offsets], dtype=np.float64).reshape(-1, 3)
+            co = basis_co.copy()
+            np.add.at(co, indices, offsets[:, (0, 2, 1)] * self.__scale) # offsets of the same vertex add up
+            shapeKey.data.foreach_set('co', co.astype(np.float32).ravel())
 
     def __importMaterialMorphs(self):
         mmd_root = self.__root.mmd_root
@@ -782,13 +814,14 @@ class PMXImporter:
             logging.info(' * No support for custom normals!!')
             return
         logging.info('Setting custom normals...')
+        normals = self.__pmxVertices.normal[:, (0, 2, 1)].astype(np.float64)
+        lengths = np.linalg.norm(normals, axis=1)
+        normals[lengths > 0] /= lengths[lengths > 0, None]
         if self.__vertex_map:
-            verts, faces = self.__model.vertices, self.__model.faces
-            custom_normals = [(Vector(verts[i].normal).xzy).normalized() for f in faces for i in f]
-            mesh.normals_split_custom_set(custom_normals)
+            custom_normals = normals[np.array(self.__model.faces, dtype=np.int64).ravel()]
+            mesh.normals_split_custom_set(custom_normals.tolist())
         else:
-            custom_normals = [(Vector(v.normal).xzy).normalized() for v in self.__model.vertices]
-            mesh.normals_split_custom_set_from_vertices(custom_normals)
+            mesh.normals_split_custom_set_from_vertices(normals.tolist())
         mesh.use_auto_smooth = True
         logging.info('   - Done!!')
 
@@ -836,27 +869,33 @@ class PMXImporter:
 
         start_time = time.time()
 
+        def timed(stage, func, *args):
+            stage_start = time.time()
+            result = func(*args)
+            logging.info(' - %s: %f seconds', stage, time.time() - stage_start)
+            return result
+
         self.__createObjects()
 
         if 'MESH' in types:
             if clean_model:
-                _PMXCleaner.clean(self.__model, 'MORPHS' not in types)
+                timed('clean model', _PMXCleaner.clean, self.__model, 'MORPHS' not in types)
             if remove_doubles:
-                self.__vertex_map = _PMXCleaner.remove_doubles(self.__model, 'MORPHS' not in types)
+                self.__vertex_map = timed('remove doubles', _PMXCleaner.remove_doubles, self.__model, 'MORPHS' not in types)
             self.__createMeshObject()
-            self.__importVertices()
-            self.__importMaterials()
-            self.__importFaces()
+            timed('vertices', self.__importVertices)
+            timed('materials', self.__importMaterials)
+            timed('faces', self.__importFaces)
             self.__meshObj.data.update()
-            self.__assignCustomNormals()
-            self.__storeVerticesSDEF()
+            timed('custom normals', self.__assignCustomNormals)
+            timed('SDEF vertices', self.__storeVerticesSDEF)
 
         if 'ARMATURE' in types:
             # for tracking bone order
             if 'MESH' not in types:
                 self.__createMeshObject()
                 self.__importVertexGroup()
-            self.__importBones()
+            timed('bones', self.__importBones)
             if args.get('rename_LR_bones', False):
                 use_underscore = args.get('use_underscore', False)
                 self.__renameLRBones(use_underscore)
@@ -867,8 +906,8 @@ class PMXImporter:
             FnBone.apply_additional_transformation(self.__armObj)
 
         if 'PHYSICS' in types:
-            self.__importRigids()
-            self.__importJoints()
+            timed('rigid bodies', self.__importRigids)
+            timed('joints', self.__importJoints)
 
         if 'DISPLAY' in types:
             self.__importDisplayFrames()
@@ -876,11 +915,11 @@ class PMXImporter:
             self.__rig.initialDisplayFrames()
 
         if 'MORPHS' in types:
-            self.__importGroupMorphs()
-            self.__importVertexMorphs()
-            self.__importBoneMorphs()
-            self.__importMaterialMorphs()
-            self.__importUVMorphs()
+            timed('group morphs', self.__importGroupMorphs)
+            timed('vertex morphs', self.__importVertexMorphs)
+            timed('bone morphs', self.__importBoneMorphs)
+            timed('material morphs', self.__importMaterialMorphs)
+            timed('uv morphs', self.__importUVMorphs)
 
         if self.__meshObj:
             self.__addArmatureModifier(self.__meshObj, self.__armObj)
@@ -905,28 +944,27 @@ class _PMXCleaner:
     def clean(cls, pmx_model, mesh_only):
         logging.info('Cleaning PMX data...')
         pmx_faces = pmx_model.faces
-        pmx_vertices = pmx_model.vertices
+        vertex_count = pmx_model.vertexCount()
 
         # clean face/vertex
-        cls.__clean_pmx_faces(pmx_faces, pmx_model.materials, lambda f: frozenset(f))
+        faces = np.array(pmx_faces, dtype=np.int64).reshape(-1, 3)
+        face_keys = np.sort(faces, axis=1)
+        is_valid = (face_keys[:, 0] != face_keys[:, 1]) & (face_keys[:, 1] != face_keys[:, 2])
+        faces = cls.__clean_pmx_faces(pmx_faces, pmx_model.materials, faces, face_keys, is_valid)
 
-        index_map = {v:v for f in pmx_faces for v in f}
-        is_index_clean = len(index_map) == len(pmx_vertices)
+        used_vertices = np.flatnonzero(np.bincount(faces.ravel(), minlength=vertex_count))
+        is_index_clean = len(used_vertices) == vertex_count
         if is_index_clean:
             logging.info('   (vertices is clean)')
         else:
-            new_vertex_count = 0
-            for v in sorted(index_map):
-                if v != new_vertex_count:
-                    pmx_vertices[new_vertex_count] = pmx_vertices[v]
-                    index_map[v] = new_vertex_count
-                new_vertex_count += 1
-            logging.warning('   - removed %d vertices', len(pmx_vertices)-new_vertex_count)
-            del pmx_vertices[new_vertex_count:]
+            logging.warning('   - removed %d vertices', vertex_count-len(used_vertices))
+            pmx_model.setVertexArrays(pmx_model.vertexArrays().take(used_vertices))
 
             # update vertex indices of faces
-            for f in pmx_faces:
-                f[:] = [index_map[v] for v in f]
+            index_map = np.full(vertex_count, -1, dtype=np.int64)
+            index_map[used_vertices] = np.arange(len(used_vertices))
+            faces = index_map[faces]
+        pmx_faces[:] = faces.tolist()
 
         if mesh_only:
             logging.info('   - Done (mesh only)!!')
@@ -934,6 +972,7 @@ class _PMXCleaner:
 
         if not is_index_clean:
             # clean vertex/uv morphs
+            index_map = dict(zip(used_vertices.tolist(), range(len(used_vertices))))
             def __update_index(x):
                 x.index = index_map.get(x.index, None)
                 return x.index is not None
@@ -943,38 +982,39 @@ class _PMXCleaner:
     @classmethod
     def remove_doubles(cls, pmx_model, mesh_only):
         logging.info('Removing doubles...')
-        pmx_vertices = pmx_model.vertices
+        pmx_vertices = pmx_model.vertexArrays()
+        vertex_count = len(pmx_vertices)
 
-        vertex_map = [None] * len(pmx_vertices)
-        # gather vertex data
-        for i, v in enumerate(pmx_vertices):
-            vertex_map[i] = [tuple(v.co)]
+        # gather vertex data, vertices are merged if their coordinates and the offsets of all morphs touching them are equal
+        vertex_keys = [(pmx_vertices.co + np.float32(0)).view(np.uint32).astype(np.uint64)] # -0.0 == 0.0
         if not mesh_only:
-            for m in pmx_model.morphs:
-                if not isinstance(m, pmx.VertexMorph) and not isinstance(m, pmx.UVMorph):
-                    continue
-                for x in m.offsets:
-                    vertex_map[x.index].append(tuple(x.offset))
-        # generate vertex merging table
-        keys = {}
-        for i, v in enumerate(vertex_map):
-            k = tuple(v)
-            if k in keys:
-                vertex_map[i] = keys[k] # merge pmx_vertices[i] to pmx_vertices[keys[k][0]]
-            else:
-                vertex_map[i] = keys[k] = (i, len(keys)) # (pmx index, blender index)
-        counts = len(vertex_map) - len(keys)
-        keys.clear()
+            vertex_keys.extend(cls.__hash_morph_offsets(pmx_model.morphs, vertex_count))
+        vertex_keys = np.column_stack(vertex_keys) if vertex_count else np.zeros((0, 3), dtype=np.uint64)
+
+        # generate vertex merging table, (pmx index, blender index) for every vertex
+        first_indices, key_indices = cls.__unique_rows(vertex_keys)
+        blender_indices = np.empty(len(first_indices), dtype=np.int64)
+        blender_indices[np.argsort(first_indices)] = np.arange(len(first_indices))
+        merged_indices = first_indices[key_indices]
+        vertex_map = list(zip(merged_indices.tolist(), blender_indices[key_indices].tolist()))
+
+        counts = vertex_count - len(first_indices)
         if counts:
             logging.warning('   - %d vertices will be removed', counts)
         else:
             logging.info('   - Done (no changes)!!')
             return None
 
-        # clean face
-        #face_key_func = lambda f: frozenset(vertex_map[x][0] for x in f)
-        face_key_func = lambda f: frozenset({vertex_map[x][0]:tuple(pmx_vertices[x].uv) for x in f}.items())
-        cls.__clean_pmx_faces(pmx_model.faces, pmx_model.materials, face_key_func)
+        # clean face, faces of merged vertices are only equal if the UVs of their vertices are equal too
+        faces = np.array(pmx_model.faces, dtype=np.int64).reshape(-1, 3)
+        _, uv_indices = cls.__unique_rows((pmx_vertices.uv + np.float32(0)).view(np.uint32))
+        merged_faces, face_uvs = merged_indices[faces], uv_indices[faces]
+        order = np.argsort(merged_faces, axis=1, kind='stable')
+        rows = np.arange(len(order))[:, None]
+        merged_faces = merged_faces[rows, order]
+        face_keys = np.column_stack((merged_faces, face_uvs[rows, order]))
+        is_valid = (merged_faces[:, 0] != merged_faces[:, 1]) & (merged_faces[:, 1] != merged_faces[:, 2])
+        pmx_model.faces[:] = cls.__clean_pmx_faces(pmx_model.faces, pmx_model.materials, faces, face_keys, is_valid).tolist()
 
         if mesh_only:
             logging.info('   - Done (mesh only)!!')
@@ -988,32 +1028,82 @@ class _PMXCleaner:
             logging.info('   - Done!!')
         return vertex_map
 
+    @staticmethod
+    def __unique_rows(keys):
+        """ Returns the index of the first row of every distinct row and the id of the distinct row of every row
+        """
+        order = np.lexsort(keys.T[::-1])
+        sorted_keys = keys[order]
+        is_first = np.ones(len(keys), dtype=bool)
+        is_first[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+        row_ids = np.empty(len(keys), dtype=np.int64)
+        row_ids[order] = np.cumsum(is_first) - 1
+        return order[is_first], row_ids
 
     @staticmethod
-    def __clean_pmx_faces(pmx_faces, pmx_materials, face_key_func):
-        new_face_count = 0
-        face_iter = iter(pmx_faces)
-        for mat in pmx_materials:
-            used_faces = set()
-            new_vertex_count = 0
-            for i in range(int(mat.vertex_count/3)):
-                f = next(face_iter)
-
-                f_key = face_key_func(f)
-                if len(f_key) != 3 or f_key in used_faces:
-                    continue
-                used_faces.add(f_key)
-
-                pmx_faces[new_face_count] = list(f)
-                new_face_count += 1
-                new_vertex_count += 3
-            mat.vertex_count = new_vertex_count
-        face_iter = None
-        if new_face_count == len(pmx_faces):
+    def __hash_morph_offsets(pmx_morphs, vertex_count):
+        """ Returns the number of vertex/uv morph offsets of every vertex and two independent 64 bit hashes of them
+        The hashes depend on the order of the offsets, just like comparing the lists of offsets of the vertices would
+        """
+        def __mix(x): # splitmix64 finalizer
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+            return x ^ (x >> np.uint64(31))
+
+        counts = np.zeros(vertex_count, dtype=np.uint64)
+        hashes = (np.zeros(vertex_count, dtype=np.uint64), np.zeros(vertex_count, dtype=np.uint64))
+        seeds = (np.uint64(0x9e3779b97f4a7c15), np.uint64(0x632be59bd9b4e019))
+        for m in pmx_morphs:
+            if not isinstance(m, pmx.VertexMorph) and not isinstance(m, pmx.UVMorph):
+                continue
+            if not m.offsets:
+                continue
+            indices = np.array([x.index for x in m.offsets], dtype=np.int64)
+            offsets = np.array([x.offset for x in m.offsets], dtype=np.float32).reshape(len(indices), -1) + np.float32(0) # -0.0 == 0.0
+            offset_bits = offsets.view(np.uint32).astype(np.uint64)
+
+            # the offsets of a vertex have to be added in order, so vertices with multiple offsets in one morph take turns
+            order = np.argsort(indices, kind='stable')
+            sorted_indices = indices[order]
+            group_starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+            ranks = np.empty(len(indices), dtype=np.int64)
+            ranks[order] = np.arange(len(indices)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(indices)]))
+
+            for h, seed in zip(hashes, seeds):
+                offset_hash = __mix(np.full(len(indices), offset_bits.shape[1], dtype=np.uint64) ^ seed)
+                for column in offset_bits.T:
+                    offset_hash = __mix(offset_hash ^ column)
+                for rank in range(ranks.max() + 1):
+                    selected = ranks == rank
+                    selected_indices = indices[selected]
+                    h[selected_indices] = __mix(h[selected_indices] ^ offset_hash[selected])
+            np.add.at(counts, indices, np.uint64(1))
+        return (counts,) + hashes
+
+    @classmethod
+    def __clean_pmx_faces(cls, pmx_faces, pmx_materials, faces, face_keys, is_valid):
+        """ Removes invalid faces and faces with the same key as a face before them in the same material
+        Updates the vertex counts of the materials and returns the remaining faces
+        """
+        face_counts = [int(mat.vertex_count/3) for mat in pmx_materials]
+        material_indices = np.repeat(np.arange(len(face_counts)), face_counts)[:len(faces)]
+        face_count = len(material_indices)
+
+        first_faces, _ = cls.__unique_rows(np.column_stack((material_indices, face_keys[:face_count])))
+        is_kept = np.zeros(face_count, dtype=bool)
+        is_kept[first_faces] = True
+        is_kept &= is_valid[:face_count]
+
+        new_face_counts = np.bincount(material_indices[is_kept], minlength=len(face_counts))
+        for mat, count in zip(pmx_materials, new_face_counts.tolist()):
+            mat.vertex_count = count*3
+
+        faces = faces[:face_count][is_kept]
+        if len(faces) == len(pmx_faces):
             logging.info('   (faces is clean)')
         else:
-            logging.warning('   - removed %d faces', len(pmx_faces)-new_face_count)
-            del pmx_faces[new_face_count:]
+            logging.warning('   - removed %d faces', len(pmx_faces)-len(faces))
+        return faces
 
     @staticmethod
     def __clean_pmx_morphs(pmx_morphs, index_update_func):
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import bpy
 from mathutils import Vector, Matrix, Quaternion
+import numpy as np
 import time
 
+from collections import OrderedDict
 from mmd_tools_local.bpyutils import matmul
 
 
@@ -15,39 +17,64 @@ def _hash(v):
         raise NotImplementedError('hash')
 
 
+class _SDEFCache:
+    """ The cached SDEF data of a mesh object, which is rebuilt when the signature of the object changes
+    """
+    def __init__(self, name, signature, vertices):
+        self.name = name
+        self.signature = signature
+        self.vertices = vertices # {(group0, group1): (bone0_name, bone1_name, sdef_data, vids)}
+        self.bone_names = {name for data in vertices.values() for name in data[:2]}
+        self.shapekey_data = None
+        self.bone_matrices = {} # {bone_name: matrix of the last update}
+        self.sdef_mute = None
+
+    def moved_bones(self, pose_bones):
+        """ Returns the names of the bones which moved since the last call
+        """
+        moved = set()
+        bone_matrices = self.bone_matrices
+        for name in self.bone_names:
+            matrix = pose_bones[name].matrix
+            if bone_matrices.get(name) != matrix:
+                bone_matrices[name] = matrix.copy()
+                moved.add(name)
+        return moved
+
+
 class FnSDEF():
-    g_verts = {} # global cache
-    g_shapekey_data = {}
-    g_bone_check = {}
-    __g_armature_check = {}
+    g_cache = OrderedDict() # global cache, least recently used first
+    MAX_CACHE_SIZE = 32
     SHAPEKEY_NAME = 'mmd_sdef_skinning'
     MASK_NAME = 'mmd_sdef_mask'
 
     def __init__(self):
         raise NotImplementedError('not allowed')
 
-    @classmethod
-    def __init_cache(cls, obj, shapekey):
-        key = _hash(obj)
-        obj = getattr(obj, 'original', obj)
+    @staticmethod
+    def __signature(obj):
         mod = obj.modifiers.get('mmd_bone_order_override')
         key_armature = _hash(mod.object.pose) if mod and mod.type == 'ARMATURE' and mod.object else None
-        if key not in cls.g_verts or cls.__g_armature_check.get(key) != key_armature:
-            cls.g_verts[key] = cls.__find_vertices(obj)
-            cls.g_bone_check[key] = {}
-            cls.__g_armature_check[key] = key_armature
-            cls.g_shapekey_data[key] = None
-            return True
-        return False
+        key_blocks = getattr(obj.data.shape_keys, 'key_blocks', ())
+        # edits are only written to the mesh when leaving edit mode, which changes the signature again
+        return (key_armature, obj.data.name, obj.mode == 'EDIT', len(obj.data.vertices), len(obj.vertex_groups),
+                tuple(kb.name for kb in key_blocks))
 
     @classmethod
-    def __check_bone_update(cls, obj, bone0, bone1):
-        check = cls.g_bone_check[_hash(obj)]
-        key = (_hash(bone0), _hash(bone1))
-        if key not in check or (bone0.matrix, bone1.matrix) != check[key]:
-            check[key] = (bone0.matrix.copy(), bone1.matrix.copy())
-            return True
-        return False
+    def __get_cache(cls, obj):
+        key = _hash(obj)
+        obj = getattr(obj, 'original', obj)
+        signature = cls.__signature(obj)
+        cache = cls.g_cache.get(key)
+        if cache is None or cache.signature != signature:
+            # drop the data of deleted and renamed objects
+            for k in [k for k, v in cls.g_cache.items() if v.name not in bpy.data.objects]:
+                del cls.g_cache[k]
+            cache = cls.g_cache[key] = _SDEFCache(obj.name, signature, cls.__find_vertices(obj))
+        cls.g_cache.move_to_end(key)
+        while len(cls.g_cache) > cls.MAX_CACHE_SIZE:
+            cls.g_cache.popitem(last=False)
+        return cache
 
     @classmethod
     def mute_sdef_set(cls, obj, mute):
@@ -56,22 +83,21 @@ class FnSDEF():
             shapekey = key_blocks[cls.SHAPEKEY_NAME]
             shapekey.mute = mute
             if cls.has_sdef_data(obj):
-                cls.__init_cache(obj, shapekey)
-                cls.__sdef_muted(obj, shapekey)
+                cls.__sdef_muted(obj, shapekey, cls.__get_cache(obj))
 
     @classmethod
-    def __sdef_muted(cls, obj, shapekey):
+    def __sdef_muted(cls, obj, shapekey, cache):
         mute = shapekey.mute
-        if mute != cls.g_bone_check[_hash(obj)].get('sdef_mute'):
+        if mute != cache.sdef_mute:
             mod = obj.modifiers.get('mmd_bone_order_override')
             if mod and mod.type == 'ARMATURE':
                 if not mute and cls.MASK_NAME not in obj.vertex_groups and obj.mode != 'EDIT':
-                    mask = tuple(i for v in cls.g_verts[_hash(obj)].values() for i in v[3])
+                    mask = tuple(i for v in cache.vertices.values() for i in v[3].tolist())
                     obj.vertex_groups.new(name=cls.MASK_NAME).add(mask, 1, 'REPLACE')
                 mod.vertex_group = '' if mute else cls.MASK_NAME
                 mod.invert_vertex_group = True
                 shapekey.vertex_group = cls.MASK_NAME
-            cls.g_bone_check[_hash(obj)]['sdef_mute'] = mute
+            cache.sdef_mute = mute
         return mute
 
     @staticmethod
@@ -87,38 +113,72 @@ class FnSDEF():
         if not cls.has_sdef_data(obj):
             return {}
 
-        vertices = {}
         pose_bones = obj.modifiers.get('mmd_bone_order_override').object.pose.bones
-        bone_map = {g.index:pose_bones[g.name] for g in obj.vertex_groups if g.name in pose_bones}
-        sdef_c = obj.data.shape_keys.key_blocks['mmd_sdef_c'].data
-        sdef_r0 = obj.data.shape_keys.key_blocks['mmd_sdef_r0'].data
-        sdef_r1 = obj.data.shape_keys.key_blocks['mmd_sdef_r1'].data
+        bone_map = {g.index:g.name for g in obj.vertex_groups if g.name in pose_bones}
+        key_blocks = obj.data.shape_keys.key_blocks
         vd = obj.data.vertices
 
-        for i in range(len(sdef_c)):
-            if vd[i].co != sdef_c[i].co:
-                bgs = [g for g in vd[i].groups if g.group in bone_map and g.weight] # bone groups
-                if len(bgs) >= 2:
-                    bgs.sort(key=lambda x: x.group)
-                    # preprocessing
-                    w0, w1 = bgs[0].weight, bgs[1].weight
-                    # w0 + w1 == 1
-                    w0 = w0 / (w0 + w1)
-                    w1 = 1 - w0
-
-                    c, r0, r1 = sdef_c[i].co, sdef_r0[i].co, sdef_r1[i].co
-                    rw = r0 * w0 + r1 * w1
-                    r0 = c + r0 - rw
-                    r1 = c + r1 - rw
-
-                    key = (bgs[0].group, bgs[1].group)
-                    if key not in vertices:
-                        #TODO basically we can not cache any bone reference
-                        vertices[key] = (bone_map[bgs[0].group], bone_map[bgs[1].group], [], [])
-                    vertices[key][2].append((i, w0, w1, vd[i].co-c, (c+r0)/2, (c+r1)/2))
-                    vertices[key][3].append(i)
+        def __get_co(data):
+            co = np.empty(len(data)*3, dtype=np.float32)
+            data.foreach_get('co', co)
+            return co.reshape(-1, 3).astype(np.float64)
+        sdef_c = __get_co(key_blocks['mmd_sdef_c'].data)
+        sdef_r0 = __get_co(key_blocks['mmd_sdef_r0'].data)
+        sdef_r1 = __get_co(key_blocks['mmd_sdef_r1'].data)
+        co = __get_co(vd)[:len(sdef_c)]
+
+        pairs = {}
+        for i in np.flatnonzero(np.any(co != sdef_c, axis=1)).tolist():
+            bgs = [g for g in vd[i].groups if g.group in bone_map and g.weight] # bone groups
+            if len(bgs) >= 2:
+                bgs.sort(key=lambda x: x.group)
+                key = (bgs[0].group, bgs[1].group)
+                pairs.setdefault(key, []).append((i, bgs[0].weight, bgs[1].weight))
+
+        # preprocessing, the data of each bone pair is stored as arrays of (w0, w1, pos_c, cr0, cr1) and the vertex ids
+        vertices = {}
+        for key, pair_vertices in pairs.items():
+            vids, w0, w1 = (np.array(x) for x in zip(*pair_vertices))
+            # w0 + w1 == 1
+            w0 = w0 / (w0 + w1)
+            w1 = 1 - w0
+
+            c, r0, r1 = sdef_c[vids], sdef_r0[vids], sdef_r1[vids]
+            rw = r0 * w0[:, None] + r1 * w1[:, None]
+            r0 = c + r0 - rw
+            r1 = c + r1 - rw
+
+            vertices[key] = (bone_map[key[0]], bone_map[key[1]], (w0, w1, co[vids]-c, (c+r0)/2, (c+r1)/2), vids)
         return vertices
 
+    @staticmethod
+    def __skinning(bone0, bone1, sdef_data, use_scale):
+        """ Returns the SDEF positions of all vertices of a bone pair
+        """
+        mat0 = matmul(bone0.matrix, bone0.bone.matrix_local.inverted())
+        mat1 = matmul(bone1.matrix, bone1.bone.matrix_local.inverted())
+        # workaround some weird result of matrix.to_quaternion() using to_euler(), but still minor issues
+        rot0 = mat0.to_euler('YXZ').to_quaternion()
+        rot1 = mat1.to_euler('YXZ').to_quaternion()
+        if rot1.dot(rot0) < 0:
+            rot1 = -rot1
+
+        w0, w1, pos_c, cr0, cr1 = sdef_data
+        # blended rotations (w, x, y, z) of all vertices
+        rot = np.outer(w0, rot0) + np.outer(w1, rot1)
+        rot /= np.linalg.norm(rot, axis=1)[:, None]
+        if use_scale:
+            pos_c = pos_c * (np.outer(w0, mat0.to_scale()) + np.outer(w1, mat1.to_scale()))
+
+        # rotate pos_c by the quaternions: v + w*t + q x t, t = 2 * q x v
+        t = 2 * np.cross(rot[:, 1:], pos_c)
+        pos = pos_c + rot[:, :1] * t + np.cross(rot[:, 1:], t)
+
+        mat0, mat1 = np.array(mat0), np.array(mat1)
+        pos += (np.dot(cr0, mat0[:3, :3].T) + mat0[:3, 3]) * w0[:, None]
+        pos += (np.dot(cr1, mat1[:3, :3].T) + mat1[:3, 3]) * w1[:, None]
+        return pos
+
     @classmethod
     def driver_function_wrap(cls, obj_name, bulk_update, use_skip, use_scale):
         obj = bpy.data.objects[obj_name]
@@ -133,83 +193,29 @@ class FnSDEF():
             #cls.driver_function(shapekey.id_data.original.key_blocks[shapekey.name], obj_name, bulk_update, use_skip, use_scale) # update original data
             data_path = shapekey.path_from_id('value')
             obj = next(i for i in shapekey.id_data.animation_data.drivers if i.data_path == data_path).driver.variables['obj'].targets[0].id
-        cls.__init_cache(obj, shapekey)
-        if cls.__sdef_muted(obj, shapekey):
+        cache = cls.__get_cache(obj)
+        if cls.__sdef_muted(obj, shapekey, cache):
             return 0.0
 
         pose_bones = obj.modifiers.get('mmd_bone_order_override').object.pose.bones
+        moved_bones = cache.moved_bones(pose_bones) if use_skip else None
         if not bulk_update:
             shapekey_data = shapekey.data
-            if use_scale:
-                # with scale
-                for bone0, bone1, sdef_data, vids in cls.g_verts[_hash(obj)].values():
-                    bone0, bone1 = pose_bones[bone0.name], pose_bones[bone1.name]
-                    if use_skip and not cls.__check_bone_update(obj, bone0, bone1):
-                        continue
-                    mat0 = matmul(bone0.matrix, bone0.bone.matrix_local.inverted())
-                    mat1 = matmul(bone1.matrix, bone1.bone.matrix_local.inverted())
-                    rot0 = mat0.to_euler('YXZ').to_quaternion()
-                    rot1 = mat1.to_euler('YXZ').to_quaternion()
-                    if rot1.dot(rot0) < 0:
-                        rot1 = -rot1
-                    s0, s1 = mat0.to_scale(), mat1.to_scale()
-                    for vid, w0, w1, pos_c, cr0, cr1 in sdef_data:
-                        s = s0*w0 + s1*w1
-                        mat_rot = matmul((rot0*w0 + rot1*w1).normalized().to_matrix(), Matrix([(s[0],0,0), (0,s[1],0), (0,0,s[2])]))
-                        shapekey_data[vid].co = matmul(mat_rot, pos_c) + matmul(mat0, cr0)*w0 + matmul(mat1, cr1)*w1
-            else:
-                # default
-                for bone0, bone1, sdef_data, vids in cls.g_verts[_hash(obj)].values():
-                    bone0, bone1 = pose_bones[bone0.name], pose_bones[bone1.name]
-                    if use_skip and not cls.__check_bone_update(obj, bone0, bone1):
-                        continue
-                    mat0 = matmul(bone0.matrix, bone0.bone.matrix_local.inverted())
-                    mat1 = matmul(bone1.matrix, bone1.bone.matrix_local.inverted())
-                    # workaround some weird result of matrix.to_quaternion() using to_euler(), but still minor issues
-                    rot0 = mat0.to_euler('YXZ').to_quaternion()
-                    rot1 = mat1.to_euler('YXZ').to_quaternion()
-                    if rot1.dot(rot0) < 0:
-                        rot1 = -rot1
-                    for vid, w0, w1, pos_c, cr0, cr1 in sdef_data:
-                        mat_rot = (rot0*w0 + rot1*w1).normalized().to_matrix()
-                        shapekey_data[vid].co = matmul(mat_rot, pos_c) + matmul(mat0, cr0)*w0 + matmul(mat1, cr1)*w1
+            for bone0, bone1, sdef_data, vids in cache.vertices.values():
+                if use_skip and bone0 not in moved_bones and bone1 not in moved_bones:
+                    continue
+                for vid, co in zip(vids.tolist(), cls.__skinning(pose_bones[bone0], pose_bones[bone1], sdef_data, use_scale).tolist()):
+                    shapekey_data[vid].co = co
         else: # bulk update
-            shapekey_data = cls.g_shapekey_data[_hash(obj)]
+            shapekey_data = cache.shapekey_data
             if shapekey_data is None:
-                import numpy as np
                 shapekey_data = np.zeros(len(shapekey.data)*3, dtype=np.float32)
                 shapekey.data.foreach_get('co', shapekey_data)
-                shapekey_data = cls.g_shapekey_data[_hash(obj)] = shapekey_data.reshape(len(shapekey.data), 3)
-            if use_scale:
-                # scale & bulk update
-                for bone0, bone1, sdef_data, vids in cls.g_verts[_hash(obj)].values():
-                    bone0, bone1 = pose_bones[bone0.name], pose_bones[bone1.name]
-                    if use_skip and not cls.__check_bone_update(obj, bone0, bone1):
-                        continue
-                    mat0 = matmul(bone0.matrix, bone0.bone.matrix_local.inverted())
-                    mat1 = matmul(bone1.matrix, bone1.bone.matrix_local.inverted())
-                    rot0 = mat0.to_euler('YXZ').to_quaternion()
-                    rot1 = mat1.to_euler('YXZ').to_quaternion()
-                    if rot1.dot(rot0) < 0:
-                        rot1 = -rot1
-                    s0, s1 = mat0.to_scale(), mat1.to_scale()
-                    def scale(mat_rot, w0, w1):
-                        s = s0*w0 + s1*w1
-                        return matmul(mat_rot, Matrix([(s[0],0,0), (0,s[1],0), (0,0,s[2])]))
-                    shapekey_data[vids] = [matmul(scale((rot0*w0 + rot1*w1).normalized().to_matrix(), w0, w1), pos_c) + matmul(mat0, cr0)*w0 + matmul(mat1, cr1)*w1 for vid, w0, w1, pos_c, cr0, cr1 in sdef_data]
-            else:
-                # bulk update
-                for bone0, bone1, sdef_data, vids in cls.g_verts[_hash(obj)].values():
-                    bone0, bone1 = pose_bones[bone0.name], pose_bones[bone1.name]
-                    if use_skip and not cls.__check_bone_update(obj, bone0, bone1):
-                        continue
-                    mat0 = matmul(bone0.matrix, bone0.bone.matrix_local.inverted())
-                    mat1 = matmul(bone1.matrix, bone1.bone.matrix_local.inverted())
-                    rot0 = mat0.to_euler('YXZ').to_quaternion()
-                    rot1 = mat1.to_euler('YXZ').to_quaternion()
-                    if rot1.dot(rot0) < 0:
-                        rot1 = -rot1
-                    shapekey_data[vids] = [matmul((rot0*w0 + rot1*w1).normalized().to_matrix(), pos_c) + matmul(mat0, cr0)*w0 + matmul(mat1, cr1)*w1 for vid, w0, w1, pos_c, cr0, cr1 in sdef_data]
+                shapekey_data = cache.shapekey_data = shapekey_data.reshape(len(shapekey.data), 3)
+            for bone0, bone1, sdef_data, vids in cache.vertices.values():
+                if use_skip and bone0 not in moved_bones and bone1 not in moved_bones:
+                    continue
+                shapekey_data[vids] = cls.__skinning(pose_bones[bone0], pose_bones[bone1], sdef_data, use_scale)
             shapekey.data.foreach_set('co', shapekey_data.reshape(3 * len(shapekey.data)))
 
         return 1.0 # shapkey value
@@ -248,8 +254,8 @@ class FnSDEF():
             return False
         # Create the shapekey for the driver
         shapekey = obj.shape_key_add(name=cls.SHAPEKEY_NAME, from_mix=False)
-        cls.__init_cache(obj, shapekey)
-        cls.__sdef_muted(obj, shapekey)
+        cache = cls.__get_cache(obj)
+        cls.__sdef_muted(obj, shapekey, cache)
         cls.register_driver_function()
         if bulk_update is None:
             bulk_update = cls.__get_benchmark_result(obj, shapekey, use_scale, use_skip)
@@ -268,7 +274,7 @@ class FnSDEF():
                 use_skip = False
             mod = obj.modifiers.get('mmd_bone_order_override')
             variables = f.driver.variables
-            for name in set(data[i].name for data in cls.g_verts[_hash(obj)].values() for i in range(2)): # add required bones for dependency graph
+            for name in set(data[i] for data in cache.vertices.values() for i in range(2)): # add required bones for dependency graph
                 var = variables.new()
                 var.type = 'TRANSFORMS'
                 var.targets[0].id = mod.object
@@ -301,21 +307,11 @@ class FnSDEF():
     def clear_cache(cls, obj=None, unused_only=False):
         if unused_only:
             valid_keys = set(_hash(i) for i in bpy.data.objects if i.type == 'MESH' and i != obj)
-            for key in (cls.g_verts.keys()-valid_keys):
-                del cls.g_verts[key]
-            for key in (cls.g_shapekey_data.keys()-cls.g_verts.keys()):
-                del cls.g_shapekey_data[key]
-            for key in (cls.g_bone_check.keys()-cls.g_verts.keys()):
-                del cls.g_bone_check[key]
+            for key in (cls.g_cache.keys()-valid_keys):
+                del cls.g_cache[key]
         elif obj:
             key = _hash(obj)
-            if key in cls.g_verts:
-                del cls.g_verts[key]
-            if key in cls.g_shapekey_data:
-                del cls.g_shapekey_data[key]
-            if key in cls.g_bone_check:
-                del cls.g_bone_check[key]
+            if key in cls.g_cache:
+                del cls.g_cache[key]
         else:
-            cls.g_verts = {}
-            cls.g_bone_check = {}
-            cls.g_shapekey_data = {}
+            cls.g_cache.clear()
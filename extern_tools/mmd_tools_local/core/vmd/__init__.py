@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import struct
 import collections
+import mmap
+
+import numpy as np
 
 class InvalidFileError(Exception):
     pass
@@ -34,6 +37,13 @@ class Header:
 
 
 class BoneFrameKey:
+    DTYPE = np.dtype([
+        ('frame_number', '<u4'),
+        ('location', '<f4', 3),
+        ('rotation', '<f4', 4),
+        ('interp', 'i1', 64),
+        ])
+
     def __init__(self):
         self.frame_number = 0
         self.location = []
@@ -48,6 +58,23 @@ class BoneFrameKey:
             self.rotation = (0, 0, 0, 1)
         self.interp = list(struct.unpack('<64b', fin.read(64)))
 
+    @staticmethod
+    def fixRecords(records):
+        rotation = records['rotation']
+        rotation[~rotation.any(axis=1)] = (0, 0, 0, 1)
+
+    @classmethod
+    def fromRecords(cls, records):
+        frameKeys = []
+        for frame_number, location, rotation, interp in zip(*(records[i].tolist() for i in cls.DTYPE.names)):
+            frameKey = cls()
+            frameKey.frame_number = frame_number
+            frameKey.location = location
+            frameKey.rotation = rotation
+            frameKey.interp = interp
+            frameKeys.append(frameKey)
+        return frameKeys
+
     def save(self, fin):
         fin.write(struct.pack('<L', self.frame_number))
         fin.write(struct.pack('<fff', *self.location))
@@ -63,6 +90,11 @@ class BoneFrameKey:
 
 
 class ShapeKeyFrameKey:
+    DTYPE = np.dtype([
+        ('frame_number', '<u4'),
+        ('weight', '<f4'),
+        ])
+
     def __init__(self):
         self.frame_number = 0
         self.weight = 0.0
@@ -71,6 +103,20 @@ class ShapeKeyFrameKey:
         self.frame_number, = struct.unpack('<L', fin.read(4))
         self.weight, = struct.unpack('<f', fin.read(4))
 
+    @staticmethod
+    def fixRecords(records):
+        pass
+
+    @classmethod
+    def fromRecords(cls, records):
+        frameKeys = []
+        for frame_number, weight in zip(*(records[i].tolist() for i in cls.DTYPE.names)):
+            frameKey = cls()
+            frameKey.frame_number = frame_number
+            frameKey.weight = weight
+            frameKeys.append(frameKey)
+        return frameKeys
+
     def save(self, fin):
         fin.write(struct.pack('<L', self.frame_number))
         fin.write(struct.pack('<f', self.weight))
@@ -83,6 +129,16 @@ class ShapeKeyFrameKey:
 
 
 class CameraKeyFrameKey:
+    DTYPE = np.dtype([
+        ('frame_number', '<u4'),
+        ('distance', '<f4'),
+        ('location', '<f4', 3),
+        ('rotation', '<f4', 3),
+        ('interp', 'i1', 24),
+        ('angle', '<u4'),
+        ('persp', 'i1'),
+        ])
+
     def __init__(self):
         self.frame_number = 0
         self.distance = 0.0
@@ -102,6 +158,25 @@ class CameraKeyFrameKey:
         self.persp, = struct.unpack('<b', fin.read(1))
         self.persp = (self.persp == 0)
 
+    @staticmethod
+    def fixRecords(records):
+        pass
+
+    @classmethod
+    def fromRecords(cls, records):
+        frameKeys = []
+        for frame_number, distance, location, rotation, interp, angle, persp in zip(*(records[i].tolist() for i in cls.DTYPE.names)):
+            frameKey = cls()
+            frameKey.frame_number = frame_number
+            frameKey.distance = distance
+            frameKey.location = location
+            frameKey.rotation = rotation
+            frameKey.interp = interp
+            frameKey.angle = angle
+            frameKey.persp = (persp == 0)
+            frameKeys.append(frameKey)
+        return frameKeys
+
     def save(self, fin):
         fin.write(struct.pack('<L', self.frame_number))
         fin.write(struct.pack('<f', self.distance))
@@ -225,6 +300,49 @@ class _AnimationBase(collections.defaultdict):
             frameKey.load(fin)
             self[name].append(frameKey)
 
+    @classmethod
+    def loadRecords(cls, fin):
+        """ Read the section as a dict of {name: records of frameClass().DTYPE} in file order
+        """
+        frameClass = cls.frameClass()
+        dtype = np.dtype([('name', 'S15'), ('key', frameClass.DTYPE)])
+        count, = struct.unpack('<L', fin.read(4))
+        print('loading %s... %d'%(cls.__name__, count))
+        data = fin.read(count*dtype.itemsize)
+        records = np.frombuffer(data, dtype=dtype, count=len(data)//dtype.itemsize)
+
+        # the bytes after the terminating null are undefined, so different raw names can be the same name
+        raw_names, raw_index, raw_ids = np.unique(records['name'], return_index=True, return_inverse=True)
+        name_table = {}
+        for raw_name, index in sorted(zip(raw_names, raw_index), key=lambda x: x[1]):
+            name_table.setdefault(_toShiftJisString(raw_name), len(name_table))
+        ids = np.array([name_table[_toShiftJisString(i)] for i in raw_names], dtype=np.intp)[raw_ids.ravel()]
+
+        order = np.argsort(ids, kind='stable')
+        keys = records['key'][order]
+        frameClass.fixRecords(keys)
+        bounds = np.searchsorted(ids[order], np.arange(len(name_table)+1))
+        return {name:keys[bounds[i]:bounds[i+1]] for name, i in name_table.items()}
+
+    @classmethod
+    def fromRecords(cls, records):
+        animation = cls()
+        frameClass = cls.frameClass()
+        for name, keys in records.items():
+            animation[name] = frameClass.fromRecords(keys)
+        return animation
+
+    @classmethod
+    def saveRecords(cls, fin, records):
+        dtype = np.dtype([('name', 'S15'), ('key', cls.frameClass().DTYPE)])
+        count = sum([len(i) for i in records.values()])
+        fin.write(struct.pack('<L', count))
+        for name, keys in records.items():
+            data = np.empty(len(keys), dtype=dtype)
+            data['name'] = _toShiftJisBytes(name)
+            data['key'] = keys
+            fin.write(data.tobytes())
+
     def save(self, fin):
         count = sum([len(i) for i in self.values()])
         fin.write(struct.pack('<L', count))
@@ -252,6 +370,30 @@ class _AnimationListBase(list):
             frameKey.load(fin)
             self.append(frameKey)
 
+    @classmethod
+    def loadRecords(cls, fin):
+        """ Read the section as records of frameClass().DTYPE
+        """
+        frameClass = cls.frameClass()
+        dtype = frameClass.DTYPE
+        count, = struct.unpack('<L', fin.read(4))
+        print('loading %s... %d'%(cls.__name__, count))
+        data = fin.read(count*dtype.itemsize)
+        records = np.frombuffer(data, dtype=dtype, count=len(data)//dtype.itemsize).copy()
+        frameClass.fixRecords(records)
+        return records
+
+    @classmethod
+    def fromRecords(cls, records):
+        animation = cls()
+        animation.extend(cls.frameClass().fromRecords(records))
+        return animation
+
+    @classmethod
+    def saveRecords(cls, fin, records):
+        fin.write(struct.pack('<L', len(records)))
+        fin.write(records.astype(cls.frameClass().DTYPE).tobytes())
+
     def save(self, fin):
         fin.write(struct.pack('<L', len(self)))
         for frameKey in self:
@@ -313,6 +455,10 @@ class PropertyAnimation(_AnimationListBase):
 
 
 class File:
+    """ Bone, shape key and camera animations are loaded as records (see loadRecords),
+    boneAnimation, shapeKeyAnimation and cameraAnimation are created from them on first access.
+    The records are saved as they are unless these animations were accessed or assigned.
+    """
     def __init__(self):
         self.filepath = None
         self.header = None
@@ -323,24 +469,53 @@ class File:
         self.selfShadowAnimation = None
         self.propertyAnimation = None
 
+    def __getAnimation(self, attr, cls):
+        animation = getattr(self, '_File__'+attr)
+        records = getattr(self, attr+'Records')
+        if animation is None and records is not None:
+            animation = cls.fromRecords(records)
+            setattr(self, '_File__'+attr, animation)
+        return animation
+
+    def __setAnimation(self, attr, animation):
+        setattr(self, '_File__'+attr, animation)
+        setattr(self, attr+'Records', None)
+
+    def __saveAnimation(self, fin, attr, cls):
+        records = getattr(self, attr+'Records')
+        if records is not None and getattr(self, '_File__'+attr) is None:
+            cls.saveRecords(fin, records)
+        else:
+            (getattr(self, attr) or cls()).save(fin)
+
+    boneAnimation = property(lambda self: self.__getAnimation('boneAnimation', BoneAnimation),
+                             lambda self, value: self.__setAnimation('boneAnimation', value))
+    shapeKeyAnimation = property(lambda self: self.__getAnimation('shapeKeyAnimation', ShapeKeyAnimation),
+                                 lambda self, value: self.__setAnimation('shapeKeyAnimation', value))
+    cameraAnimation = property(lambda self: self.__getAnimation('cameraAnimation', CameraAnimation),
+                               lambda self, value: self.__setAnimation('cameraAnimation', value))
+
     def load(self, **args):
         path = args['filepath']
 
-        with open(path, 'rb') as fin:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as fin:
             self.filepath = path
             self.header = Header()
-            self.boneAnimation = BoneAnimation()
-            self.shapeKeyAnimation = ShapeKeyAnimation()
-            self.cameraAnimation = CameraAnimation()
+            self.boneAnimation = None
+            self.shapeKeyAnimation = None
+            self.cameraAnimation = None
+            self.boneAnimationRecords = {}
+            self.shapeKeyAnimationRecords = {}
+            self.cameraAnimationRecords = np.empty(0, CameraKeyFrameKey.DTYPE)
             self.lampAnimation = LampAnimation()
             self.selfShadowAnimation = SelfShadowAnimation()
             self.propertyAnimation = PropertyAnimation()
 
             self.header.load(fin)
             try:
-                self.boneAnimation.load(fin)
-                self.shapeKeyAnimation.load(fin)
-                self.cameraAnimation.load(fin)
+                self.boneAnimationRecords = BoneAnimation.loadRecords(fin)
+                self.shapeKeyAnimationRecords = ShapeKeyAnimation.loadRecords(fin)
+                self.cameraAnimationRecords = CameraAnimation.loadRecords(fin)
                 self.lampAnimation.load(fin)
                 self.selfShadowAnimation.load(fin)
                 self.propertyAnimation.load(fin)
@@ -351,18 +526,15 @@ class File:
         path = args.get('filepath', self.filepath)
 
         header = self.header or Header()
-        boneAnimation = self.boneAnimation or BoneAnimation()
-        shapeKeyAnimation = self.shapeKeyAnimation or ShapeKeyAnimation()
-        cameraAnimation = self.cameraAnimation or CameraAnimation()
         lampAnimation = self.lampAnimation or LampAnimation()
         selfShadowAnimation = self.selfShadowAnimation or SelfShadowAnimation()
         propertyAnimation = self.propertyAnimation or PropertyAnimation()
 
         with open(path, 'wb') as fin:
             header.save(fin)
-            boneAnimation.save(fin)
-            shapeKeyAnimation.save(fin)
-            cameraAnimation.save(fin)
+            self.__saveAnimation(fin, 'boneAnimation', BoneAnimation)
+            self.__saveAnimation(fin, 'shapeKeyAnimation', ShapeKeyAnimation)
+            self.__saveAnimation(fin, 'cameraAnimation', CameraAnimation)
             lampAnimation.save(fin)
             selfShadowAnimation.save(fin)
             propertyAnimation.save(fin)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+""" Batched cubic bezier curves of VMD and F-Curve interpolation
+
+A batch of N curves is given by its points p0, p1, p2, p3, each an array with shape (N, 2).
+"""
+
+import numpy as np
+
+
+def solve_cubic(a, b, c, d):
+    """ Real roots of a*t*t*t + b*t*t + c*t + d = 0 for arrays of coefficients with shape (N,),
+    returns an array with shape (N, 3) padded with nan
+    """
+    a, b, c, d = np.broadcast_arrays(*(np.asarray(i, dtype=np.float64) for i in (a, b, c, d)))
+    roots = np.full(a.shape + (3,), np.nan)
+    scale = np.maximum.reduce([np.abs(a), np.abs(b), np.abs(c), np.abs(d)])
+    cubic = np.abs(a) > 1e-9 * scale
+    quadratic = ~cubic & (np.abs(b) > 1e-12 * scale)
+    linear = ~cubic & ~quadratic & (c != 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # t = s - B/3, s*s*s + p*s + q = 0
+        A = np.where(cubic, a, 1)
+        B, C, D = b/A, c/A, d/A
+        p = C - B*B/3
+        q = 2*B*B*B/27 - B*C/3 + D
+        shift = -B/3
+        delta = (q/2)**2 + (p/3)**3
+        one_root = cubic & (delta > 0)
+        sq = np.sqrt(np.where(one_root, delta, 0))
+        roots[one_root, 0] = (np.cbrt(-q/2 + sq) + np.cbrt(-q/2 - sq) + shift)[one_root]
+        three_roots = cubic & ~one_root
+        m = 2*np.sqrt(np.maximum(-p, 0)/3)
+        cos3 = np.where(m > 0, 3*q/(np.where(m > 0, p*m, 1)), 0)
+        theta = np.arccos(np.clip(cos3, -1, 1))/3
+        for k in range(3):
+            roots[three_roots, k] = (m*np.cos(theta - 2*np.pi*k/3) + shift)[three_roots]
+
+        # numerically stable quadratic formula
+        D = c*c - 4*b*d
+        real = quadratic & (D >= 0)
+        Q = -0.5*(c + np.copysign(np.sqrt(np.maximum(D, 0)), c))
+        roots[real, 0] = (Q/b)[real]
+        roots[real, 1] = np.where(Q != 0, d/Q, Q/b)[real]
+
+        roots[linear, 0] = (-d/c)[linear]
+    return roots
+
+
+def evaluate(p0, p1, p2, p3, t):
+    """ Points of the curves at t with shape (N,)
+    """
+    t = t[:, None]
+    p01t = (1-t)*p0 + t*p1
+    p12t = (1-t)*p1 + t*p2
+    p23t = (1-t)*p2 + t*p3
+    p012t = (1-t)*p01t + t*p12t
+    p123t = (1-t)*p12t + t*p23t
+    return (1-t)*p012t + t*p123t
+
+
+def split(p0, p1, p2, p3, t0, t1):
+    """ Points of the parts of the curves between t0 and t1 with shape (N,)
+    """
+    def _blossom(u0, u1, u2):
+        u0, u1, u2 = u0[:, None], u1[:, None], u2[:, None]
+        p01 = (1-u0)*p0 + u0*p1
+        p12 = (1-u0)*p1 + u0*p2
+        p23 = (1-u0)*p2 + u0*p3
+        p012 = (1-u1)*p01 + u1*p12
+        p123 = (1-u1)*p12 + u1*p23
+        return (1-u2)*p012 + u2*p123
+    return _blossom(t0, t0, t0), _blossom(t0, t0, t1), _blossom(t0, t1, t1), _blossom(t1, t1, t1)
+
+
+def axis_to_t(p0, p1, p2, p3, val, axis=0, iterations=4):
+    """ The smallest t in [0, 1] where the curves reach val with shape (N,) on the axis,
+    the closed-form root is refined by Newton's method
+    """
+    p0, p1, p2, p3 = p0[:, axis], p1[:, axis], p2[:, axis], p3[:, axis]
+    a = p3 - p0 + 3 * (p1 - p2)
+    b = 3 * (p0 - 2*p1 + p2)
+    c = 3 * (p1 - p0)
+    d = p0 - val
+
+    roots = solve_cubic(a, b, c, d)
+    roots[~((roots >= -1e-6) & (roots <= 1 + 1e-6))] = np.inf
+    t = roots.min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = np.clip((val - p0) / (p3 - p0), 0, 1)
+    t = np.clip(np.where(np.isfinite(t), t, np.nan_to_num(guess)), 0, 1)
+
+    f = ((a*t + b)*t + c)*t + d
+    for i in range(iterations):
+        df = (3*a*t + 2*b)*t + c
+        step = np.divide(f, df, out=np.zeros_like(f), where=df != 0)
+        t_new = np.clip(t - step, 0, 1)
+        f_new = ((a*t_new + b)*t_new + c)*t_new + d
+        better = np.abs(f_new) < np.abs(f)
+        t, f = np.where(better, t_new, t), np.where(better, f_new, f)
+    return t
+
+
+def find_critical(p0, p1, p2, p3):
+    """ t of the extremes on the y axis of the curves which overshoot their end points,
+    returns t with shape (N, 3) and whether each t is valid
+    """
+    p0, p1, p2, p3 = p0[:, 1], p1[:, 1], p2[:, 1], p3[:, 1]
+    p_min, p_max = np.minimum(p0, p3), np.maximum(p0, p3)
+    check = (p1 > p_max) | (p1 < p_min) | (p2 > p_max) | (p2 < p_min)
+    a = 3 * (p3 - p0 + 3 * (p1 - p2))
+    b = 6 * (p0 - 2*p1 + p2)
+    c = 3 * (p1 - p0)
+    t = solve_cubic(0, a, b, c)
+    with np.errstate(invalid='ignore'):
+        valid = (t >= 0) & (t <= 1) & check[:, None]
+    return t, valid
+
+
+def from_fcurve(p0, p1, p2, p3, legacy=False):
+    """ Correct the handles of F-Curve segments the way Blender does,
+    legacy is the correction of Blender older than 2.91
+    """
+    p1, p2 = p1.copy(), p2.copy()
+    if not legacy: # the F-Curve can become near-vertical
+        m = p1[:, 0] > p3[:, 0]
+        t = ((p3[m, 0] - p0[m, 0]) / (p1[m, 0] - p0[m, 0]))[:, None]
+        p1[m] = (1-t)*p0[m] + p1[m]*t
+        m = p0[:, 0] > p2[:, 0]
+        t = ((p3[m, 0] - p0[m, 0]) / (p3[m, 0] - p2[m, 0]))[:, None]
+        p2[m] = (1-t)*p3[m] + p2[m]*t
+    else:
+        m = p1[:, 0] > p2[:, 0]
+        t = ((p3[m, 0] - p0[m, 0]) / (p1[m, 0] - p0[m, 0] + p3[m, 0] - p2[m, 0]))[:, None]
+        p1[m] = (1-t)*p0[m] + p1[m]*t
+        p2[m] = (1-t)*p3[m] + p2[m]*t
+    return p0, p1, p2, p3
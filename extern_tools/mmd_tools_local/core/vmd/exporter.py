@@ -6,109 +6,133 @@ import re
 import bpy
 import math
 import mathutils
+import numpy as np
 
 from mmd_tools_local.core import vmd
 from mmd_tools_local.core.camera import MMDCamera
 from mmd_tools_local.core.lamp import MMDLamp
 
-from mmd_tools_local.core.vmd.importer import _FnBezier
+from mmd_tools_local.core.vmd import bezier
+from mmd_tools_local.core.vmd.importer import _FnBezier, _getKeyframeEnum
 
 
 class _FCurve:
 
+    DEFAULT_INTERP = (20, 20, 107, 107) # x1, y1, x2, y2
+
     def __init__(self, default_value):
         self.__default_value = default_value
         self.__fcurve = None
+        self.__keys = None
 
     def setFCurve(self, fcurve):
         assert(fcurve.is_valid and self.__fcurve is None)
         self.__fcurve = fcurve
 
-    @staticmethod
-    def __get_keys(keyframe_points):
-        kp0 = None
-        for kp1 in sorted(keyframe_points, key=lambda x: x.co[0]):
-            yield int(kp1.co[0]+0.5)
-            if kp0 and kp0.interpolation != 'LINEAR' and kp1.co.x - kp0.co.x > 2.5:
-                if kp0.interpolation == 'CONSTANT':
-                    yield int(kp1.co[0]-0.5)
-                elif kp0.interpolation == 'BEZIER':
-                    bz = _FnBezier.from_fcurve(kp0, kp1)
-                    for t in bz.find_critical():
-                        yield int(bz.evaluate(t).x+0.5)
-            kp0 = kp1
+    def __getKeys(self):
+        # co, handle_left, handle_right, interpolation and frame numbers of the key frames sorted by frame
+        if self.__keys is None:
+            kps = self.__fcurve.keyframe_points
+            data = np.empty((3, len(kps)*2), dtype=np.float32)
+            for i, attr in enumerate(('co', 'handle_left', 'handle_right')):
+                kps.foreach_get(attr, data[i])
+            co, handle_left, handle_right = data.astype(np.float64).reshape(3, -1, 2)
+            interpolation = np.array(_getKeyframeEnum(kps, 'interpolation'), dtype=object)
+            order = np.argsort(co[:, 0], kind='stable')
+            frames = np.trunc(co[order, 0] + 0.5).astype(np.int64)
+            self.__keys = (co[order], handle_left[order], handle_right[order], interpolation[order], frames)
+        return self.__keys
+
+    def __hasKeys(self):
+        return self.__fcurve is not None and len(self.__fcurve.keyframe_points) > 0
 
     def frameNumbers(self):
-        if self.__fcurve is None:
-            return set()
-        #return {int(kp.co[0]+0.5) for kp in self.__fcurve.keyframe_points}
-        return set(self.__get_keys(self.__fcurve.keyframe_points))
-
-    @staticmethod
-    def getVMDControlPoints(kp0, kp1):
-        if kp0.interpolation == 'BEZIER':
-            return _FCurve.__toVMDControlPoints(_FnBezier.from_fcurve(kp0, kp1))
-        return ((20, 20), (107, 107))
+        if not self.__hasKeys():
+            return np.empty(0, dtype=np.int64)
+        co, handle_left, handle_right, interpolation, frames = self.__getKeys()
+        gap = co[1:, 0] - co[:-1, 0] > 2.5
+        m = gap & (interpolation[:-1] == 'CONSTANT')
+        frame_numbers = [frames, np.trunc(co[1:][m, 0] - 0.5).astype(np.int64)]
+        m = gap & (interpolation[:-1] == 'BEZIER')
+        if m.any():
+            points = _FnBezier.from_fcurve_arrays(co[:-1][m], handle_right[:-1][m], handle_left[1:][m], co[1:][m])
+            t, valid = bezier.find_critical(*points)
+            points = [np.repeat(i, t.shape[1], axis=0)[valid.ravel()] for i in points]
+            x = bezier.evaluate(*points, t[valid])[:, 0]
+            frame_numbers.append(np.trunc(x + 0.5).astype(np.int64))
+        return np.unique(np.concatenate(frame_numbers))
 
     @staticmethod
-    def __toVMDControlPoints(bezier):
-        p0, p1, p2, p3 = bezier.points
-
-        dx, dy = p3 - p0
-        if abs(dy) < 1e-6 or abs(dx) < 1.5:
-            return ((20, 20), (107, 107))
-
-        x1, y1 = p1 - p0
-        x2, y2 = p2 - p0
-        x1 = max(0, min(127, int(0.5 + x1*127.0/dx)))
-        x2 = max(0, min(127, int(0.5 + x2*127.0/dx)))
-        y1 = max(0, min(127, int(0.5 + y1*127.0/dy)))
-        y2 = max(0, min(127, int(0.5 + y2*127.0/dy)))
-        return ((x1, y1), (x2, y2))
+    def __toVMDControlPoints(p0, p1, p2, p3):
+        dx, dy = (p3 - p0).T
+        x1, y1 = (p1 - p0).T
+        x2, y2 = (p2 - p0).T
+        default = (np.abs(dy) < 1e-6) | (np.abs(dx) < 1.5)
+        dx, dy = np.where(default, 1, dx), np.where(default, 1, dy)
+        interps = np.stack([x1*127.0/dx, y1*127.0/dy, x2*127.0/dx, y2*127.0/dy], axis=1)
+        interps = np.clip(np.trunc(0.5 + interps), 0, 127).astype(np.int64)
+        interps[default] = _FCurve.DEFAULT_INTERP
+        return interps
+
+    def __evaluate(self, frames, kp0, kp1):
+        co, handle_left, handle_right, interpolation, _ = self.__getKeys()
+        x = frames.astype(np.float64)
+        (x0, y0), (x1, y1) = co[kp0].T, co[kp1].T
+        interpolation = interpolation[kp0]
+        linear = interpolation == 'LINEAR'
+        fast = (x0 <= x) & (x <= x1) & (x0 < x1) & (linear | (interpolation == 'CONSTANT'))
+        fast &= (x < x1) | (co[np.minimum(kp1+1, len(co)-1), 0] != x1) | (kp1 == len(co)-1) # no other key at x1
+        if len(self.__fcurve.modifiers):
+            fast[:] = False
+        dx = np.where(x0 < x1, x1 - x0, 1)
+        values = np.where(linear, y0 + (y1 - y0) * (x - x0) / dx, np.where(x < x1, y0, y1))
+        evaluate = self.__fcurve.evaluate
+        for i in np.flatnonzero(~fast).tolist():
+            values[i] = evaluate(x[i])
+        return values
 
     def sampleFrames(self, frame_numbers):
+        """ Return the values and the VMD interpolations (x1, y1, x2, y2) at the sorted frame_numbers
+        """
         # assume set(frame_numbers) & set(self.frameNumbers()) == set(self.frameNumbers())
-        fcurve = self.__fcurve
-        if fcurve is None or len(fcurve.keyframe_points) < 1: # no key frames
-            for i in frame_numbers:
-                yield [self.__default_value, ((20, 20), (107, 107))]
-            return
-
-        evaluate = fcurve.evaluate
-        frame_iter = iter(frame_numbers)
-        prev_kp = None
-        prev_i = None
-        for kp in sorted(fcurve.keyframe_points, key=lambda x: x.co[0]):
-            i = int(kp.co[0]+0.5)
-            if i == prev_i:
-                prev_kp = kp
-                continue
-            prev_i = i
-            frames = []
-            while True:
-                frame = next(frame_iter)
-                frames.append(frame)
-                if frame >= i:
-                    break
-            assert(len(frames) >= 1 and frames[-1] == i)
-            if prev_kp is None:
-                for f in frames: # starting key frames
-                    yield [kp.co[1], ((20, 20), (107, 107))]
-            elif len(frames) == 1:
-                yield [kp.co[1], self.getVMDControlPoints(prev_kp, kp)]
-            elif prev_kp.interpolation == 'BEZIER':
-                bz = _FnBezier.from_fcurve(prev_kp, kp)
-                for f in frames[:-1]:
-                    b1, bz, pt = bz.split_by_x(f)
-                    yield [pt.y, self.__toVMDControlPoints(b1)]
-                yield [bz.points[-1].y, self.__toVMDControlPoints(bz)]
-            else:
-                for f in frames:
-                    yield [evaluate(f), ((20, 20), (107, 107))]
-            prev_kp = kp
-
-        for f in frame_iter: # ending key frames
-            yield [prev_kp.co[1], ((20, 20), (107, 107))]
+        count = len(frame_numbers)
+        interps = np.empty((count, 4), dtype=np.int64)
+        interps[:] = self.DEFAULT_INTERP
+        if not self.__hasKeys(): # no key frames
+            return np.full(count, self.__default_value), interps
+
+        co, handle_left, handle_right, interpolation, frames = self.__getKeys()
+        first = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+        last = np.append(first[1:]-1, len(frames)-1)
+        pos = np.searchsorted(frame_numbers, frames[first])
+        assert(pos[-1] < count and (frame_numbers[pos] == frames[first]).all())
+
+        values = np.empty(count)
+        values[:pos[0]+1] = co[first[0], 1] # starting key frames
+        values[pos[-1]+1:] = co[last[-1], 1] # ending key frames
+
+        # the frames between the key frames kp0 and kp1 of each segment
+        index = np.arange(pos[0]+1, pos[-1]+1)
+        seg = np.searchsorted(pos, index)
+        kp0, kp1 = last[seg-1], first[seg]
+        is_first, is_last = index == pos[seg-1]+1, index == pos[seg]
+        is_bezier = interpolation[kp0] == 'BEZIER'
+
+        m = ~is_bezier & is_first & is_last
+        values[index[m]] = co[kp1[m], 1]
+        m = ~is_bezier & ~(is_first & is_last)
+        values[index[m]] = self.__evaluate(frame_numbers[index[m]], kp0[m], kp1[m])
+
+        index, kp0, kp1, is_first, is_last = index[is_bezier], kp0[is_bezier], kp1[is_bezier], is_first[is_bezier], is_last[is_bezier]
+        points = _FnBezier.from_fcurve_arrays(co[kp0], handle_right[kp0], handle_left[kp1], co[kp1])
+        t1 = bezier.axis_to_t(*points, frame_numbers[index].astype(np.float64))
+        t1[is_last] = 1
+        t0 = np.append(0, t1[:-1])
+        t0[is_first] = 0
+        parts = bezier.split(*points, t0, t1)
+        values[index] = np.where(is_last, co[kp1, 1], parts[3][:, 1])
+        interps[index] = self.__toVMDControlPoints(*parts)
+        return values, interps
 
 
 class VMDExporter:
@@ -121,33 +145,25 @@ class VMDExporter:
         self.__ik_fcurves = {}
 
     def __allFrameKeys(self, curves):
-        all_frames = set()
-        for i in curves:
-            all_frames |= i.frameNumbers()
-
+        """ Return the frame numbers in the frame range, and the values and the VMD interpolations
+        (see _FCurve.sampleFrames) of each curve at these frames
+        """
+        all_frames = np.unique(np.concatenate([i.frameNumbers() for i in curves]))
         if len(all_frames) < 1:
-            return
+            return all_frames, [(np.empty(0), np.empty((0, 4), dtype=np.int64)) for i in curves]
 
-        frame_start = min(all_frames)
+        frame_start = all_frames[0]
         if frame_start < self.__frame_start:
             frame_start = self.__frame_start
-            all_frames.add(frame_start)
 
-        frame_end = max(all_frames)
+        frame_end = all_frames[-1]
         if frame_end > self.__frame_end:
             frame_end = self.__frame_end
-            all_frames.add(frame_end)
 
-        all_frames = sorted(all_frames)
+        all_frames = np.union1d(all_frames, np.array([frame_start, frame_end], dtype=all_frames.dtype))
         all_keys = [i.sampleFrames(all_frames) for i in curves]
-        #return zip(all_frames, *all_keys)
-        for data in zip(all_frames, *all_keys):
-            frame_number = data[0]
-            if frame_number < frame_start:
-                continue
-            if frame_number > frame_end:
-                break
-            yield data
+        m = (all_frames >= frame_start) & (all_frames <= frame_end)
+        return all_frames[m], [(values[m], interps[m]) for values, interps in all_keys]
 
     @staticmethod
     def __minRotationDiff(prev_q, curr_q):
@@ -159,33 +175,34 @@ class VMDExporter:
 
     @staticmethod
     def __getVMDBoneInterpolation(x_axis, y_axis, z_axis, rotation):
-        x_x1, x_y1 = x_axis[0]
-        x_x2, x_y2 = x_axis[1]
-        y_x1, y_y1 = y_axis[0]
-        y_x2, y_y2 = y_axis[1]
-        z_x1, z_y1 = z_axis[0]
-        z_x2, z_y2 = z_axis[1]
-        r_x1, r_y1 = rotation[0]
-        r_x2, r_y2 = rotation[1]
+        # x_axis, y_axis, z_axis and rotation are arrays of (x1, y1, x2, y2) with shape (N, 4)
         #return [ # minimum acceptable data
         #    x_x1, 0, 0, 0, x_y1, 0, 0, 0, x_x2, 0, 0, 0, x_y2, 0, 0, 0,
         #    y_x1, 0, 0, 0, y_y1, 0, 0, 0, y_x2, 0, 0, 0, y_y2, 0, 0, 0,
         #    z_x1, 0, 0, 0, z_y1, 0, 0, 0, z_x2, 0, 0, 0, z_y2, 0, 0, 0,
         #    r_x1, 0, 0, 0, r_y1, 0, 0, 0, r_x2, 0, 0, 0, r_y2, 0, 0, 0,
         #    ]
-        return [ # full data, indices in [2, 3, 31, 46, 47, 61, 62, 63] are unclear
-            x_x1, y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,
-            y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,
-            z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,    0,
-            r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,    0,    0,
-            ]
+        # full data, indices in [2, 3, 31, 46, 47, 61, 62, 63] are unclear
+        # x_x1, y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,
+        # y_x1, z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,
+        # z_x1, r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,    0,
+        # r_x1, x_y1, y_y1, z_y1, r_y1, x_x2, y_x2, z_x2, r_x2, x_y2, y_y2, z_y2, r_y2,    0,    0,    0,
+        data = np.stack([x_axis, y_axis, z_axis, rotation], axis=2).reshape(-1, 16)
+        interp = np.zeros((len(data), 64), dtype=np.int8)
+        for i in range(4):
+            interp[:, i*16:i*16+16-i] = data[:, i:]
+        return interp
 
     @staticmethod
     def __pickRotationInterpolation(rotation_interps):
+        picked = np.empty_like(rotation_interps[0])
+        picked[:] = _FCurve.DEFAULT_INTERP
+        unset = np.ones(len(picked), dtype=bool)
         for ir in rotation_interps:
-            if ir != ((20, 20), (107, 107)):
-                return ir
-        return ((20, 20), (107, 107))
+            m = unset & (ir != _FCurve.DEFAULT_INTERP).any(axis=1)
+            picked[m] = ir[m]
+            unset &= ~m
+        return picked
 
     @staticmethod
     def __xyzw_from_rotation_mode(mode):
@@ -212,7 +229,7 @@ class VMDExporter:
             logging.warning('[WARNING] armature "%s" has no animation data', armObj.name)
             return None
 
-        vmd_bone_anim = vmd.BoneAnimation()
+        vmd_bone_anim = {} # records of vmd.BoneAnimation
 
         anim_bones = {}
         rePath = re.compile(r'^pose\.bones\["(.+)"\]\.([a-z_]+)$')
@@ -256,25 +273,29 @@ class VMDExporter:
         for bone, bone_curves in anim_bones.items():
             key_name = bone.mmd_bone.name_j or bone.name
             assert(key_name not in vmd_bone_anim) # VMD bone name collision
-            frame_keys = vmd_bone_anim[key_name]
+
+            frame_numbers, samples = self.__allFrameKeys(bone_curves)
+            frame_keys = np.zeros(len(frame_numbers), dtype=vmd.BoneFrameKey.DTYPE)
+            frame_keys['frame_number'] = frame_numbers - self.__frame_start
 
             get_xyzw = self.__xyzw_from_rotation_mode(bone.rotation_mode)
             converter = self.__bone_converter_cls(bone, self.__scale, invert=True)
             prev_rot = None
-            for frame_number, x, y, z, rw, rx, ry, rz in self.__allFrameKeys(bone_curves):
-                key = vmd.BoneFrameKey()
-                key.frame_number = frame_number - self.__frame_start
-                key.location = converter.convert_location([x[0], y[0], z[0]])
-                curr_rot = converter.convert_rotation(get_xyzw([rx[0], ry[0], rz[0], rw[0]]))
+            location, rotation = frame_keys['location'], frame_keys['rotation']
+            for i, (x, y, z, rw, rx, ry, rz) in enumerate(zip(*(values.tolist() for values, _ in samples))):
+                location[i] = converter.convert_location([x, y, z])
+                curr_rot = converter.convert_rotation(get_xyzw([rx, ry, rz, rw]))
                 if prev_rot is not None:
                     curr_rot = self.__minRotationDiff(prev_rot, curr_rot)
                 prev_rot = curr_rot
-                key.rotation = curr_rot[1:] + curr_rot[0:1] # (w, x, y, z) to (x, y, z, w)
-                #FIXME we can only choose one interpolation from (rw, rx, ry, rz) for bone's rotation
-                ir = self.__pickRotationInterpolation([rw[1], rx[1], ry[1], rz[1]])
-                ix, iy, iz = converter.convert_interpolation([x[1], y[1], z[1]])
-                key.interp = self.__getVMDBoneInterpolation(ix, iy, iz, ir)
-                frame_keys.append(key)
+                rotation[i] = curr_rot[1:] + curr_rot[0:1] # (w, x, y, z) to (x, y, z, w)
+
+            x, y, z, rw, rx, ry, rz = (interps for _, interps in samples)
+            #FIXME we can only choose one interpolation from (rw, rx, ry, rz) for bone's rotation
+            ir = self.__pickRotationInterpolation([rw, rx, ry, rz])
+            ix, iy, iz = converter.convert_interpolation([x, y, z])
+            frame_keys['interp'] = self.__getVMDBoneInterpolation(ix, iy, iz, ir)
+            vmd_bone_anim[key_name] = frame_keys
             logging.info('(bone) frames:%5d  name: %s', len(frame_keys), key_name)
         logging.info('---- bone animations:%5d  source: %s', len(vmd_bone_anim), armObj.name)
         return vmd_bone_anim
@@ -291,7 +312,7 @@ class VMDExporter:
             logging.warning('[WARNING] mesh "%s" has no animation data', meshObj.name)
             return None
 
-        vmd_morph_anim = vmd.ShapeKeyAnimation()
+        vmd_morph_anim = {} # records of vmd.ShapeKeyAnimation
 
         key_blocks = meshObj.data.shape_keys.key_blocks
         def __get_key_block(key):
@@ -316,16 +337,15 @@ class VMDExporter:
 
             key_name = kb.name
             assert(key_name not in vmd_morph_anim)
-            anim = vmd_morph_anim[key_name]
 
             curve = _FCurve(kb.value)
             curve.setFCurve(fcurve)
 
-            for frame_number, weight in self.__allFrameKeys([curve]):
-                key = vmd.ShapeKeyFrameKey()
-                key.frame_number = frame_number - self.__frame_start
-                key.weight = weight[0]
-                anim.append(key)
+            frame_numbers, ((weights, _),) = self.__allFrameKeys([curve])
+            anim = np.zeros(len(frame_numbers), dtype=vmd.ShapeKeyFrameKey.DTYPE)
+            anim['frame_number'] = frame_numbers - self.__frame_start
+            anim['weight'] = weights
+            vmd_morph_anim[key_name] = anim
             logging.info('(mesh) frames:%5d  name: %s', len(anim), key_name)
         logging.info('---- morph animations:%5d  source: %s', len(vmd_morph_anim), meshObj.name)
         return vmd_morph_anim
@@ -355,11 +375,12 @@ class VMDExporter:
             prop_curves.append(c)
             ik_name_list.append(bone.mmd_bone.name_j or bone.name)
 
-        for data in self.__allFrameKeys(prop_curves):
+        frame_numbers, samples = self.__allFrameKeys(prop_curves)
+        for frame_number, visible, *ik_states in zip(frame_numbers.tolist(), *(values.tolist() for values, _ in samples)):
             key = vmd.PropertyFrameKey()
-            key.frame_number = data[0] - self.__frame_start
-            key.visible = int(0.5 + data[1][0])
-            key.ik_states = [(ik_name, int(0.5+on_off[0])) for ik_name, on_off in zip(ik_name_list, data[2:])]
+            key.frame_number = frame_number - self.__frame_start
+            key.visible = int(0.5 + visible)
+            key.ik_states = [(ik_name, int(0.5+on_off)) for ik_name, on_off in zip(ik_name_list, ik_states)]
             vmd_prop_anim.append(key)
         logging.info('(property) frames:%5d  name: %s', len(vmd_prop_anim), root.name if root else armObj.name)
         return vmd_prop_anim
@@ -402,27 +423,22 @@ class VMDExporter:
                 if fcurve.data_path == 'location' and fcurve.array_index == 1: # distance
                     cam_curves[8].setFCurve(fcurve)
 
-        for frame_number, x, y, z, rx, ry, rz, fov, persp, distance in self.__allFrameKeys(cam_curves):
+        frame_numbers, samples = self.__allFrameKeys(cam_curves)
+        x, y, z, rx, ry, rz, fov, persp, distance = (interps for _, interps in samples)
+        #FIXME we can only choose one interpolation from (rx, ry, rz) for camera's rotation
+        ir = self.__pickRotationInterpolation([rx, ry, rz])
+        # (x1, x2, y1, y2) of x, y, z, rotation, distance and fov
+        interps = np.concatenate([i[:, (0, 2, 1, 3)] for i in (x, z, y, ir, distance, fov)], axis=1)
+        samples = [values.tolist() for values, _ in samples]
+        for frame_number, x, y, z, rx, ry, rz, fov, persp, distance, interp in zip(frame_numbers.tolist(), *samples, interps.tolist()):
             key = vmd.CameraKeyFrameKey()
             key.frame_number = frame_number - self.__frame_start
-            key.location = [x[0]*self.__scale, z[0]*self.__scale, y[0]*self.__scale]
-            key.rotation = [rx[0], rz[0], ry[0]] # euler
-            key.angle = int(0.5 + math.degrees(fov[0]))
-            key.distance = distance[0] * self.__scale
-            key.persp = True if persp[0] else False
-
-            #FIXME we can only choose one interpolation from (rx, ry, rz) for camera's rotation
-            ir = self.__pickRotationInterpolation([rx[1], ry[1], rz[1]])
-            ix, iy, iz, iD, iF = x[1], z[1], y[1], distance[1], fov[1]
-            key.interp = [
-                ix[0][0], ix[1][0], ix[0][1], ix[1][1],
-                iy[0][0], iy[1][0], iy[0][1], iy[1][1],
-                iz[0][0], iz[1][0], iz[0][1], iz[1][1],
-                ir[0][0], ir[1][0], ir[0][1], ir[1][1],
-                iD[0][0], iD[1][0], iD[0][1], iD[1][1],
-                iF[0][0], iF[1][0], iF[0][1], iF[1][1],
-                ]
-
+            key.location = [x*self.__scale, z*self.__scale, y*self.__scale]
+            key.rotation = [rx, rz, ry] # euler
+            key.angle = int(0.5 + math.degrees(fov))
+            key.distance = distance * self.__scale
+            key.persp = True if persp else False
+            key.interp = interp
             vmd_cam_anim.append(key)
         logging.info('(camera) frames:%5d  name: %s', len(vmd_cam_anim), mmd_cam.name)
         return vmd_cam_anim
@@ -456,11 +472,12 @@ class VMDExporter:
                 if fcurve.data_path == 'location': # x, y, z
                     lamp_curves[3+fcurve.array_index].setFCurve(fcurve)
 
-        for frame_number, r, g, b, x, y, z in self.__allFrameKeys(lamp_curves):
+        frame_numbers, samples = self.__allFrameKeys(lamp_curves)
+        for frame_number, r, g, b, x, y, z in zip(frame_numbers.tolist(), *(values.tolist() for values, _ in samples)):
             key = vmd.LampKeyFrameKey()
             key.frame_number = frame_number - self.__frame_start
-            key.color = [r[0], g[0], b[0]]
-            key.direction = [-x[0], -z[0], -y[0]]
+            key.color = [r, g, b]
+            key.direction = [-x, -z, -y]
             vmd_lamp_anim.append(key)
         logging.info('(lamp) frames:%5d  name: %s', len(vmd_lamp_anim), mmd_lamp.name)
         return vmd_lamp_anim
@@ -486,8 +503,8 @@ class VMDExporter:
             vmdFile = vmd.File()
             vmdFile.header = vmd.Header()
             vmdFile.header.model_name = args.get('model_name', '')
-            vmdFile.boneAnimation = self.__exportBoneAnimation(armature)
-            vmdFile.shapeKeyAnimation = self.__exportMorphAnimation(mesh)
+            vmdFile.boneAnimationRecords = self.__exportBoneAnimation(armature)
+            vmdFile.shapeKeyAnimationRecords = self.__exportMorphAnimation(mesh)
             vmdFile.propertyAnimation = self.__exportPropertyAnimation(armature)
             vmdFile.save(filepath=filepath)
 
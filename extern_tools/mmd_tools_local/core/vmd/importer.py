@@ -5,15 +5,45 @@ import os
 
 import bpy
 import math
+import numpy as np
 from mathutils import Vector, Quaternion
 
 from mmd_tools_local import utils
 from mmd_tools_local.bpyutils import matmul
 from mmd_tools_local.core import vmd
+from mmd_tools_local.core.vmd import bezier
 from mmd_tools_local.core.camera import MMDCamera
 from mmd_tools_local.core.lamp import MMDLamp
 
 
+def _setKeyframeEnum(keyframe_points, prop_name, identifiers):
+    """ Set the enum property prop_name of all keyframe_points to identifiers at once
+    identifiers is a single identifier or a sequence of identifiers
+    """
+    if isinstance(identifiers, str):
+        identifiers = (identifiers,) * len(keyframe_points)
+    try:
+        enum_items = bpy.types.Keyframe.bl_rna.properties[prop_name].enum_items
+        values = {i.identifier:i.value for i in enum_items}
+        keyframe_points.foreach_set(prop_name, [values[i] for i in identifiers])
+    except (TypeError, RuntimeError): # foreach_set doesn't support enum properties in older Blender
+        for kp, i in zip(keyframe_points, identifiers):
+            setattr(kp, prop_name, i)
+
+
+def _getKeyframeEnum(keyframe_points, prop_name):
+    """ Get the enum property prop_name of all keyframe_points at once as a list of identifiers
+    """
+    try:
+        enum_items = bpy.types.Keyframe.bl_rna.properties[prop_name].enum_items
+        identifiers = {i.value:i.identifier for i in enum_items}
+        values = np.empty(len(keyframe_points), dtype=np.int32)
+        keyframe_points.foreach_get(prop_name, values)
+        return [identifiers[i] for i in values.tolist()]
+    except (TypeError, RuntimeError): # foreach_get doesn't support enum properties in older Blender
+        return [getattr(kp, prop_name) for kp in keyframe_points]
+
+
 class _MirrorMapper:
     def __init__(self, data_map=None):
         from mmd_tools_local.operators.view import FlipPose
@@ -147,6 +177,12 @@ class _FnBezier:
             p2 = (1-t)*p3 + p2*t
         return cls(p0, p1, p2, p3)
 
+    @classmethod
+    def from_fcurve_arrays(cls, p0, p1, p2, p3):
+        """ Same as from_fcurve for arrays of points with shape (N, 2), see bezier.from_fcurve
+        """
+        return bezier.from_fcurve(p0, p1, p2, p3, legacy=not cls.__BLENDER_2_91_OR_NEWER)
+
     def __init__(self, p0, p1, p2, p3): # assuming VMD's bezier or F-Curve's bezier
         #assert(p0.x <= p1.x <= p3.x and p0.x <= p2.x <= p3.x)
         self._p0, self._p1, self._p2, self._p3 = p0, p1, p2, p3
@@ -180,76 +216,15 @@ class _FnBezier:
     def evaluate_by_x(self, x):
         return self.evaluate(self.axis_to_t(x))
 
+    def __arrays(self):
+        return [np.array([p], dtype=np.float64) for p in self.points]
+
     def axis_to_t(self, val, axis=0):
-        p0, p1, p2, p3 = self._p0[axis], self._p1[axis], self._p2[axis], self._p3[axis]
-        a = p3 - p0 + 3 * (p1 - p2)
-        b = 3 * (p0 - 2*p1 + p2)
-        c = 3 * (p1 - p0)
-        d = p0 - val
-        return next(self.__find_roots(a, b, c, d))
+        return float(bezier.axis_to_t(*self.__arrays(), np.array([val], dtype=np.float64), axis)[0])
 
     def find_critical(self):
-        p0, p1, p2, p3 = self._p0.y, self._p1.y, self._p2.y, self._p3.y
-        p_min, p_max = (p0, p3) if p0 < p3 else (p3, p0)
-        if p1 > p_max or p1 < p_min or p2 > p_max or p2 < p_min:
-            a = 3 * (p3 - p0 + 3 * (p1 - p2))
-            b = 6 * (p0 - 2*p1 + p2)
-            c = 3 * (p1 - p0)
-            yield from self.__find_roots(0, a, b, c)
-
-    @staticmethod
-    def __find_roots(a, b, c, d): # a*t*t*t + b*t*t + c*t + d = 0
-        #TODO fix precision errors (ex: t=0 and t=1) and improve performance
-        if a == 0:
-            if b == 0:
-                t = -d/c
-                if 0 <= t <= 1:
-                    yield t
-            else:
-                D = c*c - 4*b*d
-                if D < 0:
-                    return
-                D = D**0.5
-                b2 = 2*b
-                t = (-c + D)/b2
-                if 0 <= t <= 1:
-                    yield t
-                t = (-c - D)/b2
-                if 0 <= t <= 1:
-                    yield t
-            return
-
-        def _sqrt3(v):
-            return -((-v)**(1/3)) if v < 0 else v**(1/3)
-
-        A = b*c/(6*a*a) - b*b*b/(27*a*a*a) - d/(2*a)
-        B = c/(3*a) - b*b/(9*a*a)
-        b_3a = -b/(3*a)
-        D = A*A + B*B*B
-
-        if D > 0:
-            D = D**0.5
-            t = b_3a + _sqrt3(A+D) + _sqrt3(A-D)
-            if 0 <= t <= 1:
-                yield t
-        elif D == 0:
-            t = b_3a + _sqrt3(A)*2
-            if 0 <= t <= 1:
-                yield t
-            t = b_3a - _sqrt3(A)
-            if 0 <= t <= 1:
-                yield t
-        else:
-            R = A / (-B*B*B)**0.5
-            t = b_3a + 2*(-B)**0.5 * math.cos(math.acos(R) / 3)
-            if 0 <= t <= 1:
-                yield t
-            t = b_3a + 2*(-B)**0.5 * math.cos((math.acos(R) + 2*math.pi) / 3)
-            if 0 <= t <= 1:
-                yield t
-            t = b_3a + 2*(-B)**0.5 * math.cos((math.acos(R) - 2*math.pi) / 3)
-            if 0 <= t <= 1:
-                yield t
+        t, valid = bezier.find_critical(*self.__arrays())
+        yield from t[0][valid[0]].tolist()
 
 
 class VMDImporter:
@@ -287,6 +262,50 @@ class VMDImporter:
         kp0.handle_right = kp0.co + Vector((d.x * bezier[0], d.y * bezier[1]))
         kp1.handle_left = kp0.co + Vector((d.x * bezier[2], d.y * bezier[3]))
 
+    @staticmethod
+    def __setKeyframes(fcurve, co, bezier, extra_frame):
+        """ Add all keyframes co[i] = (frame, value) to fcurve at once, the same as
+        __setInterpolation for each pair of keyframes followed by __fixFcurveHandles.
+        bezier[i] is the interpolation from the previous keyframe of the VMD keyframe i,
+        the keyframe at frame 1 of the frame margin is co[0] if extra_frame is set.
+        """
+        start = 1 if extra_frame else 0
+        p0, p1 = co[start:-1], co[start+1:]
+        b = bezier[1:]
+        handle_left, handle_right = co.copy(), co.copy()
+        handle_left[0, 0] -= 1
+        handle_right[-1, 0] += 1
+        d = (p1 - p0) / 127.0
+        handle_right[start:-1] = p0 + d * b[:, 0:2]
+        handle_left[start+1:] = p0 + d * b[:, 2:4]
+
+        interpolation = np.full(len(co), 'BEZIER', dtype=object)
+        interpolation[start:-1][(b[:, 0] == b[:, 1]) & (b[:, 2] == b[:, 3])] = 'LINEAR'
+        handle_left_type = ['FREE'] * len(co)
+        handle_right_type = ['FREE'] * len(co)
+        if extra_frame:
+            interpolation[0] = 'LINEAR'
+            if len(co) > 1:
+                handle_right_type[0] = handle_left_type[1] = 'AUTO_CLAMPED'
+
+        kps = fcurve.keyframe_points
+        kps.add(len(co))
+        _setKeyframeEnum(kps, 'interpolation', interpolation)
+        _setKeyframeEnum(kps, 'handle_left_type', handle_left_type)
+        _setKeyframeEnum(kps, 'handle_right_type', handle_right_type)
+        kps.foreach_set('co', co.astype(np.float32).ravel())
+        kps.foreach_set('handle_left', handle_left.astype(np.float32).ravel())
+        kps.foreach_set('handle_right', handle_right.astype(np.float32).ravel())
+
+    @staticmethod
+    def __setConstantKeyframes(fcurve, keys):
+        """ Add the keyframes of keys {frame: value} to fcurve at once with constant interpolation
+        """
+        kps = fcurve.keyframe_points
+        kps.add(len(keys))
+        kps.foreach_set('co', np.array(sorted(keys.items()), dtype=np.float32).ravel())
+        _setKeyframeEnum(kps, 'interpolation', 'CONSTANT')
+
     @staticmethod
     def __fixFcurveHandles(fcurve):
         kp0 = fcurve.keyframe_points[0]
@@ -328,7 +347,7 @@ class VMDImporter:
         return _ConverterWrap
 
     def __assignToArmature(self, armObj, action_name=None):
-        boneAnim = self.__vmdFile.boneAnimation
+        boneAnim = self.__vmdFile.boneAnimationRecords
         logging.info('---- bone animations:%5d  target: %s', len(boneAnim), armObj.name)
         if len(boneAnim) < 1:
             return
@@ -348,8 +367,6 @@ class VMDImporter:
             pose_bones = _MirrorMapper(pose_bones)
             _loc, _rot = _MirrorMapper.get_location, _MirrorMapper.get_rotation
 
-        class _Dummy: pass
-        dummy_keyframe_points = iter(lambda: _Dummy, None)
         prop_rot_map = {'QUATERNION':'rotation_quaternion', 'AXIS_ANGLE':'rotation_axis_angle'}
 
         bone_name_table = {}
@@ -365,59 +382,40 @@ class VMDImporter:
             assert(bone_name_table.get(bone.name, name) == name)
             bone_name_table[bone.name] = name
 
-            fcurves = [dummy_keyframe_points]*7 # x, y, z, r0, r1, r2, (r3)
             data_path_rot = prop_rot_map.get(bone.rotation_mode, 'rotation_euler')
             bone_rotation = getattr(bone, data_path_rot)
             default_values = list(bone.location) + list(bone_rotation)
-            data_path = 'pose.bones["%s"].location'%bone.name
-            for axis_i in range(3):
-                fcurves[axis_i] = action.fcurves.new(data_path=data_path, index=axis_i, action_group=bone.name)
-            data_path = 'pose.bones["%s"].%s'%(bone.name, data_path_rot)
-            for axis_i in range(len(bone_rotation)):
-                fcurves[3+axis_i] = action.fcurves.new(data_path=data_path, index=axis_i, action_group=bone.name)
-
-            for i in range(len(default_values)):
-                c = fcurves[i]
-                c.keyframe_points.add(extra_frame+num_frame)
-                kp_iter = iter(c.keyframe_points)
-                if extra_frame:
-                    kp = next(kp_iter)
-                    kp.co = (1, default_values[i])
-                    kp.interpolation = 'LINEAR'
-                fcurves[i] = kp_iter
 
             converter = self.__getBoneConverter(bone)
             prev_rot = bone_rotation if extra_frame else None
-            prev_kps, indices = None, tuple(converter.convert_interpolation((0, 16, 32)))+(48,)*len(bone_rotation)
-            keyFrames.sort(key=lambda x:x.frame_number)
-            for k, x, y, z, r0, r1, r2, r3 in zip(keyFrames, *fcurves):
-                frame = k.frame_number + self.__frame_margin
-                loc = converter.convert_location(_loc(k.location))
-                curr_rot = converter.convert_rotation(_rot(k.rotation))
+            indices = tuple(converter.convert_interpolation((0, 16, 32)))+(48,)*len(bone_rotation)
+            keyFrames = keyFrames[np.argsort(keyFrames['frame_number'], kind='stable')]
+
+            values = np.empty((extra_frame+num_frame, 1+len(default_values)))
+            values[:extra_frame, 0] = 1
+            values[:extra_frame, 1:] = default_values
+            for location, rotation, row in zip(keyFrames['location'].tolist(), keyFrames['rotation'].tolist(), values[extra_frame:]):
+                loc = converter.convert_location(_loc(location))
+                curr_rot = converter.convert_rotation(_rot(rotation))
                 if prev_rot is not None:
                     curr_rot = converter.compatible_rotation(prev_rot, curr_rot)
                     #FIXME the rotation interpolation has slightly different result
                     #   Blender: rot(x) = prev_rot*(1 - bezier(t)) + curr_rot*bezier(t)
                     #       MMD: rot(x) = prev_rot.slerp(curr_rot, factor=bezier(t))
                 prev_rot = curr_rot
+                row[1:4] = loc
+                row[4:] = curr_rot
+            values[extra_frame:, 0] = keyFrames['frame_number'] + self.__frame_margin
+            interp = keyFrames['interp'].astype(np.float64)
 
-                x.co = (frame, loc[0])
-                y.co = (frame, loc[1])
-                z.co = (frame, loc[2])
-                r0.co = (frame, curr_rot[0])
-                r1.co = (frame, curr_rot[1])
-                r2.co = (frame, curr_rot[2])
-                r3.co = (frame, curr_rot[-1])
-
-                curr_kps = (x, y, z, r0, r1, r2, r3)
-                if prev_kps is not None:
-                    interp = k.interp
-                    for idx, prev_kp, kp in zip(indices, prev_kps, curr_kps):
-                        self.__setInterpolation(interp[idx:idx+16:4], prev_kp, kp)
-                prev_kps = curr_kps
-
-        for c in action.fcurves:
-            self.__fixFcurveHandles(c)
+            data_path = 'pose.bones["%s"].location'%bone.name
+            data_path_rot = 'pose.bones["%s"].%s'%(bone.name, data_path_rot)
+            for i, idx in enumerate(indices):
+                if i < 3:
+                    c = action.fcurves.new(data_path=data_path, index=i, action_group=bone.name)
+                else:
+                    c = action.fcurves.new(data_path=data_path_rot, index=i-3, action_group=bone.name)
+                self.__setKeyframes(c, values[:, (0, 1+i)], interp[:, idx:idx+16:4], extra_frame)
 
         # ensure IK's default state
         for b in armObj.pose.bones:
@@ -429,18 +427,24 @@ class VMDImporter:
         if len(propertyAnim) < 1:
             return
         logging.info('---- IK animations:%5d  target: %s', len(propertyAnim), armObj.name)
+        ik_keys = {}
         for keyFrame in propertyAnim:
             logging.debug('(IK) frame:%5d  list: %s', keyFrame.frame_number, keyFrame.ik_states)
             frame = keyFrame.frame_number + self.__frame_margin
             for ikName, enable in keyFrame.ik_states:
                 bone = pose_bones.get(ikName, None)
                 if bone:
-                    bone.mmd_ik_toggle = enable
-                    bone.keyframe_insert(data_path='mmd_ik_toggle', frame=frame)
+                    bone_keys = ik_keys.setdefault(bone.name, (bone, {}))[1]
+                    bone_keys.pop(frame, None)
+                    bone_keys[frame] = bool(enable)
+        for bone, bone_keys in ik_keys.values():
+            bone.mmd_ik_toggle = list(bone_keys.values())[-1]
+            c = action.fcurves.new(data_path=bone.path_from_id('mmd_ik_toggle'), action_group=bone.name)
+            self.__setConstantKeyframes(c, bone_keys)
 
 
     def __assignToMesh(self, meshObj, action_name=None):
-        shapeKeyAnim = self.__vmdFile.shapeKeyAnimation
+        shapeKeyAnim = self.__vmdFile.shapeKeyAnimationRecords
         logging.info('---- morph animations:%5d  target: %s', len(shapeKeyAnim), meshObj.name)
         if len(shapeKeyAnim) < 1:
             return
@@ -460,14 +464,16 @@ class VMDImporter:
             logging.info('(mesh) frames:%5d  name: %s', len(keyFrames), name)
             shapeKey = shapeKeyDict[name]
             fcurve = action.fcurves.new(data_path='key_blocks["%s"].value'%shapeKey.name)
+            keyFrames = keyFrames[np.argsort(keyFrames['frame_number'], kind='stable')]
+            weights = keyFrames['weight']
+            co = np.empty((len(keyFrames), 2), dtype=np.float32)
+            co[:, 0] = keyFrames['frame_number'] + self.__frame_margin
+            co[:, 1] = weights
             fcurve.keyframe_points.add(len(keyFrames))
-            keyFrames.sort(key=lambda x:x.frame_number)
-            for k, v in zip(keyFrames, fcurve.keyframe_points):
-                v.co = (k.frame_number+self.__frame_margin, k.weight)
-                v.interpolation = 'LINEAR'
-            weights = tuple(i.weight for i in keyFrames)
-            shapeKey.slider_min = min(shapeKey.slider_min, floor(min(weights)))
-            shapeKey.slider_max = max(shapeKey.slider_max, ceil(max(weights)))
+            fcurve.keyframe_points.foreach_set('co', co.ravel())
+            _setKeyframeEnum(fcurve.keyframe_points, 'interpolation', 'LINEAR')
+            shapeKey.slider_min = min(shapeKey.slider_min, floor(weights.min()))
+            shapeKey.slider_max = max(shapeKey.slider_max, ceil(weights.max()))
 
 
     def __assignToRoot(self, rootObj, action_name=None):
@@ -481,10 +487,14 @@ class VMDImporter:
         rootObj.animation_data_create().action = action
 
         logging.debug('(Display) list(frame, show): %s', [(keyFrame.frame_number, bool(keyFrame.visible)) for keyFrame in propertyAnim])
+        keys = {}
         for keyFrame in propertyAnim:
-            rootObj.mmd_root.show_meshes = keyFrame.visible
-            rootObj.keyframe_insert(data_path='mmd_root.show_meshes',
-                                    frame=keyFrame.frame_number+self.__frame_margin)
+            frame = keyFrame.frame_number + self.__frame_margin
+            keys.pop(frame, None)
+            keys[frame] = bool(keyFrame.visible)
+        rootObj.mmd_root.show_meshes = list(keys.values())[-1]
+        fcurve = action.fcurves.new(data_path='mmd_root.show_meshes')
+        self.__setConstantKeyframes(fcurve, keys)
 
 
     @staticmethod
@@ -92,5 +92,5 @@ class MMDSDEFPanel(_PanelBase, Panel):
         c.operator('mmd_tools.sdef_bind', text='Bind')
         c.operator('mmd_tools.sdef_unbind', text='Unbind')
         row = c.row()
-        row.label(text='Cache Info: %d data'%(len(FnSDEF.g_verts)), icon='INFO')
+        row.label(text='Cache Info: %d data'%(len(FnSDEF.g_cache)), icon='INFO')
         row.operator('mmd_tools.sdef_cache_reset', text='', icon='X')
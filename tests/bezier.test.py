@@ -0,0 +1,223 @@
+# MIT License
+
+# Copyright (c) 2017 GiveMeAllYourCats
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Code author: GiveMeAllYourCats
+# Repo: https://github.com/michaeldegroot/cats-blender-plugin
+# Edits by: GiveMeAllYourCats
+
+import unittest
+import random
+import math
+import time
+import sys
+import bpy
+import numpy as np
+
+from mathutils import Vector
+from mmd_tools_local.core.vmd import bezier
+from mmd_tools_local.core.vmd.importer import _FnBezier
+
+
+# Random VMD interpolation curves from (0, 0) to (127, 127), including straight and flat ones
+def create_curves(count):
+    rnd = random.Random(1)
+    curves = []
+    for i in range(count):
+        if i % 10 == 0:
+            p1, p2 = (20, 20), (107, 107)
+        elif i % 10 == 1:
+            p1, p2 = (127, 0), (0, 127)
+        else:
+            p1, p2 = (rnd.randint(0, 127), rnd.randint(0, 127)), (rnd.randint(0, 127), rnd.randint(0, 127))
+        curves.append(((0, 0), p1, p2, (127, 127)))
+    values = [rnd.choice([0, 127, rnd.uniform(0, 127)]) for _ in range(count)]
+    return curves, values
+
+
+def to_arrays(curves):
+    return [np.array(points, dtype=np.float64) for points in zip(*curves)]
+
+
+def scalar_x(curve, t):
+    (x0, _), (x1, _), (x2, _), (x3, _) = curve
+    return (1-t)**3*x0 + 3*(1-t)**2*t*x1 + 3*(1-t)*t*t*x2 + t**3*x3
+
+
+# A copy of the scalar root finder _FnBezier used before the bezier module, used as the reference for accuracy and speed
+def old_find_roots(a, b, c, d): # a*t*t*t + b*t*t + c*t + d = 0
+    if a == 0:
+        if b == 0:
+            t = -d/c
+            if 0 <= t <= 1:
+                yield t
+        else:
+            D = c*c - 4*b*d
+            if D < 0:
+                return
+            D = D**0.5
+            b2 = 2*b
+            t = (-c + D)/b2
+            if 0 <= t <= 1:
+                yield t
+            t = (-c - D)/b2
+            if 0 <= t <= 1:
+                yield t
+        return
+
+    def _sqrt3(v):
+        return -((-v)**(1/3)) if v < 0 else v**(1/3)
+
+    A = b*c/(6*a*a) - b*b*b/(27*a*a*a) - d/(2*a)
+    B = c/(3*a) - b*b/(9*a*a)
+    b_3a = -b/(3*a)
+    D = A*A + B*B*B
+
+    if D > 0:
+        D = D**0.5
+        t = b_3a + _sqrt3(A+D) + _sqrt3(A-D)
+        if 0 <= t <= 1:
+            yield t
+    elif D == 0:
+        t = b_3a + _sqrt3(A)*2
+        if 0 <= t <= 1:
+            yield t
+        t = b_3a - _sqrt3(A)
+        if 0 <= t <= 1:
+            yield t
+    else:
+        R = A / (-B*B*B)**0.5
+        t = b_3a + 2*(-B)**0.5 * math.cos(math.acos(R) / 3)
+        if 0 <= t <= 1:
+            yield t
+        t = b_3a + 2*(-B)**0.5 * math.cos((math.acos(R) + 2*math.pi) / 3)
+        if 0 <= t <= 1:
+            yield t
+        t = b_3a + 2*(-B)**0.5 * math.cos((math.acos(R) - 2*math.pi) / 3)
+        if 0 <= t <= 1:
+            yield t
+
+
+# The old _FnBezier.axis_to_t, returns None where the old root finder missed the root
+def old_axis_to_t(curve, val):
+    (p0, _), (p1, _), (p2, _), (p3, _) = curve
+    a = p3 - p0 + 3 * (p1 - p2)
+    b = 3 * (p0 - 2*p1 + p2)
+    c = 3 * (p1 - p0)
+    d = p0 - val
+    return next(old_find_roots(a, b, c, d), None)
+
+
+# The old _FnBezier.find_critical
+def old_find_critical(curve):
+    (_, p0), (_, p1), (_, p2), (_, p3) = curve
+    p_min, p_max = (p0, p3) if p0 < p3 else (p3, p0)
+    if p1 > p_max or p1 < p_min or p2 > p_max or p2 < p_min:
+        a = 3 * (p3 - p0 + 3 * (p1 - p2))
+        b = 6 * (p0 - 2*p1 + p2)
+        c = 3 * (p1 - p0)
+        yield from old_find_roots(0, a, b, c)
+
+
+class TestAddon(unittest.TestCase):
+
+    def test_bezier_axis_to_t(self):
+        curves, values = create_curves(2000)
+        t = bezier.axis_to_t(*to_arrays(curves), np.array(values))
+        for curve, value, t_new in zip(curves, values, t.tolist()):
+            error_new = abs(scalar_x(curve, t_new) - value)
+            self.assertLess(error_new, 1e-9)
+
+            # The old code misses roots that land slightly outside of [0, 1] because of precision errors
+            t_old = old_axis_to_t(curve, value)
+            if t_old is None:
+                continue
+            self.assertLessEqual(error_new, max(abs(scalar_x(curve, t_old) - value), 1e-12))
+
+            # t is ill-conditioned where the curve is flat, x(t) is not
+            (x0, _), (x1, _), (x2, _), (x3, _) = curve
+            slope = 3*(1-t_new)**2*(x1-x0) + 6*(1-t_new)*t_new*(x2-x1) + 3*t_new*t_new*(x3-x2)
+            if slope > 1:
+                self.assertAlmostEqual(t_new, t_old, delta=1e-9)
+
+    def test_bezier_split(self):
+        curves, values = create_curves(200)
+        p0, p1, p2, p3 = to_arrays(curves)
+        t = bezier.axis_to_t(p0, p1, p2, p3, np.array(values))
+        parts = bezier.split(p0, p1, p2, p3, np.zeros(len(t)), t)
+        points = bezier.evaluate(p0, p1, p2, p3, t)
+        for i, curve in enumerate(curves):
+            part, _, point = _FnBezier(*(Vector(p) for p in curve)).split(float(t[i]))
+            for p_scalar, p_batched in zip(part.points, parts):
+                self.assertAlmostEqual((p_scalar - Vector(p_batched[i])).length, 0, delta=1e-4)
+            self.assertAlmostEqual((point - Vector(points[i])).length, 0, delta=1e-4)
+
+    def test_bezier_find_critical(self):
+        rnd = random.Random(1)
+        curves = [[(rnd.uniform(0, 127), rnd.uniform(-100, 200)) for _ in range(4)] for _ in range(500)]
+        p0, p1, p2, p3 = to_arrays(curves)
+        t, valid = bezier.find_critical(p0, p1, p2, p3)
+
+        # Count the extremes independently by the sign changes of dy on a dense grid
+        grid = np.linspace(0, 1, 100001)
+        y0, y1, y2, y3 = p0[:, 1:], p1[:, 1:], p2[:, 1:], p3[:, 1:]
+        dy = 3*(1-grid)**2*(y1-y0) + 6*(1-grid)*grid*(y2-y1) + 3*grid*grid*(y3-y2)
+        sign_changes = np.count_nonzero(np.sign(dy[:, 1:]) != np.sign(dy[:, :-1]), axis=1)
+
+        counts = [0, 0, 0]
+        for i, curve in enumerate(curves):
+            t_new = sorted(t[i][valid[i]].tolist())
+            t_old = sorted(old_find_critical(curve))
+            self.assertEqual(len(t_new), len(t_old))
+            for t_a, t_b in zip(t_new, t_old):
+                self.assertAlmostEqual(t_a, t_b, delta=1e-9)
+
+            # Only curves which overshoot their end points have critical points
+            y = [p[1] for p in curve]
+            if min(y[0], y[3]) <= min(y[1], y[2]) and max(y[1], y[2]) <= max(y[0], y[3]):
+                self.assertEqual(len(t_new), 0)
+            else:
+                self.assertEqual(len(t_new), sign_changes[i])
+            counts[len(t_new)] += 1
+
+        # Curves without, with one and with two critical points were all checked
+        self.assertTrue(all(counts))
+
+    def test_bezier_benchmark(self):
+        curves, values = create_curves(2000)
+
+        start = time.time()
+        for curve, value in zip(curves, values):
+            old_axis_to_t(curve, value)
+        time_scalar = time.time() - start
+
+        start = time.time()
+        bezier.axis_to_t(*to_arrays(curves), np.array(values))
+        time_batched = time.time() - start
+
+        print('Solved x -> t of', len(curves), 'curves:',
+              'scalar', round(time_scalar, 3), 's, batched', round(time_batched, 3), 's')
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
@@ -0,0 +1,203 @@
+# MIT License
+
+# Copyright (c) 2017 GiveMeAllYourCats
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Code author: GiveMeAllYourCats
+# Repo: https://github.com/michaeldegroot/cats-blender-plugin
+# Edits by: GiveMeAllYourCats
+
+import unittest
+import random
+import math
+import time
+import sys
+import bpy
+import numpy as np
+
+from cats.tools import decimation as Decimation
+
+
+# Random vertex group assignments sorted by vertex, like Common.WeightTable has them. Every vertex has 1 to 4 of 30 groups
+def create_weights(vertex_count, rnd):
+    vertex_indices, group_indices, weights = [], [], []
+    for vertex in range(vertex_count):
+        for group in sorted(rnd.sample(range(30), rnd.randint(1, 4))):
+            vertex_indices.append(vertex)
+            group_indices.append(group)
+            weights.append(rnd.random())
+    return np.array(vertex_indices, dtype=np.int64), np.array(group_indices, dtype=np.int64), np.array(weights)
+
+
+# Shape keys that each move a random part of the mesh, created one at a time like they are read from the mesh
+def create_shape_key_cos(basis_co, shape_key_count, rnd):
+    for _ in range(shape_key_count):
+        co = basis_co.copy()
+        start = rnd.randrange(len(co))
+        co[start:start + len(co) // 10] += rnd.random()
+        yield co
+
+
+# The scalar reference: the per vertex dicts that the auto decimation used before
+def scalar_animation_weights(vertex_indices, group_indices, group_weights, basis_co, shape_key_cos):
+    vertex_groups = {}
+    for vertex, group, weight in zip(vertex_indices.tolist(), group_indices.tolist(), group_weights.tolist()):
+        vertex_groups.setdefault(vertex, []).append((group, weight))
+
+    weights = {}
+    for vertex, groups in vertex_groups.items():
+        for idx1, (group1, weight1) in enumerate(groups):
+            for idx2, (group2, weight2) in enumerate(groups):
+                if idx1 != idx2:
+                    weights.setdefault((group1, group2), {})[vertex] = weight1 * weight2
+
+    new_weights = {}
+    for weighting in weights.values():
+        m_min = min(min(weighting.values()), 1)
+        m_max = max(max(weighting.values()), 0)
+        for vertex, weight in weighting.items():
+            if m_max != m_min:
+                weight = (weight - m_min) / (m_max - m_min)
+            new_weights[vertex] = max(new_weights.get(vertex, weight), weight)
+
+    for co in shape_key_cos:
+        movement = [math.sqrt(sum((a - b) ** 2 for a, b in zip(v0, v1))) for v0, v1 in zip(basis_co.tolist(), co.tolist())]
+        m_min = min(movement)
+        m_max = max(max(movement), 0)
+        for vertex, weight in enumerate(movement):
+            if m_max != m_min:
+                weight = (weight - m_min) / (m_max - m_min)
+            new_weights[vertex] = max(new_weights.get(vertex, weight), weight)
+    return new_weights
+
+
+class TestAddon(unittest.TestCase):
+
+    def test_animation_weights(self):
+        rnd = random.Random(1)
+        vertex_count = 2000
+        vertex_indices, group_indices, group_weights = create_weights(vertex_count, rnd)
+        basis_co = np.array([(rnd.random(), rnd.random(), rnd.random()) for _ in range(vertex_count)])
+        shape_key_cos = list(create_shape_key_cos(basis_co, 10, rnd))
+
+        weights, weighted = Decimation.get_animation_weights(vertex_count, vertex_indices, group_indices, group_weights,
+                                                             basis_co, iter(shape_key_cos))
+        expected = scalar_animation_weights(vertex_indices, group_indices, group_weights, basis_co, shape_key_cos)
+
+        self.assertEqual(sorted(expected.keys()), np.flatnonzero(weighted).tolist())
+        for vertex, weight in expected.items():
+            self.assertAlmostEqual(weights[vertex], weight, delta=1e-9)
+
+    def test_animation_weights_without_shape_keys(self):
+        rnd = random.Random(2)
+        vertex_indices, group_indices, group_weights = create_weights(500, rnd)
+        weights, weighted = Decimation.get_animation_weights(500, vertex_indices, group_indices, group_weights)
+        expected = scalar_animation_weights(vertex_indices, group_indices, group_weights, None, [])
+
+        self.assertEqual(sorted(expected.keys()), np.flatnonzero(weighted).tolist())
+        for vertex, weight in expected.items():
+            self.assertAlmostEqual(weights[vertex], weight, delta=1e-9)
+
+    def test_distribute_tris(self):
+        # Enough tris left, no mesh gets more than it has
+        meshes, current_tris_count = Decimation.distribute_tris([['a', 'KEEP', 100, 1, 0], ['b', 'CLEAR', 200, 1, 0]], 1000)
+        self.assertEqual(current_tris_count, 300)
+        self.assertEqual([mesh[3] for mesh in meshes], [100, 200])
+
+        # A mesh with large tris would get more than it has, it keeps its tris and the rest goes to the other mesh
+        meshes, _ = Decimation.distribute_tris([['a', 'KEEP', 10, 1000, 0], ['b', 'KEEP', 1000, 10, 0]], 500)
+        self.assertEqual([mesh[3] for mesh in meshes], [10, 490])
+
+        # Meshes that don't get decimated and fixed tris count towards the model, but aren't part of the budget
+        meshes, current_tris_count = Decimation.distribute_tris([['a', None, 300, 1, 0], ['b', 'KEEP', 400, 1, 0],
+                                                                 ['c', 'KEEP', 400, 1, 0]], 700, fixed_tris=100)
+        self.assertEqual(current_tris_count, 1200)
+        self.assertEqual([mesh[0] for mesh in meshes], ['b', 'c'])
+        self.assertEqual([mesh[3] for mesh in meshes], [150, 150])
+
+        # Shape keys in SMART mode get a bigger share
+        meshes, _ = Decimation.distribute_tris([['a', 'SMART', 1000, 1, 16], ['b', 'CLEAR', 1000, 1, 0]], 1000)
+        self.assertGreater(meshes[0][3], meshes[1][3])
+        self.assertAlmostEqual(meshes[0][3] + meshes[1][3], 1000, delta=1)
+
+        # A tiny mesh keeps at least 1 tri instead of getting a ratio of 0
+        meshes, _ = Decimation.distribute_tris([['a', 'KEEP', 2, 0.001, 0], ['b', 'KEEP', 10000, 1000, 0]], 100)
+        self.assertEqual(meshes[0][3], 1)
+
+    def test_separate_fingers(self):
+        # Two phalanges: a and e are only in IndexFinger1, b is in both, c is only in IndexFinger2, d is in no finger
+        mesh = bpy.data.meshes.new('fingers')
+        mesh.from_pydata([(0, 0, 0), (1, 1, 0), (2, 0, 0), (3, 1, 0), (0, 1, 0)], [], [(0, 1, 2), (1, 3, 2), (0, 4, 1)])
+        obj = bpy.data.objects.new('fingers', mesh)
+        if hasattr(bpy.context.scene, 'collection'):
+            bpy.context.scene.collection.objects.link(obj)
+        else:
+            bpy.context.scene.objects.link(obj)
+        obj.vertex_groups.new(name='IndexFinger1_L').add([0, 1, 4], 1, 'REPLACE')
+        obj.vertex_groups.new(name='IndexFinger2_L').add([1, 2], 1, 'REPLACE')
+
+        # The face across the joint goes with the fingers even though its vertices don't share a group
+        fingers = Decimation.separate_fingers(obj)
+        self.assertIsNotNone(fingers)
+        self.assertEqual(len(fingers.data.polygons), 2)
+        self.assertEqual(len(obj.data.polygons), 1)
+        self.assertEqual(sorted(obj.data.vertices[i].co.x for i in obj.data.polygons[0].vertices), [1, 2, 3])
+
+    def test_set_vertex_group_weights(self):
+        vertex_count = 10000
+        rnd = random.Random(4)
+        mesh = bpy.data.meshes.new('weights')
+        mesh.from_pydata([(i, rnd.random(), 0) for i in range(vertex_count)], [], [(i, i + 1, i + 2) for i in range(0, vertex_count - 2, 3)])
+        obj = bpy.data.objects.new('weights', mesh)
+        obj.vertex_groups.new(name='other').add([0, 1, 2], 0.5, 'REPLACE')
+        vertex_group = obj.vertex_groups.new(name='CATS Animation')
+
+        indices = np.array(sorted(rnd.sample(range(vertex_count), vertex_count // 2)), dtype=np.int64)
+        weights = np.array([rnd.random() for _ in indices])
+        start = time.time()
+        Decimation.set_vertex_group_weights(obj, vertex_group.index, indices, weights)
+        print('Wrote', len(indices), 'continuous weights in', round(time.time() - start, 3), 's')
+
+        written = {vertex.index: group.weight for vertex in obj.data.vertices for group in vertex.groups if group.group == vertex_group.index}
+        self.assertEqual(sorted(written.keys()), indices.tolist())
+        for index, weight in zip(indices.tolist(), weights.tolist()):
+            self.assertAlmostEqual(written[index], weight, places=6)
+        self.assertEqual([group.weight for group in obj.data.vertices[0].groups if group.group == 0], [0.5])
+
+    def test_animation_weights_benchmark(self):
+        rnd = random.Random(3)
+        shape_key_count = 200
+        for vertex_count in [25000, 50000, 100000]:
+            vertex_indices, group_indices, group_weights = create_weights(vertex_count, rnd)
+            basis_co = np.random.RandomState(vertex_count).random_sample((vertex_count, 3))
+
+            start = time.time()
+            Decimation.get_animation_weights(vertex_count, vertex_indices, group_indices, group_weights,
+                                             basis_co, create_shape_key_cos(basis_co, shape_key_count, rnd))
+            time_weights = time.time() - start
+
+            print('Animation weights of', vertex_count, 'vertices with', shape_key_count, 'shape keys:',
+                  round(time_weights, 3), 's,', round(time_weights / vertex_count * 1e6, 2), 'us per vertex')
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
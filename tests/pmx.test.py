@@ -0,0 +1,154 @@
+# MIT License
+
+# Copyright (c) 2017 GiveMeAllYourCats
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Code author: GiveMeAllYourCats
+# Repo: https://github.com/michaeldegroot/cats-blender-plugin
+# Edits by: GiveMeAllYourCats
+
+import unittest
+import tempfile
+import random
+import shutil
+import sys
+import os
+import bpy
+
+from mmd_tools_local.core import pmx
+
+
+# A small model with every weight type, additional UVs and vertex/UV morphs
+def create_model(vertex_count=300, bone_count=300, additional_uvs=2):
+    rnd = random.Random(1)
+    model = pmx.Model()
+    model.name = model.name_e = 'test'
+    model.comment = model.comment_e = 'test'
+
+    for i in range(bone_count):
+        bone = pmx.Bone()
+        bone.name = 'bone' + str(i)
+        bone.location = (rnd.random(), rnd.random(), rnd.random())
+        model.bones.append(bone)
+
+    for i in range(vertex_count):
+        vertex = pmx.Vertex()
+        vertex.co = [rnd.random() for _ in range(3)]
+        vertex.normal = [rnd.random() for _ in range(3)]
+        vertex.uv = [rnd.random() for _ in range(2)]
+        vertex.additional_uvs = [[rnd.random() for _ in range(4)] for _ in range(additional_uvs)]
+        vertex.edge_scale = rnd.random()
+
+        weight = vertex.weight = pmx.BoneWeight()
+        weight.type = i % 4
+        if weight.type == pmx.BoneWeight.BDEF1:
+            weight.bones = [rnd.randrange(-1, bone_count)]
+        elif weight.type == pmx.BoneWeight.BDEF2:
+            weight.bones = [rnd.randrange(bone_count) for _ in range(2)]
+            weight.weights = [rnd.random()]
+        elif weight.type == pmx.BoneWeight.BDEF4:
+            weight.bones = [rnd.randrange(bone_count) for _ in range(4)]
+            weight.weights = [rnd.random() for _ in range(4)]
+        else:
+            weight.bones = [rnd.randrange(bone_count) for _ in range(2)]
+            weight.weights = pmx.BoneWeightSDEF(rnd.random(), (1, 2, 3), (4, 5, 6), (7, 8, 9))
+        model.vertices.append(vertex)
+
+    model.faces = [[rnd.randrange(vertex_count) for _ in range(3)] for _ in range(vertex_count * 2)]
+    material = pmx.Material()
+    material.name = 'material'
+    material.diffuse = (1, 1, 1, 1)
+    material.specular = material.ambient = (0.5, 0.5, 0.5)
+    material.edge_color = (0, 0, 0, 1)
+    material.vertex_count = len(model.faces) * 3
+    model.materials.append(material)
+
+    for i in range(3):
+        morph = pmx.VertexMorph('vertex' + str(i), '', 4)
+        for index in rnd.sample(range(vertex_count), vertex_count // 3):
+            offset = pmx.VertexMorphOffset()
+            offset.index = index
+            offset.offset = (rnd.random(), rnd.random(), rnd.random())
+            morph.offsets.append(offset)
+        model.morphs.append(morph)
+
+        morph = pmx.UVMorph('uv' + str(i), '', 4, type_index=3 + i)
+        for index in rnd.sample(range(vertex_count), vertex_count // 5):
+            offset = pmx.UVMorphOffset()
+            offset.index = index
+            offset.offset = (rnd.random(), rnd.random(), rnd.random(), rnd.random())
+            morph.offsets.append(offset)
+        model.morphs.append(morph)
+    return model
+
+
+class TestAddon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            return file.read()
+
+    def test_pmx_round_trip(self):
+        # 300 vertices use 2 byte vertex and bone indices, 70000 vertices use 4 byte vertex indices
+        for vertex_count, additional_uvs in [(0, 0), (300, 2), (70000, 1)]:
+            path = os.path.join(self.directory, 'model.pmx')
+            pmx.save(path, create_model(vertex_count, additional_uvs=additional_uvs), add_uv_count=additional_uvs)
+
+            # Saved straight from the loaded vertex arrays
+            model = pmx.load(path)
+            self.assertEqual(model.vertexCount(), vertex_count)
+            self.assertEqual(len(model.morphs), 6)
+            pmx.save(os.path.join(self.directory, 'arrays.pmx'), model, add_uv_count=additional_uvs)
+            self.assertEqual(self.read('model.pmx'), self.read('arrays.pmx'))
+
+            # Saved from the vertex objects
+            model = pmx.load(path)
+            self.assertEqual(len(model.vertices), vertex_count)
+            pmx.save(os.path.join(self.directory, 'vertices.pmx'), model, add_uv_count=additional_uvs)
+            self.assertEqual(self.read('model.pmx'), self.read('vertices.pmx'))
+
+    def test_pmx_vertices(self):
+        original = create_model()
+        path = os.path.join(self.directory, 'model.pmx')
+        pmx.save(path, original, add_uv_count=2)
+        model = pmx.load(path)
+
+        self.assertEqual(len(model.materials), 1)
+        self.assertEqual(len(model.morphs), len(original.morphs))
+        self.assertEqual(model.faces, original.faces)
+        for v1, v2 in zip(original.vertices, model.vertices):
+            for a, b in [(v1.co, v2.co), (v1.normal, v2.normal), (v1.uv, v2.uv)] + list(zip(v1.additional_uvs, v2.additional_uvs)):
+                for x, y in zip(a, b):
+                    self.assertAlmostEqual(x, y, places=5)
+            self.assertEqual(v1.weight.type, v2.weight.type)
+            self.assertEqual(list(v1.weight.bones), list(v2.weight.bones))
+        for m1, m2 in zip(original.morphs, model.morphs):
+            self.assertEqual([o.index for o in m1.offsets], [o.index for o in m2.offsets])
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
@@ -0,0 +1,113 @@
+# MIT License
+
+# Copyright (c) 2017 GiveMeAllYourCats
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Code author: GiveMeAllYourCats
+# Repo: https://github.com/michaeldegroot/cats-blender-plugin
+# Edits by: GiveMeAllYourCats
+
+import unittest
+import sys
+import bpy
+
+from mmd_tools_local.core.model import Model
+
+
+# A chain of small spheres that don't collide with any group, so close rigid bodies get non collision constraints
+def create_rig(rigid_count):
+    rig = Model.create('test', 'test', add_root_bone=True)
+    rigids = []
+    for i, obj in enumerate(rig.createRigidBodyPool(rigid_count)):
+        rigids.append(rig.createRigidBody(
+            obj=obj,
+            name='rigid' + str(i),
+            shape_type=0,
+            dynamics_type=1,
+            location=(i * 0.05, 0, 1),
+            rotation=(0, 0, 0),
+            size=(0.1, 0, 0),
+            collision_group_number=i % 16,
+            collision_group_mask=[True] * 16,
+        ))
+
+    for i, obj in enumerate(rig.createJointPool(rigid_count - 1)):
+        rig.createJoint(
+            obj=obj,
+            name='joint' + str(i),
+            location=(i * 0.05 + 0.025, 0, 1),
+            rotation=(0, 0, 0),
+            rigid_a=rigids[i],
+            rigid_b=rigids[i + 1],
+            maximum_location=(0, 0, 0),
+            minimum_location=(0, 0, 0),
+            maximum_rotation=(0, 0, 0),
+            minimum_rotation=(0, 0, 0),
+            spring_linear=(0, 0, 0),
+            spring_angular=(0, 0, 0),
+        )
+    return rig, rigids
+
+
+def get_world_objects():
+    world = bpy.context.scene.rigidbody_world
+    if bpy.app.version < (2, 80, 0):
+        return set(world.group.objects), set(world.constraints.objects)
+    return set(world.collection.objects), set(world.constraints.objects)
+
+
+class TestAddon(unittest.TestCase):
+
+    def test_rigid_body_build(self):
+        for rigid_count in [1, 2, 30]:
+            rig, created_rigids = create_rig(rigid_count)
+            rig.build()
+
+            rigids = list(rig.rigidBodies())
+            joints = list(rig.joints())
+            non_collision = [obj for obj in rig.temporaryObjects() if obj.mmd_type == 'NON_COLLISION_CONSTRAINT']
+            self.assertEqual(len(rigids), rigid_count)
+            self.assertEqual(len(joints), rigid_count - 1)
+
+            # Every copy has to be part of the simulation and have its own mesh
+            rigid_objects, constraint_objects = get_world_objects()
+            self.assertTrue(all(obj in rigid_objects for obj in rigids))
+            self.assertTrue(all(obj in constraint_objects for obj in joints + non_collision))
+            self.assertEqual(len({obj.data.name for obj in rigids}), rigid_count)
+            self.assertTrue(all(obj.rigid_body is not None for obj in rigids))
+
+            # Neighbours are connected by joints, the others that are close get non collision constraints
+            self.assertEqual({frozenset((obj.rigid_body_constraint.object1, obj.rigid_body_constraint.object2)) for obj in joints},
+                             {frozenset(created_rigids[i:i + 2]) for i in range(rigid_count - 1)})
+            self.assertTrue(all(obj.rigid_body_constraint.disable_collisions for obj in joints + non_collision))
+            if rigid_count > 2:
+                self.assertGreater(len(non_collision), 0)
+                pairs = {frozenset((obj.rigid_body_constraint.object1, obj.rigid_body_constraint.object2)) for obj in non_collision}
+                self.assertEqual(len(pairs), len(non_collision))
+                self.assertTrue(all(len(pair) == 2 and pair <= set(rigids) for pair in pairs))
+
+            rig.clean()
+            self.assertEqual(len([obj for obj in rig.temporaryObjects() if obj.mmd_type == 'NON_COLLISION_CONSTRAINT']), 0)
+
+
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
+runner = unittest.TextTestRunner()
+ret = not runner.run(suite).wasSuccessful()
+sys.exit(ret)
@@ -25,15 +25,138 @@
 # Edits by: GiveMeAllYourCats
 
 import unittest
+import threading
+import json
+import time
+import os
 import sys
 import bpy
 
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote
+from cats.tools import translate as Translate
+from cats.tools import translate_google as TranslateGoogle
+
+
+# Answers like Google Translate, translating every line to 'EN(line)'. The first request gets rejected as spam
+class GoogleStubHandler(BaseHTTPRequestHandler):
+    requests_received = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        rpc = json.loads(unquote(data[len('f.req='):-1]))
+        text = json.loads(rpc[0][0][1])[0][0]
+        GoogleStubHandler.requests_received.append(text)
+
+        if len(GoogleStubHandler.requests_received) == 1:
+            self.send_response(429)
+            self.end_headers()
+            return
+
+        lines = text.split('\n')
+        sentences = [['EN(' + line + ')' + ('\n' if i < len(lines) - 1 else '')] for i, line in enumerate(lines)]
+        payload = [None, [[[None, None, None, None, None, sentences]]]]
+        response = json.dumps([['wrb.fr', 'MkEWBc', json.dumps(payload), None, None, None, 'generic']])[:-1]
+        response = (")]}'\n\n123\n" + response + '\n').encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
 
 class TestAddon(unittest.TestCase):
     def test_translate_shapekeys(self):
         result = bpy.ops.cats_translate.shapekeys()
         self.assertTrue(result == {'FINISHED'})
 
+    def test_translation_matcher(self):
+        Translate.load_translations()
+        dictionary = Translate.dictionary
+        matcher = Translate.TranslationMatcher(dictionary.items())
+
+        # The old greedy replacement over the length sorted dictionary
+        def translate_old(to_translate, length, addition=''):
+            translated_count = 0
+            for key, value in dictionary.items():
+                if key in to_translate:
+                    if not value:
+                        continue
+                    to_translate = to_translate.replace(key, addition + value)
+                    translated_count += len(key)
+                    if translated_count >= length:
+                        break
+            return to_translate, translated_count
+
+        keys = list(dictionary.keys())
+        names = []
+        for i in range(len(keys)):
+            names.append(keys[i])
+            names.append(keys[i] + '.L')
+            names.append(keys[i - 1] + '_' + keys[i] + keys[i - 7])
+
+        for name in names:
+            for addition in ['', ' ']:
+                self.assertEqual(translate_old(name, len(name), addition), matcher.replace(name, len(name), addition))
+
+        start = time.time()
+        for name in names:
+            translate_old(name, len(name))
+        time_old = time.time() - start
+
+        start = time.time()
+        for name in names:
+            matcher.replace(name, len(name))
+        time_new = time.time() - start
+
+        print('Translated', len(names), 'names with', len(dictionary), 'dictionary entries:',
+              'old', round(time_old, 3), 's, matcher', round(time_new, 3), 's')
+
+    def test_translate_names(self):
+        names = [bone.name for bone in Translate.get_bones_to_translate()]
+        translations = Translate.translate_names(names + names)
+        for name in names:
+            translated_name, translated = Translate.translate(name)
+            self.assertEqual(translations.get(name, name), translated_name)
+            self.assertEqual(name in translations, translated)
+
+    def test_dictionary_cache(self):
+        if os.path.isfile(Translate.dictionary_cache_file):
+            os.remove(Translate.dictionary_cache_file)
+
+        # The first load parses the dictionary files and creates the cache, the second one loads the cache
+        self.assertTrue(Translate.load_translations())
+        self.assertTrue(os.path.isfile(Translate.dictionary_cache_file))
+        dictionary_parsed = dict(Translate.dictionary)
+        names = list(dictionary_parsed.keys())
+        translations_parsed = [Translate.get_matcher().replace(name, len(name)) for name in names]
+
+        self.assertTrue(Translate.load_translations())
+        self.assertEqual(dictionary_parsed, dict(Translate.dictionary))
+        self.assertEqual(translations_parsed, [Translate.get_matcher().replace(name, len(name)) for name in names])
+
+    def test_google_translator_stub(self):
+        server = HTTPServer(('127.0.0.1', 0), GoogleStubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        translator = TranslateGoogle.GoogleTranslator(url='http://127.0.0.1:' + str(server.server_address[1]) + '/',
+                                                      workers=1, rate=100, burst=10, chunk_size=4, backoff=0.01)
+        texts = ['名前' + str(i) for i in range(10)]
+        batches = []
+        translator.translate(texts, batches.append)
+        server.shutdown()
+
+        # The spam error gets retried, the batches arrive in order and every batch is a single request
+        translations = {}
+        for batch in batches:
+            translations.update(batch)
+        self.assertEqual(list(translations.keys()), texts)
+        self.assertEqual(list(translations.values()), ['EN(' + text + ')' for text in texts])
+        self.assertEqual(len(GoogleStubHandler.requests_received), 4)
+
 
 suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestAddon)
 runner = unittest.TextTestRunner()
@@ -21,6 +21,7 @@ if "bpy" not in locals():
     from . import settings
     from . import shapekey
     from . import supporter
+    from . import translate_google
     from . import translate
     from . import translations
     from . import viseme
@@ -47,6 +48,7 @@ else:
     importlib.reload(settings)
     importlib.reload(shapekey)
     importlib.reload(supporter)
+    importlib.reload(translate_google)
     importlib.reload(translate)
     importlib.reload(translations)
     importlib.reload(viseme)
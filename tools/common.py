@@ -29,6 +29,7 @@ import bpy
 import time
 import bmesh
 import platform
+import numpy as np
 
 from math import degrees
 from mathutils import Vector
@@ -337,25 +338,71 @@ def get_bone_angle(p1, p2):
     return ret
 
 
+# Sparse table of all vertex group weights of a mesh
+# The weights are read once into flat arrays of (vertex index, group index, weight), sorted by vertex,
+# so that the vertex groups can be queried with NumPy instead of looping over every vertex again
+class WeightTable:
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.group_count = len(mesh.vertex_groups)
+
+        # Vertex groups can't be read with foreach_get, so this is the only loop over the vertices
+        table = [(vertex.index, group.group, group.weight) for vertex in mesh.data.vertices for group in vertex.groups]
+        table = np.array(table, dtype=np.float64).reshape(-1, 3)
+
+        # Vertices can keep weights of vertex groups that don't exist anymore, those are ignored by every query
+        table = table[table[:, 1] < self.group_count]
+        self.vertex_indices = table[:, 0].astype(np.int64)
+        self.group_indices = table[:, 1].astype(np.int64)
+        self.weights = table[:, 2]
+
+    # Returns a mask of all vertex groups that have a vertex with a weight above the threshold
+    def used_groups(self, threshold=0):
+        used = np.zeros(self.group_count, dtype=bool)
+        used[self.group_indices[self.weights > threshold]] = True
+        return used
+
+    # Returns the indices of all vertex groups without a vertex with a weight above the threshold
+    def empty_groups(self, threshold=0):
+        return np.flatnonzero(~self.used_groups(threshold=threshold)).tolist()
+
+    # Returns whether any vertex is assigned to the vertex group, no matter its weight
+    def has_vertices(self, group_index):
+        return bool(np.any(self.group_indices == group_index))
+
+    # Returns the indices of all vertices in the vertex group with a weight above the threshold
+    def group_vertices(self, group_index, threshold=0):
+        return self.vertex_indices[(self.group_indices == group_index) & (self.weights > threshold)]
+
+    # Returns a dict of all vertex groups and the indices of their vertices with a weight not above the threshold
+    def zero_weight_vertices(self, threshold=0):
+        zero = self.weights <= threshold
+        group_indices = self.group_indices[zero]
+        vertex_indices = self.vertex_indices[zero]
+        return {int(group_index): vertex_indices[group_indices == group_index].tolist() for group_index in np.unique(group_indices)}
+
+    # Returns the average position of all vertices in the vertex group with a weight above the threshold
+    def group_center(self, group_index, threshold=0):
+        vertex_indices = self.group_vertices(group_index, threshold=threshold)
+        if not len(vertex_indices):
+            return None
+
+        co = np.empty(len(self.mesh.data.vertices) * 3, dtype=np.float32)
+        self.mesh.data.vertices.foreach_get('co', co)
+        return Vector(np.mean(co.reshape(-1, 3)[vertex_indices], axis=0, dtype=np.float64))
+
+
 def remove_unused_vertex_groups(ignore_main_bones=False):
     remove_count = 0
     unselect_all()
     for mesh in get_meshes_objects(mode=2):
         mesh.update_from_editmode()
 
-        vgroup_used = {i: False for i, k in enumerate(mesh.vertex_groups)}
-
-        for v in mesh.data.vertices:
-            for g in v.groups:
-                if g.weight > 0.0:
-                    vgroup_used[g.group] = True
-
-        for i, used in sorted(vgroup_used.items(), reverse=True):
-            if not used:
-                if ignore_main_bones and mesh.vertex_groups[i].name in Bones.dont_delete_these_main_bones:
-                    continue
-                mesh.vertex_groups.remove(mesh.vertex_groups[i])
-                remove_count += 1
+        for i in reversed(WeightTable(mesh).empty_groups()):
+            if ignore_main_bones and mesh.vertex_groups[i].name in Bones.dont_delete_these_main_bones:
+                continue
+            mesh.vertex_groups.remove(mesh.vertex_groups[i])
+            remove_count += 1
     return remove_count
 
 
@@ -364,63 +411,40 @@ def remove_unused_vertex_groups_of_mesh(mesh):
     unselect_all()
     mesh.update_from_editmode()
 
-    vgroup_used = {i: False for i, k in enumerate(mesh.vertex_groups)}
-
-    for v in mesh.data.vertices:
-        for g in v.groups:
-            if g.weight > 0.0:
-                vgroup_used[g.group] = True
-
-    for i, used in sorted(vgroup_used.items(), reverse=True):
-        if not used:
-            mesh.vertex_groups.remove(mesh.vertex_groups[i])
-            remove_count += 1
+    for i in reversed(WeightTable(mesh).empty_groups()):
+        mesh.vertex_groups.remove(mesh.vertex_groups[i])
+        remove_count += 1
     return remove_count
 
 
-def find_center_vector_of_vertex_group(mesh, vertex_group):
-    data = mesh.data
-    verts = data.vertices
-    verts_in_group = []
+# Pass in a WeightTable of the mesh when querying it multiple times, so that the weights only get read once
+def find_center_vector_of_vertex_group(mesh, vertex_group, weight_table=None):
+    vgroup = mesh.vertex_groups.get(vertex_group)
+    if vgroup is None:
+        return False
 
-    for vert in verts:
-        i = vert.index
-        try:
-            if mesh.vertex_groups[vertex_group].weight(i) > 0:
-                verts_in_group.append(vert)
-        except RuntimeError:
-            # vertex is not in the group
-            pass
+    if weight_table is None:
+        weight_table = WeightTable(mesh)
 
     # Find the average vector point of the vertex cluster
-    divide_by = len(verts_in_group)
-    total = Vector()
-
-    if divide_by == 0:
+    average = weight_table.group_center(vgroup.index)
+    if average is None:
         return False
 
-    for vert in verts_in_group:
-        total += vert.co
-
-    average = total / divide_by
-
     return average
 
 
-def vertex_group_exists(mesh_name, bone_name):
+def vertex_group_exists(mesh_name, bone_name, weight_table=None):
     mesh = get_objects()[mesh_name]
-    data = mesh.data
-    verts = data.vertices
+    vgroup = mesh.vertex_groups.get(bone_name)
+    if vgroup is None:
+        return False
 
-    for vert in verts:
-        i = vert.index
-        try:
-            mesh.vertex_groups[bone_name].weight(i)
-            return True
-        except:
-            pass
+    if weight_table is not None:
+        return weight_table.has_vertices(vgroup.index)
 
-    return False
+    # Without a table, stop at the first vertex in the group instead of reading every weight
+    return any(group.group == vgroup.index for vertex in mesh.data.vertices for group in vertex.groups)
 
 
 def get_meshes(self, context):
@@ -1322,56 +1346,130 @@ def sort_shape_keys(mesh_name, shape_key_order=None):
         if shape not in order:
             order.append(shape)
 
-    wm = bpy.context.window_manager
-    current_step = 0
-    wm.progress_begin(current_step, len(order))
+    key_blocks = mesh.data.shape_keys.key_blocks
+    new_order = get_shape_key_permutation([shapekey.name for shapekey in key_blocks], order)
+    if new_order != list(range(len(key_blocks))):
+        # Swapping the data of the shape keys renames them, which would mix up the paths of their animations and of
+        # all drivers reading them, even those of other objects. So animated shape keys are moved with the operator instead
+        if is_animation_target(mesh.data.shape_keys):
+            move_shape_keys(mesh, new_order)
+        else:
+            rebuild_shape_keys(mesh, new_order)
+
+    mesh.active_shape_key_index = 0
+
+
+# Checks if the ID is animated or read by a driver anywhere in the file
+def is_animation_target(id_data):
+    if id_data.animation_data:
+        return True
+
+    for collection_name in ['objects', 'meshes', 'shape_keys', 'armatures', 'materials', 'textures', 'node_groups',
+                            'cameras', 'lamps', 'lights', 'worlds', 'scenes']:
+        for data in getattr(bpy.data, collection_name, []):
+            animation_data = getattr(data, 'animation_data', None)
+            if not animation_data:
+                continue
+            for fcurve in animation_data.drivers:
+                for variable in fcurve.driver.variables:
+                    if any(target.id == id_data for target in variable.targets):
+                        return True
+    return False
+
+
+# Returns the new order of the shape keys as a list of their current indices
+# The named shape keys are placed at the top in the given order, all others keep their order below them
+def get_shape_key_permutation(shape_names, order):
+    indices = list(range(len(shape_names)))
+    positions = {name: index for index, name in enumerate(shape_names)}
 
     i = 0
     for name in order:
-        if name == 'Basis' and 'Basis' not in mesh.data.shape_keys.key_blocks:
+        if name == 'Basis' and 'Basis' not in positions:
+            # Keep the current reference key at the top
             i += 1
-            current_step += 1
-            wm.progress_update(current_step)
             continue
 
-        for index, shapekey in enumerate(mesh.data.shape_keys.key_blocks):
-            if shapekey.name == name:
-
-                mesh.active_shape_key_index = index
-                new_index = i
-                index_diff = (index - new_index)
-
-                if new_index >= len(mesh.data.shape_keys.key_blocks):
-                    bpy.ops.object.shape_key_move(type='BOTTOM')
-                    break
+        index = positions.get(name)
+        if index is None:
+            continue
 
-                position_correct = False
-                if 0 <= index_diff <= (new_index - 1):
-                    while position_correct is False:
-                        if mesh.active_shape_key_index != new_index:
-                            bpy.ops.object.shape_key_move(type='UP')
-                        else:
-                            position_correct = True
-                else:
-                    if mesh.active_shape_key_index > new_index:
-                        bpy.ops.object.shape_key_move(type='TOP')
+        indices.remove(index)
+        if i >= len(indices):
+            indices.append(index)
+            continue
 
-                    position_correct = False
-                    while position_correct is False:
-                        if mesh.active_shape_key_index != new_index:
-                            bpy.ops.object.shape_key_move(type='DOWN')
-                        else:
-                            position_correct = True
+        indices.insert(i, index)
+        i += 1
 
-                i += 1
-                break
+    return indices
 
-        current_step += 1
-        wm.progress_update(current_step)
 
-    mesh.active_shape_key_index = 0
+# Moves the shape keys into the new order with as few operator calls as possible
+def move_shape_keys(mesh, new_order):
+    current_order = list(range(len(new_order)))
+    for new_index, index in enumerate(new_order):
+        current_index = current_order.index(index)
+        if current_index == new_index:
+            continue
 
-    wm.progress_end()
+        # Everything above the new index is already in place, so the shape key only ever has to move up
+        mesh.active_shape_key_index = current_index
+        if current_index - new_index <= new_index + 1:
+            for _ in range(current_index - new_index):
+                bpy.ops.object.shape_key_move(type='UP')
+        else:
+            bpy.ops.object.shape_key_move(type='TOP')
+            for _ in range(new_index):
+                bpy.ops.object.shape_key_move(type='DOWN')
+
+        current_order.insert(new_index, current_order.pop(current_index))
+
+
+# Puts the shape keys into the new order in a single pass by copying their data around instead of moving them
+def rebuild_shape_keys(mesh, new_order):
+    key_blocks = mesh.data.shape_keys.key_blocks
+    vertex_count = len(mesh.data.vertices)
+    new_indices = {index: new_index for new_index, index in enumerate(new_order)}
+
+    cos = np.empty((len(key_blocks), vertex_count * 3), dtype=np.float32)
+    shapes = []
+    for index, shapekey in enumerate(key_blocks):
+        shapekey.data.foreach_get('co', cos[index])
+        shapes.append({
+            'name': shapekey.name,
+            'value': shapekey.value,
+            'slider_min': shapekey.slider_min,
+            'slider_max': shapekey.slider_max,
+            'vertex_group': shapekey.vertex_group,
+            'interpolation': shapekey.interpolation,
+            'mute': shapekey.mute,
+            'relative_key': key_blocks.find(shapekey.relative_key.name),
+        })
+
+    # Free up all names first, otherwise they would get renamed to .001 when they are temporarily taken twice
+    for index, shapekey in enumerate(key_blocks):
+        shapekey.name = 'cats_sort_' + str(index)
+
+    for new_index, index in enumerate(new_order):
+        shape = shapes[index]
+        shapekey = key_blocks[new_index]
+        shapekey.data.foreach_set('co', cos[index])
+        shapekey.name = shape['name']
+        shapekey.slider_min = -10
+        shapekey.slider_max = 10
+        shapekey.slider_min = shape['slider_min']
+        shapekey.slider_max = shape['slider_max']
+        shapekey.value = shape['value']
+        shapekey.vertex_group = shape['vertex_group']
+        shapekey.interpolation = shape['interpolation']
+        shapekey.mute = shape['mute']
+        shapekey.relative_key = key_blocks[new_indices.get(shape['relative_key'], 0)]
+
+    # The mesh always has to match the reference key, just like when moving a shape key to the top
+    if new_order[0] != 0:
+        mesh.data.vertices.foreach_set('co', cos[new_order[0]])
+        mesh.data.update()
 
 
 def isEmptyGroup(group_name):
@@ -1382,35 +1480,17 @@ def isEmptyGroup(group_name):
     if vgroup is None:
         return True
 
-    for vert in mesh.data.vertices:
-        for group in vert.groups:
-            if group.group == vgroup.index:
-                if group.weight > 0:
-                    return False
-
-    return True
+    return not WeightTable(mesh).used_groups()[vgroup.index]
 
 
 def removeEmptyGroups(obj, thres=0):
-    z = []
-    for v in obj.data.vertices:
-        for g in v.groups:
-            if g.weight > thres:
-                if g not in z:
-                    z.append(obj.vertex_groups[g.group])
-    for r in obj.vertex_groups:
-        if r not in z:
-            obj.vertex_groups.remove(r)
+    for i in reversed(WeightTable(obj).empty_groups(threshold=thres)):
+        obj.vertex_groups.remove(obj.vertex_groups[i])
 
 
 def removeZeroVerts(obj, thres=0):
-    for v in obj.data.vertices:
-        z = []
-        for g in v.groups:
-            if not g.weight > thres:
-                z.append(g)
-        for r in z:
-            obj.vertex_groups[g.group].remove([v.index])
+    for group_index, vertex_indices in WeightTable(obj).zero_weight_vertices(threshold=thres).items():
+        obj.vertex_groups[group_index].remove(vertex_indices)
 
 
 def delete_hierarchy(parent):
@@ -1477,16 +1557,13 @@ def delete_zero_weight(armature_name=None, ignore=''):
     vertex_group_names_used = set()
     vertex_group_name_to_objects_having_same_named_vertex_group = dict()
     for objects in get_meshes_objects(armature_name=armature_name):
-        vertex_group_id_to_vertex_group_name = dict()
+        used_groups = WeightTable(objects).used_groups()
         for vertex_group in objects.vertex_groups:
-            vertex_group_id_to_vertex_group_name[vertex_group.index] = vertex_group.name
             if vertex_group.name not in vertex_group_name_to_objects_having_same_named_vertex_group:
                 vertex_group_name_to_objects_having_same_named_vertex_group[vertex_group.name] = set()
             vertex_group_name_to_objects_having_same_named_vertex_group[vertex_group.name].add(objects)
-        for vertex in objects.data.vertices:
-            for group in vertex.groups:
-                if group.weight > 0:
-                    vertex_group_names_used.add(vertex_group_id_to_vertex_group_name.get(group.group))
+            if used_groups[vertex_group.index]:
+                vertex_group_names_used.add(vertex_group.name)
 
     not_used_bone_names = bone_names_to_work_on - vertex_group_names_used
 
@@ -1731,12 +1808,9 @@ def remove_doubles(mesh, threshold, save_shapes=True):
 
 
 def get_tricount(obj):
-    # Triangulates with Bmesh to avoid messing with the original geometry
-    bmesh_mesh = bmesh.new()
-    bmesh_mesh.from_mesh(obj.data)
-
-    bmesh.ops.triangulate(bmesh_mesh, faces=bmesh_mesh.faces[:])
-    return len(bmesh_mesh.faces)
+    # A polygon with n corners gets triangulated into n - 2 tris,
+    # so the tri count can be read from the loop count without triangulating a copy of the mesh
+    return len(obj.data.loops) - 2 * len(obj.data.polygons)
 
 
 def get_bone_orientations(armature):
@@ -107,10 +107,6 @@ class CopyProtectionEnable(bpy.types.Operator):
             # 3. Create a new shapekey that distorts all the vertices
             basis_obfuscated = mesh.shape_key_add(name='Basis', from_mix=False)
 
-            # 4. Put newly created shapekey as new basis key
-            mesh.active_shape_key_index = len(mesh.data.shape_keys.key_blocks) - 1
-            bpy.ops.object.shape_key_move(type='TOP')
-
             # Make all shape keys relative to the original basis
             for shapekey in mesh.data.shape_keys.key_blocks:
                 if shapekey and shapekey.name != 'Basis' and shapekey.name != 'Basis Original':
@@ -119,7 +115,7 @@ class CopyProtectionEnable(bpy.types.Operator):
             # Make the original basis relative to the obfuscated one
             basis_original.relative_key = basis_obfuscated
 
-            # Make obfuscated basis the new basis and repair shape key order
+            # 4. Make obfuscated basis the new basis and repair shape key order
             Common.sort_shape_keys(mesh.name)
 
         self.report({'INFO'}, t('CopyProtectionEnable.success'))
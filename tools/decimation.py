@@ -26,6 +26,8 @@
 
 import bpy
 import math
+import bmesh
+import numpy as np
 
 from . import common as Common
 from . import armature_bones as Bones
@@ -207,177 +209,37 @@ class AutoDecimateButton(bpy.types.Operator):
         meshes_obj = Common.get_meshes_objects(armature_name=self.armature_name)
 
         for mesh in meshes_obj:
-            Common.set_active(mesh)
-            Common.switch('EDIT')
-            bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
-            Common.switch('OBJECT')
-            if context.scene.decimation_remove_doubles:
-                Common.remove_doubles(mesh, 0.00001, save_shapes=True)
-            current_tris_count += Common.get_tricount(mesh.data.polygons)
+            current_tris_count += prepare_mesh(mesh, context.scene.decimation_remove_doubles)
 
         if animation_weighting:
             for mesh in meshes_obj:
-                # Weight by multiplied bone weights for every pair of bones.
-                # This is O(n*m^2) for n verts and m bones, generally runs relatively quickly.
-                weights = dict()
-                for vertex in mesh.data.vertices:
-                    v_weights = [group.weight for group in vertex.groups]
-                    v_mults = []
-                    for idx1, w1 in enumerate(vertex.groups):
-                        for idx2, w2 in enumerate(vertex.groups):
-                            if idx1 != idx2:
-                                # Weight [vgroup * vgroup] for index = <mult>
-                                if (w1.group, w2.group) not in weights:
-                                    weights[(w1.group, w2.group)] = dict()
-                                weights[(w1.group, w2.group)][vertex.index] = w1.weight * w2.weight
-
-                # Normalize per vertex group pair
-                normalizedweights = dict()
-                for pair, weighting in weights.items():
-                    m_min = 1
-                    m_max = 0
-                    for _, weight in weighting.items():
-                        m_min = min(m_min, weight)
-                        m_max = max(m_max, weight)
-
-                    if pair not in normalizedweights:
-                        normalizedweights[pair] = dict()
-                    for v_index, weight in weighting.items():
-                        try:
-                            normalizedweights[pair][v_index] = (weight - m_min) / (m_max - m_min)
-                        except ZeroDivisionError:
-                            normalizedweights[pair][v_index] = weight
-
-                newweights = dict()
-                for pair, weighting in normalizedweights.items():
-                    for v_index, weight in weighting.items():
-                        try:
-                            newweights[v_index] = max(newweights[v_index], weight)
-                        except KeyError:
-                            newweights[v_index] = weight
-
-                s_weights = dict()
-
-                # Weight by relative shape key movement. This is kind of slow, but not too bad. It's O(n*m) for n verts and m shape keys,
-                # but shape keys contain every vert (not just the ones they impact)
-                # For shape key in shape keys:
+                weight_table = Common.WeightTable(mesh)
+
+                basis_co = None
+                shape_key_cos = []
                 if mesh.data.shape_keys is not None:
-                    for key_block in mesh.data.shape_keys.key_blocks[1:]:
-                        basis = mesh.data.shape_keys.key_blocks[0]
-                        s_weights[key_block.name] = dict()
-
-                        for idx, vert in enumerate(key_block.data):
-                            s_weights[key_block.name][idx] = math.sqrt(math.pow(basis.data[idx].co[0] - vert.co[0], 2.0) +
-                                                                            math.pow(basis.data[idx].co[1] - vert.co[1], 2.0) +
-                                                                            math.pow(basis.data[idx].co[2] - vert.co[2], 2.0))
-
-                # normalize min/max vert movement
-                s_normalizedweights = dict()
-                for keyname, weighting in s_weights.items():
-                    m_min = math.inf
-                    m_max = 0
-                    for _, weight in weighting.items():
-                        m_min = min(m_min, weight)
-                        m_max = max(m_max, weight)
-
-                    if keyname not in s_normalizedweights:
-                        s_normalizedweights[keyname] = dict()
-                    for v_index, weight in weighting.items():
-                        try:
-                            s_normalizedweights[keyname][v_index] = (weight - m_min) / (m_max - m_min)
-                        except ZeroDivisionError:
-                            s_normalizedweights[keyname][v_index] = weight
-
-                # find max normalized movement over all shape keys
-                for pair, weighting in s_normalizedweights.items():
-                    for v_index, weight in weighting.items():
-                        try:
-                            newweights[v_index] = max(newweights[v_index], weight)
-                        except KeyError:
-                            newweights[v_index] = weight
+                    key_blocks = mesh.data.shape_keys.key_blocks
+                    basis_co = get_shape_key_co(key_blocks[0])
+                    shape_key_cos = (get_shape_key_co(key_block) for key_block in key_blocks[1:])
+
+                weights, weighted = get_animation_weights(len(mesh.data.vertices), weight_table.vertex_indices, weight_table.group_indices,
+                                                          weight_table.weights, basis_co, shape_key_cos)
 
                 # TODO: ignore shape keys which move very little?
-                context.view_layer.objects.active = mesh
-                bpy.ops.object.vertex_group_add()
-                mesh.vertex_groups[-1].name = "CATS Animation"
-                for idx, weight in newweights.items():
-                    mesh.vertex_groups[-1].add([idx], weight, "REPLACE")
+                vertex_group = mesh.vertex_groups.new(name="CATS Animation")
+                indices = np.flatnonzero(weighted)
+                set_vertex_group_weights(mesh, vertex_group.index, indices, weights[indices])
 
+        finger_tris = 0
         if save_fingers:
             for mesh in meshes_obj:
-                if len(mesh.vertex_groups) > 0:
-                    Common.set_active(mesh)
-                    Common.switch('EDIT')
-
-                    bpy.ops.mesh.select_mode(type='VERT')
-
-                    for finger in Bones.bone_finger_list:
-                        print(finger)
-                        vgs = [mesh.vertex_groups.get(finger + 'L'), mesh.vertex_groups.get(finger + 'R')]
-                        for vg in vgs:
-                            if vg:
-                                bpy.ops.object.vertex_group_set_active(group=vg.name)
-                                bpy.ops.object.vertex_group_select()
-                                try:
-                                    bpy.ops.mesh.separate(type='SELECTED')
-                                except RuntimeError:
-                                    pass
-
-                    bpy.ops.object.mode_set(mode='OBJECT')
-
-                    Common.unselect_all()
-
-        for mesh in meshes_obj:
-            Common.set_active(mesh)
-            tris = Common.get_tricount(mesh)
-
-            if custom_decimation and mesh.name in ignore_meshes:
-                Common.unselect_all()
-                continue
-
-            if Common.has_shapekeys(mesh):
-                if full_decimation:
-                    bpy.ops.object.shape_key_remove(all=True)
-                    meshes.append((mesh, tris))
-                    tris_count += tris
-                elif smart_decimation:
-                    if len(mesh.data.shape_keys.key_blocks) == 1:
-                        bpy.ops.object.shape_key_remove(all=True)
-                    else:
-                        mesh.active_shape_key_index = 0
-                        # Sanity check, make sure basis isn't against something weird
-                        mesh.active_shape_key.relative_key = mesh.active_shape_key
-                        # Add a duplicate basis key which we un-apply to fix shape keys
-                        bpy.ops.object.shape_key_add(from_mix=False)
-                        mesh.active_shape_key.name = "CATS Basis"
-                        mesh.active_shape_key_index = 0
-                    meshes.append((mesh, tris))
-                    tris_count += tris
-                elif custom_decimation:
-                    found = False
-                    for shape in ignore_shapes:
-                        if shape in mesh.data.shape_keys.key_blocks:
-                            found = True
-                            break
-                    if found:
-                        Common.unselect_all()
-                        continue
-                    bpy.ops.object.shape_key_remove(all=True)
-                    meshes.append((mesh, tris))
-                    tris_count += tris
-                elif half_decimation and len(mesh.data.shape_keys.key_blocks) < 4:
-                    bpy.ops.object.shape_key_remove(all=True)
-                    meshes.append((mesh, tris))
-                    tris_count += tris
-                elif len(mesh.data.shape_keys.key_blocks) == 1:
-                    bpy.ops.object.shape_key_remove(all=True)
-                    meshes.append((mesh, tris))
-                    tris_count += tris
-            else:
-                meshes.append((mesh, tris))
-                tris_count += tris
+                fingers = separate_fingers(mesh)
+                if fingers:
+                    finger_tris += len(fingers.data.polygons)
 
-            Common.unselect_all()
+        # Plan how many tris every mesh gets before anything gets decimated
+        meshes, current_tris_count = plan_decimation(meshes_obj, context.scene.decimation_mode, max_tris, fixed_tris=finger_tris)
+        tris_count = sum(tris for _, _, tris, _ in meshes)
 
         print(current_tris_count)
         print(tris_count)
@@ -412,18 +274,35 @@ class AutoDecimateButton(bpy.types.Operator):
             Common.show_error(4.5, [t('decimate.cantDecimate1', number=str(max_tris)),
                                     t('decimate.cantDecimate2')])
 
-        meshes.sort(key=lambda x: x[1])
+        # Prepare the shape keys of the meshes that get decimated
+        for mesh, shape_key_action, _, _ in meshes:
+            if shape_key_action == 'CLEAR':
+                mesh.shape_key_clear()
+            elif shape_key_action == 'SMART':
+                mesh.active_shape_key_index = 0
+                # Sanity check, make sure basis isn't against something weird
+                mesh.active_shape_key.relative_key = mesh.active_shape_key
+                # Add a duplicate basis key which we un-apply to fix shape keys
+                mesh.shape_key_add(name="CATS Basis", from_mix=False)
+                mesh.active_shape_key_index = 0
+
+        meshes.sort(key=lambda x: x[2])
+        planned_tris_count = sum(target_tris for _, _, _, target_tris in meshes)
 
         for mesh in reversed(meshes):
             mesh_obj = mesh[0]
-            tris = mesh[1]
+            tris = mesh[2]
+            target_tris = mesh[3]
 
             Common.set_active(mesh_obj)
             print(mesh_obj.name)
 
             # Calculate new decimation ratio
+            # The planned tris of the mesh get scaled by how well the previous meshes met their plan
             try:
                 decimation = (max_tris - current_tris_count + tris_count) / tris_count
+                if planned_tris_count > 0:
+                    decimation *= tris_count / planned_tris_count * target_tris / tris
             except ZeroDivisionError:
                 decimation = 1
             print(decimation)
@@ -473,13 +352,10 @@ class AutoDecimateButton(bpy.types.Operator):
 
             current_tris_count = current_tris_count - tris + tris_after
             tris_count = tris_count - tris
+            planned_tris_count = planned_tris_count - target_tris
             # Repair shape keys if SMART mode is enabled
             if smart_decimation and Common.has_shapekeys(mesh_obj):
-                for idx in range(1, len(mesh_obj.data.shape_keys.key_blocks) - 1):
-                    mesh_obj.active_shape_key_index = idx
-                    Common.switch('EDIT')
-                    bpy.ops.mesh.blend_from_shape(shape="CATS Basis", blend=-1.0, add=True)
-                    Common.switch('OBJECT')
+                repair_shape_keys(mesh_obj, "CATS Basis")
                 mesh_obj.shape_key_remove(key=mesh_obj.data.shape_keys.key_blocks["CATS Basis"])
                 mesh_obj.active_shape_key_index = 0
 
@@ -520,6 +396,325 @@ class AutoDecimateButton(bpy.types.Operator):
         #         break
 
 
+@register_wrap
+class DecimationPreviewButton(bpy.types.Operator):
+    bl_idname = 'cats_decimation.preview'
+    bl_label = t('DecimationPreviewButton.label')
+    bl_description = t('DecimationPreviewButton.desc')
+    bl_options = {'INTERNAL'}
+
+    armature_name = bpy.props.StringProperty(
+        name='armature_name',
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return len(Common.get_meshes_objects(check=False)) > 0
+
+    def execute(self, context):
+        max_tris = context.scene.max_tris
+        # This is an estimate from the current meshes. The auto decimation joins them first, which applies their modifiers
+        # and can separate them by materials again, so the tris of the final meshes can differ
+        meshes, current_tris_count = plan_decimation(Common.get_meshes_objects(armature_name=self.armature_name),
+                                                     context.scene.decimation_mode, max_tris)
+        tris_count = sum(tris for _, _, tris, _ in meshes)
+        planned_tris_count = current_tris_count - tris_count + sum(target_tris for _, _, _, target_tris in meshes)
+
+        for mesh, _, tris, target_tris in meshes:
+            print(mesh.name + ':', tris, '->', target_tris)
+
+        if current_tris_count - tris_count > max_tris:
+            self.report({'WARNING'}, t('decimate.cantDecimateWithSettings', number=str(max_tris)))
+            return {'FINISHED'}
+
+        self.report({'INFO'}, t('DecimationPreviewButton.success', current=str(current_tris_count), planned=str(planned_tris_count)))
+        return {'FINISHED'}
+
+
+# Decides how a mesh is handled by the decimation mode without changing anything
+# Returns None if the mesh doesn't get decimated, otherwise what has to happen to its shape keys: 'CLEAR', 'SMART' or 'KEEP'
+def get_decimation_action(mesh, mode):
+    if mode == 'CUSTOM' and mesh.name in ignore_meshes:
+        return None
+
+    if not Common.has_shapekeys(mesh):
+        return 'KEEP'
+
+    shape_key_count = len(mesh.data.shape_keys.key_blocks)
+    if mode == 'FULL':
+        return 'CLEAR'
+    if mode == 'SMART':
+        return 'CLEAR' if shape_key_count == 1 else 'SMART'
+    if mode == 'CUSTOM':
+        for shape in ignore_shapes:
+            if shape in mesh.data.shape_keys.key_blocks:
+                return None
+        return 'CLEAR'
+    if mode == 'HALF' and shape_key_count < 4:
+        return 'CLEAR'
+    if shape_key_count == 1:
+        return 'CLEAR'
+    return None
+
+
+# Distributes the tris that are left for decimation over the meshes, without touching any geometry
+# Returns a list of [mesh, shape_key_action, tris, target_tris] for every mesh that gets decimated and the tri count of the model.
+# fixed_tris are tris that belong to the model but aren't part of the given meshes
+def plan_decimation(meshes_obj, mode, max_tris, fixed_tris=0):
+    entries = []
+    for mesh in meshes_obj:
+        action = get_decimation_action(mesh, mode)
+        area = 0
+        shape_key_count = 0
+        if action is not None:
+            polygon_areas = np.empty(len(mesh.data.polygons), dtype=np.float32)
+            mesh.data.polygons.foreach_get('area', polygon_areas)
+            area = float(np.sum(polygon_areas, dtype=np.float64))
+            shape_key_count = len(mesh.data.shape_keys.key_blocks) if Common.has_shapekeys(mesh) else 0
+        entries.append([mesh, action, Common.get_tricount(mesh), area, shape_key_count])
+
+    return distribute_tris(entries, max_tris, fixed_tris=fixed_tris)
+
+
+# Distributes the budget over entries of [mesh, shape_key_action, tris, area, shape_key_count], the mesh isn't accessed
+# Every mesh gets a share of the budget by its tri count, weighted by its importance:
+#  - Meshes with larger tris than average lose more detail per removed tri than dense meshes
+#  - Meshes that keep many shape keys in SMART mode are mostly faces, which should keep their detail
+# No mesh gets more tris than it already has, the rest goes to the other meshes.
+# Returns a list of [mesh, shape_key_action, tris, target_tris] for every mesh that gets decimated and the tri count of the model.
+def distribute_tris(entries, max_tris, fixed_tris=0):
+    current_tris_count = fixed_tris
+    meshes = []
+    areas = []
+    importances = []
+
+    for mesh, action, tris, area, shape_key_count in entries:
+        current_tris_count += tris
+        if action is None:
+            continue
+
+        importance = 1
+        if action == 'SMART':
+            importance += math.log2(shape_key_count) / 4
+
+        meshes.append([mesh, action, tris, 0])
+        areas.append(area)
+        importances.append(importance)
+
+    if not meshes:
+        return meshes, current_tris_count
+
+    tris = np.array([mesh[2] for mesh in meshes], dtype=np.float64)
+    areas = np.array(areas)
+    available = max_tris - (current_tris_count - np.sum(tris))
+
+    # Tri size relative to the average tri size of all meshes
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tri_sizes = np.where(tris > 0, areas / tris, 0) / (np.sum(areas) / np.sum(tris))
+    tri_sizes = np.where(np.isfinite(tri_sizes) & (tri_sizes > 0), tri_sizes, 1)
+    shares = tris * np.sqrt(tri_sizes) * np.array(importances)
+
+    # Hand out the budget by share. Meshes that would get more than they have keep their tris and the rest is handed out again
+    targets = np.zeros(len(meshes))
+    remaining = np.ones(len(meshes), dtype=bool)
+    while available > 0 and np.any(remaining):
+        share_sum = np.sum(shares[remaining])
+        if share_sum <= 0:
+            targets[remaining] = tris[remaining] * available / np.sum(tris[remaining])
+            break
+
+        planned = shares * available / share_sum
+        full = remaining & (planned >= tris)
+        if not np.any(full):
+            targets[remaining] = planned[remaining]
+            break
+
+        targets[full] = tris[full]
+        available -= np.sum(tris[full])
+        remaining &= ~full
+
+    # Rounded, but every mesh keeps at least 1 tri. A target of 0 would be a decimation ratio of 0, which deletes the mesh
+    for mesh, target_tris in zip(meshes, targets):
+        mesh[3] = max(int(round(target_tris)), 1) if mesh[2] > 0 else 0
+
+    return meshes, current_tris_count
+
+
+# Triangulates the mesh and merges its doubles in a single bmesh pass instead of going through edit mode operators
+# Vertices that are moved by any shape key are never merged. Returns the new tri count
+def prepare_mesh(mesh, remove_doubles):
+    bm = bmesh.new()
+    bm.from_mesh(mesh.data)
+    bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method='BEAUTY', ngon_method='BEAUTY')
+
+    # Same as Common.remove_doubles, only meshes with shape keys get their doubles removed
+    if remove_doubles and Common.has_shapekeys(mesh) and len(mesh.data.shape_keys.key_blocks) > 1:
+        moved = np.zeros(len(mesh.data.vertices), dtype=bool)
+        for key_block in mesh.data.shape_keys.key_blocks:
+            moved |= np.any(get_shape_key_co(key_block) != get_shape_key_co(key_block.relative_key), axis=1)
+
+        bm.verts.ensure_lookup_table()
+        bmesh.ops.remove_doubles(bm, verts=[bm.verts[i] for i in np.flatnonzero(~moved)], dist=0.00001)
+
+    bm.to_mesh(mesh.data)
+    tris = len(bm.faces)
+    bm.free()
+    mesh.data.update()
+    return tris
+
+
+# Moves all faces whose vertices are all in finger vertex groups into a new object, so that they don't get decimated
+# This is the same as selecting every finger vertex group in edit mode and separating the selection, but in a single bmesh pass.
+# The vertices don't have to share a group, faces across the joints of a finger have vertices of two different phalanges
+def separate_fingers(mesh):
+    finger_groups = set()
+    for finger in Bones.bone_finger_list:
+        for vg in [mesh.vertex_groups.get(finger + 'L'), mesh.vertex_groups.get(finger + 'R')]:
+            if vg:
+                finger_groups.add(vg.index)
+    if not finger_groups:
+        return None
+
+    bm = bmesh.new()
+    bm.from_mesh(mesh.data)
+    deform = bm.verts.layers.deform.active
+    if not deform:
+        bm.free()
+        return None
+
+    # A face belongs to the fingers if every one of its vertices is in any finger group
+    vert_fingers = [not finger_groups.isdisjoint(vert[deform].keys()) for vert in bm.verts]
+    bm.faces.index_update()
+    finger_faces = {face.index for face in bm.faces if all(vert_fingers[vert.index] for vert in face.verts)}
+
+    if not finger_faces:
+        bm.free()
+        return None
+
+    # Split the faces between the original mesh and a copy of it
+    bm_fingers = bm.copy()
+    bm_fingers.faces.index_update()
+    bmesh.ops.delete(bm, geom=[face for face in bm.faces if face.index in finger_faces], context='FACES')
+    bmesh.ops.delete(bm_fingers, geom=[face for face in bm_fingers.faces if face.index not in finger_faces], context='FACES')
+
+    fingers = mesh.copy()
+    fingers.data = mesh.data.copy()
+    for collection in mesh.users_collection:
+        collection.objects.link(fingers)
+
+    bm.to_mesh(mesh.data)
+    bm_fingers.to_mesh(fingers.data)
+    bm.free()
+    bm_fingers.free()
+    mesh.data.update()
+    fingers.data.update()
+    return fingers
+
+
+# Removes the offset of the given shape key from all other shape keys
+# This is the same as using 'Blend from Shape' with a blend of -1 in add mode on every shape key in between
+def repair_shape_keys(mesh, shape_name):
+    key_blocks = mesh.data.shape_keys.key_blocks
+    key_block = key_blocks[shape_name]
+    offset = get_shape_key_co(key_block) - get_shape_key_co(key_block.relative_key)
+
+    for idx in range(1, len(key_blocks) - 1):
+        co = get_shape_key_co(key_blocks[idx]) - offset
+        key_blocks[idx].data.foreach_set('co', co.astype(np.float32).ravel())
+
+
+def get_shape_key_co(key_block):
+    co = np.empty(len(key_block.data) * 3, dtype=np.float32)
+    key_block.data.foreach_get('co', co)
+    return co.reshape(-1, 3).astype(np.float64)
+
+
+# Writes the weights of the vertices into the vertex group in one pass through a bmesh deform layer
+# There is no bulk setter for vertex weights and vertex_group.add() would be needed once for every distinct weight
+def set_vertex_group_weights(mesh, group_index, indices, weights):
+    bm = bmesh.new()
+    bm.from_mesh(mesh.data)
+    bm.verts.ensure_lookup_table()
+    deform_layer = bm.verts.layers.deform.verify()
+    verts = bm.verts
+    for index, weight in zip(indices.tolist(), weights.tolist()):
+        verts[index][deform_layer][group_index] = weight
+    bm.to_mesh(mesh.data)
+    bm.free()
+    mesh.data.update()
+
+
+# Normalizes the values to 0-1 per group, like (value - min) / (max - min). Groups where all values are equal stay unchanged
+# The ranges start at the given min and max, the values have to be sorted by group
+def normalize_per_group(values, group_starts, group_ids, m_min, m_max):
+    mins = np.minimum(np.minimum.reduceat(values, group_starts), m_min)[group_ids]
+    maxs = np.maximum(np.maximum.reduceat(values, group_starts), m_max)[group_ids]
+    ranges = maxs - mins
+    normalized = values.copy()
+    nonzero = ranges != 0
+    normalized[nonzero] = (values[nonzero] - mins[nonzero]) / ranges[nonzero]
+    return normalized
+
+
+# Calculates how much every vertex is affected by animations. Returns the weights and a mask of the vertices that got one.
+# The weight of a vertex is the highest of:
+#  - The products of its bone weights for every pair of bones, normalized per bone pair
+#  - Its movement in every shape key, normalized per shape key
+# vertex_indices, group_indices and group_weights are the vertex group assignments sorted by vertex
+def get_animation_weights(vertex_count, vertex_indices, group_indices, group_weights, basis_co=None, shape_key_cos=()):
+    weights = np.zeros(vertex_count, dtype=np.float64)
+    weighted = np.zeros(vertex_count, dtype=bool)
+
+    # Find every pair of vertex groups that share a vertex. The groups of a vertex are next to each other in the arrays,
+    # so comparing the arrays with themselves shifted by 1 to n finds all pairs of vertices with up to n+1 groups
+    pair_vertices = []
+    pair_keys = []
+    pair_weights = []
+    group_count = int(group_indices.max()) + 1 if len(group_indices) else 0
+    offset = 1
+    while offset < len(vertex_indices):
+        same_vertex = np.flatnonzero(vertex_indices[:-offset] == vertex_indices[offset:])
+        if not len(same_vertex):
+            break
+        group1 = group_indices[same_vertex]
+        group2 = group_indices[same_vertex + offset]
+        pair_vertices.append(vertex_indices[same_vertex])
+        pair_keys.append(np.minimum(group1, group2) * group_count + np.maximum(group1, group2))
+        pair_weights.append(group_weights[same_vertex] * group_weights[same_vertex + offset])
+        offset += 1
+
+    if pair_vertices:
+        pair_vertices = np.concatenate(pair_vertices)
+        pair_keys = np.concatenate(pair_keys)
+        pair_weights = np.concatenate(pair_weights)
+
+        # Weights are normalized per vertex group pair
+        order = np.argsort(pair_keys, kind='stable')
+        pair_vertices, pair_keys, pair_weights = pair_vertices[order], pair_keys[order], pair_weights[order]
+        group_starts = np.flatnonzero(np.concatenate(([True], pair_keys[1:] != pair_keys[:-1])))
+        group_ids = np.cumsum(np.concatenate(([False], pair_keys[1:] != pair_keys[:-1])))
+        pair_weights = normalize_per_group(pair_weights, group_starts, group_ids, 1, 0)
+
+        # Use the highest weight of all pairs
+        pair_max = np.full(vertex_count, -np.inf)
+        np.maximum.at(pair_max, pair_vertices, pair_weights)
+        weighted[pair_vertices] = True
+        weights[weighted] = pair_max[weighted]
+
+    # Weight by relative shape key movement, normalized per shape key
+    # The shape keys are processed one at a time, so that they don't all have to be kept in memory
+    if basis_co is not None and vertex_count:
+        group_starts = np.zeros(1, dtype=np.int64)
+        group_ids = np.zeros(vertex_count, dtype=np.int64)
+        for co in shape_key_cos:
+            movement = np.sqrt(np.sum((basis_co - co) ** 2, axis=1))
+            movement = normalize_per_group(movement, group_starts, group_ids, math.inf, 0)
+            weights = np.where(weighted, np.maximum(weights, movement), movement)
+            weighted[:] = True
+
+    return weights, weighted
+
+
 @register_wrap
 class AutoDecimatePresetGood(bpy.types.Operator):
     bl_idname = 'cats_decimation.preset_good'
@@ -112,10 +112,11 @@ class CreateEyesButton(bpy.types.Operator):
 
         if not context.scene.disable_eye_movement:
             eye_name = ""
+            weight_table = Common.WeightTable(self.mesh)
             # Find the existing vertex group of the eye bones
-            if not self.vertex_group_exists(old_eye_left.name):
+            if not Common.vertex_group_exists(mesh_name, old_eye_left.name, weight_table=weight_table):
                 eye_name = context.scene.eye_left
-            elif not self.vertex_group_exists(old_eye_right.name):
+            elif not Common.vertex_group_exists(mesh_name, old_eye_right.name, weight_table=weight_table):
                 eye_name = context.scene.eye_right
 
             if eye_name:
@@ -162,9 +163,10 @@ class CreateEyesButton(bpy.types.Operator):
         new_left_eye.parent = bpy.context.object.data.edit_bones[context.scene.head]
         new_right_eye.parent = bpy.context.object.data.edit_bones[context.scene.head]
 
-        # Calculate their new positions
-        fix_eye_position(context, old_eye_left, new_left_eye, head, False)
-        fix_eye_position(context, old_eye_right, new_right_eye, head, True)
+        # Calculate their new positions. The vertex groups were changed above, so the weights have to be read again
+        weight_table = None if context.scene.disable_eye_movement else Common.WeightTable(self.mesh)
+        fix_eye_position(context, old_eye_left, new_left_eye, head, False, weight_table=weight_table)
+        fix_eye_position(context, old_eye_right, new_right_eye, head, True, weight_table=weight_table)
 
         # Switch to mesh
         Common.set_active(self.mesh)
@@ -299,22 +301,8 @@ class CreateEyesButton(bpy.types.Operator):
         self.mesh.active_shape_key_index = 0
         return from_shape
 
-    def vertex_group_exists(self, bone_name):
-        data = self.mesh.data
-        verts = data.vertices
 
-        for vert in verts:
-            i = vert.index
-            try:
-                self.mesh.vertex_groups[bone_name].weight(i)
-                return True
-            except:
-                pass
-
-        return False
-
-
-def fix_eye_position(context, old_eye, new_eye, head, right_side):
+def fix_eye_position(context, old_eye, new_eye, head, right_side, weight_table=None):
     # Verify that the new eye bone is in the correct position
     # by comparing the old eye vertex group average vector location
     mesh = Common.get_objects()[context.scene.mesh_name_eye]
@@ -322,9 +310,9 @@ def fix_eye_position(context, old_eye, new_eye, head, right_side):
 
     if not context.scene.disable_eye_movement:
         if head:
-            coords_eye = Common.find_center_vector_of_vertex_group(mesh, old_eye.name)
+            coords_eye = Common.find_center_vector_of_vertex_group(mesh, old_eye.name, weight_table=weight_table)
         else:
-            coords_eye = Common.find_center_vector_of_vertex_group(mesh, new_eye.name)
+            coords_eye = Common.find_center_vector_of_vertex_group(mesh, new_eye.name, weight_table=weight_table)
 
         if coords_eye is False:
             return
@@ -696,13 +684,14 @@ class AdjustEyesButton(bpy.types.Operator):
             return {'FINISHED'}
 
         mesh_name = context.scene.mesh_name_eye
+        weight_table = Common.WeightTable(Common.get_objects()[mesh_name])
 
-        if not Common.vertex_group_exists(mesh_name, 'LeftEye'):
+        if not Common.vertex_group_exists(mesh_name, 'LeftEye', weight_table=weight_table):
             self.report({'ERROR'}, t('AdjustEyesButton.error.noVertex', bone='LeftEye'))
             return {'CANCELLED'}
 
         # Find the existing vertex group of the right eye bone
-        if not Common.vertex_group_exists(mesh_name, 'RightEye'):
+        if not Common.vertex_group_exists(mesh_name, 'RightEye', weight_table=weight_table):
             self.report({'ERROR'}, t('AdjustEyesButton.error.noVertex', bone='RightEye'))
             return {'CANCELLED'}
 
@@ -716,8 +705,8 @@ class AdjustEyesButton(bpy.types.Operator):
         old_eye_left = armature.pose.bones.get(context.scene.eye_left)
         old_eye_right = armature.pose.bones.get(context.scene.eye_right)
 
-        fix_eye_position(context, old_eye_left, new_eye_left, None, False)
-        fix_eye_position(context, old_eye_right, new_eye_right, None, True)
+        fix_eye_position(context, old_eye_left, new_eye_left, None, False, weight_table=weight_table)
+        fix_eye_position(context, old_eye_right, new_eye_right, None, True, weight_table=weight_table)
 
         Common.switch('POSE')
 
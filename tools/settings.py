@@ -82,6 +82,7 @@ class ResetGoogleDictButton(bpy.types.Operator):
 
     def execute(self, context):
         Translate.reset_google_dict()
+        Translate.remove_google_journal()
         Translate.load_translations()
         self.report({'INFO'}, t('ResetGoogleDictButton.resetInfo'))
         return {'FINISHED'}
@@ -26,13 +26,11 @@
 import re
 import os
 import bpy
-import copy
 import json
+import pickle
 import pathlib
 import platform
-import traceback
 import collections
-import requests.exceptions
 
 from datetime import datetime, timezone
 from collections import OrderedDict
@@ -40,19 +38,35 @@ from collections import OrderedDict
 from . import common as Common
 from .register import register_wrap
 from .. import globs
-# from ..googletrans import Translator  # TODO Remove this
-from ..extern_tools.google_trans_new.google_trans_new import google_translator
+from . import translate_google
+from .translate_google import GoogleTranslator, GoogleTranslationError
 from .translations import t
 
 from mmd_tools_local import translations as mmd_translations
 
 dictionary = {}
 dictionary_google = {}
+dictionary_matcher = None
+
+# Server used for Google translations, None uses Google itself. Can be pointed at a local server for testing
+google_server_url = None
+
+# Caches the translation of every name that was translated since the dictionaries last changed
+translation_cache = {}
 
 main_dir = pathlib.Path(os.path.dirname(__file__)).parent.resolve()
 resources_dir = os.path.join(str(main_dir), "resources")
 dictionary_file = os.path.join(resources_dir, "dictionary.json")
 dictionary_google_file = os.path.join(resources_dir, "dictionary_google.json")
+dictionary_google_journal_file = os.path.join(resources_dir, "dictionary_google_journal.txt")
+dictionary_cache_file = os.path.join(resources_dir, "dictionary_cache.pickle")
+
+# Increase this whenever the content of the dictionary cache changes, so that old caches get rebuilt
+dictionary_cache_version = 1
+
+# New Google translations are appended to the journal and only written into the google dict once there are this many
+google_journal_max_size = 200
+google_journal_size = 0
 
 
 @register_wrap
@@ -69,26 +83,13 @@ class TranslateShapekeyButton(bpy.types.Operator):
 
         saved_data = Common.SavedData()
 
-        to_translate = []
+        shapekeys = get_shapekeys_to_translate()
 
-        for mesh in Common.get_meshes_objects(mode=2):
-            if Common.has_shapekeys(mesh):
-                for shapekey in mesh.data.shape_keys.key_blocks:
-                    if 'vrc.' not in shapekey.name and shapekey.name not in to_translate:
-                        to_translate.append(shapekey.name)
-
-        update_dictionary(to_translate, translating_shapes=True, self=self)
+        update_dictionary(get_names(shapekeys), translating_shapes=True, self=self)
 
         Common.update_shapekey_orders()
 
-        i = 0
-        for mesh in Common.get_meshes_objects(mode=2):
-            if Common.has_shapekeys(mesh):
-                for shapekey in mesh.data.shape_keys.key_blocks:
-                    if 'vrc.' not in shapekey.name:
-                        shapekey.name, translated = translate(shapekey.name, add_space=True, translating_shapes=True)
-                        if translated:
-                            i += 1
+        i = apply_translations(shapekeys, add_space=True, translating_shapes=True)
 
         Common.ui_refresh()
 
@@ -112,19 +113,11 @@ class TranslateBonesButton(bpy.types.Operator):
         return True
 
     def execute(self, context):
-        to_translate = []
-        for armature in Common.get_armature_objects():
-            for bone in armature.data.bones:
-                to_translate.append(bone.name)
+        bones = get_bones_to_translate()
 
-        update_dictionary(to_translate, self=self)
+        update_dictionary(get_names(bones), self=self)
 
-        count = 0
-        for armature in Common.get_armature_objects():
-            for bone in armature.data.bones:
-                bone.name, translated = translate(bone.name)
-                if translated:
-                    count += 1
+        count = apply_translations(bones)
 
         self.report({'INFO'}, t('TranslateBonesButton.success', number=str(count)))
         return {'FINISHED'}
@@ -141,34 +134,11 @@ class TranslateObjectsButton(bpy.types.Operator):
         if bpy.app.version < (2, 79, 0):
             self.report({'ERROR'}, t('TranslateX.error.wrongVersion'))
             return {'FINISHED'}
-        to_translate = []
-        for obj in Common.get_objects():
-            if obj.name not in to_translate:
-                to_translate.append(obj.name)
-            if obj.type == 'ARMATURE':
-                if obj.data and obj.data.name not in to_translate:
-                    to_translate.append(obj.data.name)
-                if obj.animation_data and obj.animation_data.action:
-                    to_translate.append(obj.animation_data.action.name)
-
-        update_dictionary(to_translate, self=self)
-
-        i = 0
-        for obj in Common.get_objects():
-            obj.name, translated = translate(obj.name)
-            if translated:
-                i += 1
-
-            if obj.type == 'ARMATURE':
-                if obj.data:
-                    obj.data.name, translated = translate(obj.data.name)
-                    if translated:
-                        i += 1
-
-                if obj.animation_data and obj.animation_data.action:
-                    obj.animation_data.action.name, translated = translate(obj.animation_data.action.name)
-                    if translated:
-                        i += 1
+        objects = get_objects_to_translate()
+
+        update_dictionary(get_names(objects), self=self)
+
+        i = apply_translations(objects)
 
         self.report({'INFO'}, t('TranslateObjectsButton.success', number=str(i)))
         return {'FINISHED'}
@@ -186,27 +156,12 @@ class TranslateMaterialsButton(bpy.types.Operator):
             self.report({'ERROR'}, t('TranslateX.error.wrongVersion'))
             return {'FINISHED'}
 
-        saved_data = Common.SavedData()
-
-        to_translate = []
-        for mesh in Common.get_meshes_objects(mode=2):
-            for matslot in mesh.material_slots:
-                if matslot.name not in to_translate:
-                    to_translate.append(matslot.name)
+        materials = get_materials_to_translate()
 
-        update_dictionary(to_translate, self=self)
+        update_dictionary(get_names(materials), self=self)
 
-        i = 0
-        for mesh in Common.get_meshes_objects(mode=2):
-            Common.set_active(mesh)
-            for index, matslot in enumerate(mesh.material_slots):
-                mesh.active_material_index = index
-                if bpy.context.object.active_material:
-                    bpy.context.object.active_material.name, translated = translate(bpy.context.object.active_material.name)
-                    if translated:
-                        i += 1
+        i = apply_translations(materials)
 
-        saved_data.load()
         self.report({'INFO'}, t('TranslateMaterialsButton.success', number=str(i)))
         return {'FINISHED'}
 
@@ -271,45 +226,290 @@ class TranslateAllButton(bpy.types.Operator):
             self.report({'ERROR'}, t('TranslateX.error.wrongVersion'))
             return {'FINISHED'}
 
-        error_shown = False
+        saved_data = Common.SavedData()
 
-        try:
-            if Common.get_armature():
-                bpy.ops.cats_translate.bones('INVOKE_DEFAULT')
-        except RuntimeError as e:
-            self.report({'ERROR'}, str(e).replace('Error: ', ''))
-            error_shown = True
+        # Collect everything first, so that every unique name only has to be looked up and translated once
+        bones = get_bones_to_translate() if Common.get_armature() else []
+        shapekeys = get_shapekeys_to_translate()
+        objects = get_objects_to_translate()
+        materials = get_materials_to_translate()
+
+        # Shape keys only need their own dictionary update if they are translated with Google only
+        to_translate = get_names(bones, objects, materials)
+        if bpy.context.scene.use_google_only:
+            success = update_dictionary(to_translate, self=self)
+            success = update_dictionary(get_names(shapekeys), translating_shapes=True, self=self) and success
+        else:
+            success = update_dictionary(get_names(shapekeys) + to_translate, self=self)
 
-        try:
-            bpy.ops.cats_translate.shapekeys('INVOKE_DEFAULT')
-        except RuntimeError as e:
-            if not error_shown:
-                self.report({'ERROR'}, str(e).replace('Error: ', ''))
-                error_shown = True
+        Common.update_shapekey_orders()
 
-        try:
-            bpy.ops.cats_translate.objects('INVOKE_DEFAULT')
-        except RuntimeError as e:
-            if not error_shown:
-                self.report({'ERROR'}, str(e).replace('Error: ', ''))
-                error_shown = True
+        apply_translations(bones)
+        apply_translations(shapekeys, add_space=True, translating_shapes=True)
+        apply_translations(objects)
+        apply_translations(materials)
 
-        try:
-            bpy.ops.cats_translate.materials('INVOKE_DEFAULT')
-        except RuntimeError as e:
-            if not error_shown:
-                self.report({'ERROR'}, str(e).replace('Error: ', ''))
-                error_shown = True
+        Common.ui_refresh()
+
+        saved_data.load()
 
-        if error_shown:
+        if not success:
             return {'CANCELLED'}
         self.report({'INFO'}, t('TranslateAllButton.success'))
         return {'FINISHED'}
 
 
+# Returns all bones that should be translated
+def get_bones_to_translate():
+    bones = []
+    for armature in Common.get_armature_objects():
+        bones += armature.data.bones
+    return bones
+
+
+# Returns all shape keys that should be translated
+def get_shapekeys_to_translate():
+    shapekeys = []
+    for mesh in Common.get_meshes_objects(mode=2):
+        if Common.has_shapekeys(mesh):
+            for shapekey in mesh.data.shape_keys.key_blocks:
+                if 'vrc.' not in shapekey.name:
+                    shapekeys.append(shapekey)
+    return shapekeys
+
+
+# Returns all objects, armature datas and armature actions that should be translated
+def get_objects_to_translate():
+    objects = []
+    for obj in Common.get_objects():
+        objects.append(obj)
+        if obj.type == 'ARMATURE':
+            if obj.data:
+                objects.append(obj.data)
+            if obj.animation_data and obj.animation_data.action:
+                objects.append(obj.animation_data.action)
+    return objects
+
+
+# Returns all materials of the meshes that should be translated. Materials used by multiple meshes are only listed once
+def get_materials_to_translate():
+    materials = {}
+    for mesh in Common.get_meshes_objects(mode=2):
+        for matslot in mesh.material_slots:
+            if matslot.material and matslot.material.name not in materials:
+                materials[matslot.material.name] = matslot.material
+    return list(materials.values())
+
+
+# Returns the unique names of all given lists of datablocks in their original order
+def get_names(*datablock_lists):
+    names = {}
+    for datablocks in datablock_lists:
+        for datablock in datablocks:
+            names[datablock.name] = None
+    return list(names.keys())
+
+
+# Translates a batch of names. Every unique name only gets translated once
+# Returns a dict with the translations of all names that changed
+def translate_names(names, add_space=False, translating_shapes=False):
+    translations = {}
+    for name in dict.fromkeys(names):
+        translated_name, translated = translate(name, add_space=add_space, translating_shapes=translating_shapes)
+        if translated:
+            translations[name] = translated_name
+    return translations
+
+
+# Translates the names of all given datablocks in bulk and returns how many of them got renamed
+def apply_translations(datablocks, add_space=False, translating_shapes=False):
+    # Read all names before renaming anything, so that renamed datablocks can't influence the others
+    names = [datablock.name for datablock in datablocks]
+    translations = translate_names(names, add_space=add_space, translating_shapes=translating_shapes)
+
+    count = 0
+    for datablock, name in zip(datablocks, names):
+        translated_name = translations.get(name)
+        if translated_name is not None:
+            datablock.name = translated_name
+            count += 1
+    return count
+
+
+# Multi pattern matcher over the dictionary keys (Aho-Corasick automaton)
+# It reproduces the old behaviour of walking the length sorted dictionary and replacing every key found in the name,
+# but only looks at keys that are actually contained in the name instead of testing every dictionary entry
+class TranslationMatcher:
+    def __init__(self, items=None):
+        # Trie nodes are stored in parallel lists, node 0 is the root
+        self._goto = [{}]
+        self._fail = [0]
+        self._term = [-1]
+        self._out = [()]
+        self._dirty = False
+
+        # Key id -> key, value and rank. Keys are applied in the order of their rank: longest first, then oldest first
+        self._ids = {}
+        self._keys = []
+        self._values = []
+        self._ranks = []
+
+        if items:
+            for key, value in items:
+                self.add(key, value)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    # Adds a key or updates the value of an existing one. Existing keys keep their rank
+    def add(self, key, value):
+        if not key:
+            return
+
+        key_id = self._ids.get(key)
+        if key_id is not None:
+            self._values[key_id] = value
+            return
+
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._term.append(-1)
+                self._out.append(())
+            node = next_node
+
+        key_id = len(self._keys)
+        self._ids[key] = key_id
+        self._keys.append(key)
+        self._values.append(value)
+        self._ranks.append((-len(key), key_id))
+        self._term[node] = key_id
+
+        # The failure links only get rebuilt when the next search happens, so adding a batch of keys only costs one rebuild
+        self._dirty = True
+
+    # Builds the failure links and output lists breadth first
+    def _build(self):
+        goto, fail, term, out = self._goto, self._fail, self._term, self._out
+        out[0] = ()
+        queue = collections.deque()
+        for node in goto[0].values():
+            fail[node] = 0
+            out[node] = (term[node],) if term[node] >= 0 else ()
+            queue.append(node)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                child_fail = goto[state].get(char, 0)
+                fail[child] = child_fail
+                out[child] = ((term[child],) if term[child] >= 0 else ()) + out[child_fail]
+                queue.append(child)
+
+        self._dirty = False
+
+    # Returns the compiled matcher as plain data, so that it can be stored in the dictionary cache
+    def get_state(self):
+        if self._dirty:
+            self._build()
+        return dict(self.__dict__)
+
+    # Creates a matcher from the data returned by get_state
+    @classmethod
+    def from_state(cls, state):
+        matcher = cls.__new__(cls)
+        matcher.__dict__.update(state)
+        return matcher
+
+    # Returns the ids of all keys that are contained in the text
+    def find(self, text):
+        if self._dirty:
+            self._build()
+
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+    # Replaces all keys in the text in the same order as the old greedy loop over the length sorted dictionary:
+    # Keys are applied in rank order and only keys ranked after the last applied one are considered.
+    # Keys without a value are ignored. Stops once the replaced key lengths add up to the given length.
+    # Returns the new text and the summed up length of the replaced keys
+    def replace(self, text, length, addition=''):
+        ranks = self._ranks
+        values = self._values
+        translated_count = 0
+        last_rank = None
+
+        while True:
+            best = None
+            for key_id in self.find(text):
+                if not values[key_id]:
+                    continue
+                rank = ranks[key_id]
+                if last_rank is not None and rank <= last_rank:
+                    continue
+                if best is None or rank < ranks[best]:
+                    best = key_id
+
+            if best is None:
+                break
+
+            key = self._keys[best]
+            text = text.replace(key, addition + values[best])
+
+            # Check if string is fully translated
+            translated_count += len(key)
+            if translated_count >= length:
+                break
+
+            last_rank = ranks[best]
+
+        return text, translated_count
+
+
 # Loads the dictionaries at the start of blender
 def load_translations():
-    global dictionary
+    global dictionary, dictionary_google, dictionary_matcher
+
+    # Use the compiled dictionaries from the cache if the dictionary files didn't change since it was saved
+    cache = load_dictionary_cache()
+    if cache:
+        dictionary = cache['dictionary']
+        dictionary_google = cache['dictionary_google']
+        dictionary_matcher = TranslationMatcher.from_state(cache['matcher'])
+        dict_found = cache['dict_found']
+    else:
+        dict_found = parse_translations()
+        save_dictionary_cache(dict_found)
+
+    # Add the Google translations that were not yet written into the google dict
+    load_google_journal()
+    translation_cache.clear()
+
+    return dict_found
+
+
+# Parses the dictionary files and compiles them
+def parse_translations():
+    global dictionary, dictionary_google, dictionary_matcher
     dictionary = OrderedDict()
     temp_dict = OrderedDict()
     dict_found = False
@@ -330,7 +530,6 @@ def load_translations():
     # Load local google dictionary and add it to the temp dict
     try:
         with open(dictionary_google_file, encoding="utf8") as file:
-            global dictionary_google
             dictionary_google = json.load(file, object_pairs_hook=collections.OrderedDict)
 
             if 'created' not in dictionary_google \
@@ -362,6 +561,9 @@ def load_translations():
     for key in sorted(temp_dict, key=lambda k: len(k), reverse=True):
         dictionary[key] = temp_dict[key]
 
+    # Compile the dictionary into the matcher used for translating
+    dictionary_matcher = TranslationMatcher(dictionary.items())
+
     # for key, value in dictionary.items():
     #     print('"' + key + '" - "' + value + '"')
 
@@ -381,9 +583,11 @@ def update_dictionary(to_translate_list, translating_shapes=False, self=None):
         to_translate_list = [to_translate_list]
 
     google_input = []
+    google_input_set = set()
+    translations_full = dictionary_google.get('translations_full')
 
-    # Translate everything
-    for to_translate in to_translate_list:
+    # Translate everything. Duplicate names only have to be checked once
+    for to_translate in dict.fromkeys(to_translate_list):
         length = len(to_translate)
         translated_count = 0
 
@@ -395,119 +599,83 @@ def update_dictionary(to_translate_list, translating_shapes=False, self=None):
             if not re.findall(regex, to_translate):
                 continue
 
-            translated = False
-            for key, value in dictionary_google.get('translations_full').items():
-                if to_translate == key and value:
-                    translated = True
-
-            if not translated:
+            if not translations_full.get(to_translate) and to_translate not in google_input_set:
                 google_input.append(to_translate)
+                google_input_set.add(to_translate)
 
         # Translate with internal dictionary
         else:
-            for key, value in dictionary.items():
-                if key in to_translate:
-                    if value:
-                        to_translate = to_translate.replace(key, value)
-                    else:
-                        continue
-
-                    # Check if string is fully translated
-                    translated_count += len(key)
-                    if translated_count >= length:
-                        break
+            to_translate, translated_count = get_matcher().replace(to_translate, length)
 
             # If not fully translated, translate the rest with Google
             if translated_count < length:
                 match = re.findall(regex, to_translate)
                 if match:
                     for name in match:
-                        if name not in google_input and name not in dictionary.keys():
+                        if name not in google_input_set and name not in dictionary:
                             google_input.append(name)
+                            google_input_set.add(name)
 
     if not google_input:
         # print('NO GOOGLE TRANSLATIONS')
-        return
+        return True
 
     # Translate the rest with google translate
     print('GOOGLE DICT UPDATE!')
-    translator = google_translator(url_suffix='com')
-    token_tries = 0
-    while True:
-        try:
-            translations = [translator.translate(text, lang_src='ja', lang_tgt='en').strip() for text in google_input]
-            break
-        except (requests.exceptions.ConnectionError, ConnectionRefusedError):
+
+    # Every batch gets added to the dictionaries and saved as soon as it arrives, so nothing is lost if Google fails later
+    def add_translations(translations):
+        new_translations = []
+        for name, translation in translations.items():
+            if use_google_only:
+                new_translations.append(('translations_full', name, translation))
+            else:
+                # Capitalize words
+                translation_words = translation.split(' ')
+                translation_words = [word.capitalize() for word in translation_words]
+                translation = ' '.join(translation_words)
+
+                new_translations.append(('translations', name, translation))
+
+            add_google_translation(*new_translations[-1])
+            print(name, '->', translation)
+
+        # The new translations can change the result of already translated names
+        translation_cache.clear()
+
+        # Save the new translations locally
+        save_google_translations(new_translations)
+
+    translator = GoogleTranslator(lang_src='ja', lang_tgt='en', url=google_server_url)
+    try:
+        translator.translate(google_input, add_translations)
+    except GoogleTranslationError as e:
+        if e.kind == translate_google.ERROR_CONNECTION:
             print('CONNECTION TO GOOGLE FAILED!')
             if self:
                 self.report({'ERROR'}, t('update_dictionary.error.cantConnect'))
-            return
-        except json.JSONDecodeError:
+        elif e.kind == translate_google.ERROR_BANNED:
+            print('YOU GOT BANNED BY GOOGLE!')
             if self:
                 self.report({'ERROR'}, t('update_dictionary.error.temporaryBan') + t('update_dictionary.error.catsTranslated'))
-            print('YOU GOT BANNED BY GOOGLE!')
-            return
-        except RuntimeError as e:
-            error = Common.html_to_text(str(e))
+        elif e.kind == translate_google.ERROR_NO_ACCESS:
+            print('NO PERMISSION TO USE GOOGLE TRANSLATE!')
             if self:
-                if 'Please try your request again later' in error:
-                    self.report({'ERROR'}, t('update_dictionary.error.temporaryBan') + t('update_dictionary.error.catsTranslated'))
-                    print('YOU GOT BANNED BY GOOGLE!')
-                    return
-
-                if 'Error 403' in error:
-                    self.report({'ERROR'}, t('update_dictionary.error.cantAccess') + t('update_dictionary.error.catsTranslated'))
-                    print('NO PERMISSION TO USE GOOGLE TRANSLATE!')
-                    return
-
-                self.report({'ERROR'}, t('update_dictionary.error.errorMsg') + t('update_dictionary.error.catsTranslated') + '\n' + '\nGoogle: ' + error)
-            print('', 'You got an error message from Google:', error, '')
-            return
-        except AttributeError:
-            # If the translator wasn't able to create a stable connection to Google, just retry it again
-            # This is an issue with Google since Nov 2020: https://github.com/ssut/py-googletrans/issues/234
-            token_tries += 1
-            if token_tries < 3:
-                print('RETRY', token_tries)
-                translator = google_translator(url_suffix='com')
-                continue
-
-            # If if didn't work after 20 tries, just quit
-            # The response from Google was printed into "cats/resources/google-response.txt"
+                self.report({'ERROR'}, t('update_dictionary.error.cantAccess') + t('update_dictionary.error.catsTranslated'))
+        elif e.kind == translate_google.ERROR_API_CHANGED:
+            print('ERROR: GOOGLE API CHANGED!')
+            print(e.message)
             if self:
                 self.report({'ERROR'}, t('update_dictionary.error.apiChanged'))
-            print('ERROR: GOOGLE API CHANGED!')
-            print(traceback.format_exc())
-            return
-
-    # Update the dictionaries
-    for i, translation in enumerate(translations):
-        name = google_input[i]
-
-        if use_google_only:
-            dictionary_google['translations_full'][name] = translation
         else:
-            # Capitalize words
-            translation_words = translation.split(' ')
-            translation_words = [word.capitalize() for word in translation_words]
-            translation = ' '.join(translation_words)
-
-            dictionary[name] = translation
-            dictionary_google['translations'][name] = translation
-
-        print(google_input[i], '->', translation)
-
-    # Sort dictionary
-    temp_dict = copy.deepcopy(dictionary)
-    dictionary = OrderedDict()
-    for key in sorted(temp_dict, key=lambda k: len(k), reverse=True):
-        dictionary[key] = temp_dict[key]
-
-    # Save the google dict locally
-    save_google_dict()
+            error = Common.html_to_text(e.message)
+            print('', 'You got an error message from Google:', error, '')
+            if self:
+                self.report({'ERROR'}, t('update_dictionary.error.errorMsg') + t('update_dictionary.error.catsTranslated') + '\n' + '\nGoogle: ' + error)
+        return False
 
     print('DICTIONARY UPDATE SUCCEEDED!')
-    return
+    return True
 
 
 def translate(to_translate, add_space=False, translating_shapes=False):
@@ -522,6 +690,12 @@ def translate(to_translate, add_space=False, translating_shapes=False):
     if translating_shapes and bpy.context.scene.use_google_only:
         use_google_only = True
 
+    # Every name only has to be translated once until the dictionaries change
+    cache_key = (to_translate, add_space, use_google_only)
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # Add space for shape keys
     addition = ''
     if add_space:
@@ -532,31 +706,30 @@ def translate(to_translate, add_space=False, translating_shapes=False):
 
     # Translate shape keys with Google Translator only, if the user chose this
     if use_google_only:
-        for key, value in dictionary_google.get('translations_full').items():
-            if to_translate == key and value:
-                to_translate = value
+        translation_full = dictionary_google.get('translations_full').get(to_translate)
+        if translation_full:
+            to_translate = translation_full
 
     # Translate with internal dictionary
     else:
-        for key, value in dictionary.items():
-            if key in to_translate:
-                # If string is empty, don't replace it. This will be done at the end
-                if not value:
-                    continue
-
-                to_translate = to_translate.replace(key, addition + value)
-
-                # Check if string is fully translated
-                translated_count += len(key)
-                if translated_count >= length:
-                    break
+        to_translate, translated_count = get_matcher().replace(to_translate, length, addition=addition)
 
     to_translate = to_translate.replace('.L', '_L').replace('.R', '_R').replace('  ', ' ').replace('し', '').replace('っ', '').strip()
 
     # print('"' + pre_translation + '"')
     # print('"' + to_translate + '"')
 
-    return to_translate, pre_translation != to_translate
+    result = to_translate, pre_translation != to_translate
+    translation_cache[cache_key] = result
+    return result
+
+
+# Returns the matcher of the current dictionary and compiles it if it doesn't exist yet
+def get_matcher():
+    global dictionary_matcher
+    if dictionary_matcher is None:
+        dictionary_matcher = TranslationMatcher(dictionary.items())
+    return dictionary_matcher
 
 
 def fix_jp_chars(name):
@@ -575,14 +748,137 @@ def reset_google_dict():
     dictionary_google['created'] = now_utc
     dictionary_google['translations'] = {}
     dictionary_google['translations_full'] = {}
+    translation_cache.clear()
 
     save_google_dict()
     print('GOOGLE DICT RESET')
 
 
 def save_google_dict():
-    with open(dictionary_google_file, 'w', encoding="utf8") as outfile:
+    # Write into a temporary file first, so that a crash while saving never leaves a broken google dict behind
+    temp_file = dictionary_google_file + '.tmp'
+    with open(temp_file, 'w', encoding="utf8") as outfile:
         json.dump(dictionary_google, outfile, ensure_ascii=False, indent=4)
+    os.replace(temp_file, dictionary_google_file)
+
+
+# Only call this once everything from the journal is in the saved google dict
+def remove_google_journal():
+    global google_journal_size
+    try:
+        os.remove(dictionary_google_journal_file)
+    except FileNotFoundError:
+        pass
+    google_journal_size = 0
+
+
+# Adds a Google translation to the google dict and to the dictionary used for translating
+def add_google_translation(section, name, translation):
+    if not name:
+        return
+
+    if section == 'translations_full':
+        dictionary_google['translations_full'][name] = translation
+        return
+
+    # The internal dictionary always has priority over the Google translations
+    if name in dictionary and name not in dictionary_google['translations']:
+        return
+
+    dictionary_google['translations'][name] = translation
+    dictionary[name] = translation
+
+    # The matcher keeps the dictionary sorted by length on its own
+    get_matcher().add(name, translation)
+
+
+# Appends new Google translations to the journal instead of rewriting the whole google dict every time
+# The google dict only gets rewritten once the journal gets too big
+def save_google_translations(new_translations):
+    global google_journal_size
+    if google_journal_size + len(new_translations) > google_journal_max_size:
+        save_google_dict()
+        remove_google_journal()
+        return
+
+    with open(dictionary_google_journal_file, 'a', encoding="utf8") as outfile:
+        for section, name, translation in new_translations:
+            outfile.write(json.dumps([section, name, translation], ensure_ascii=False) + '\n')
+    google_journal_size += len(new_translations)
+
+
+# Adds all translations from the journal to the dictionaries
+def load_google_journal():
+    global google_journal_size
+    google_journal_size = 0
+
+    try:
+        with open(dictionary_google_journal_file, encoding="utf8") as file:
+            for line in file:
+                try:
+                    section, name, translation = json.loads(line)
+                except ValueError:
+                    # The last line can be incomplete if Blender was closed while saving it
+                    print('ERROR FOUND IN GOOGLE JOURNAL')
+                    continue
+
+                if section not in ['translations', 'translations_full']:
+                    continue
+
+                add_google_translation(section, name, translation)
+                google_journal_size += 1
+    except FileNotFoundError:
+        pass
+
+
+# Returns the modification time and size of the dictionary files. The cache is only valid as long as these don't change
+def get_dictionary_file_stamps():
+    stamps = []
+    for file in [dictionary_file, dictionary_google_file]:
+        try:
+            stat = os.stat(file)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def load_dictionary_cache():
+    try:
+        with open(dictionary_cache_file, 'rb') as file:
+            cache = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError):
+        print('ERROR FOUND IN DICTIONARY CACHE')
+        return None
+
+    if type(cache) is not dict \
+            or cache.get('version') != dictionary_cache_version \
+            or cache.get('stamps') != get_dictionary_file_stamps():
+        return None
+
+    return cache
+
+
+def save_dictionary_cache(dict_found):
+    cache = {
+        'version': dictionary_cache_version,
+        'stamps': get_dictionary_file_stamps(),
+        'dict_found': dict_found,
+        'dictionary': dictionary,
+        'dictionary_google': dictionary_google,
+        'matcher': get_matcher().get_state(),
+    }
+
+    # Write into a temporary file first, so that a broken cache never replaces a working one
+    temp_file = dictionary_cache_file + '.tmp'
+    try:
+        with open(temp_file, 'wb') as outfile:
+            pickle.dump(cache, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, dictionary_cache_file)
+    except (OSError, pickle.PicklingError):
+        print('COULD NOT SAVE DICTIONARY CACHE')
 
 # def cvs_to_json():
 #     temp_dict = OrderedDict()
@@ -0,0 +1,255 @@
+# MIT License
+
+# Copyright (c) 2017 GiveMeAllYourCats
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Code author: GiveMeAllYourCats
+# Repo: https://github.com/michaeldegroot/cats-blender-plugin
+# Edits by: GiveMeAllYourCats, Hotox
+
+# Google Translate backend used to update the dictionary.
+# Names are sent in multi line batches by a small pool of workers. Requests are rate limited with a token bucket,
+# failed requests are retried with exponential backoff and finished batches are handed back in their original order
+# as soon as they are done, so that nothing that was already translated gets lost when Google stops responding.
+
+import json
+import time
+import random
+import threading
+import requests
+import concurrent.futures
+
+from urllib.parse import quote
+
+google_url = 'https://translate.google.{}/_/TranslateWebserverUi/data/batchexecute'
+google_rpc = 'MkEWBc'
+
+# Error kinds
+ERROR_CONNECTION = 'CONNECTION'
+ERROR_BANNED = 'BANNED'
+ERROR_NO_ACCESS = 'NO_ACCESS'
+ERROR_API_CHANGED = 'API_CHANGED'
+ERROR_OTHER = 'OTHER'
+
+
+class GoogleTranslationError(Exception):
+    def __init__(self, kind, message=''):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+
+    # Only connection problems and rate limits (429/503) might go away if the request is sent again later
+    def is_temporary(self):
+        return self.kind in [ERROR_CONNECTION, ERROR_BANNED]
+
+
+# Allows a request every 1/rate seconds on average, with bursts of up to 'capacity' requests
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+                self.last_update = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class GoogleTranslator:
+    # url can point to any server that speaks the Google batchexecute protocol, e.g. a local stub for testing
+    def __init__(self, lang_src='ja', lang_tgt='en', url=None, url_suffix='com', workers=4, rate=4, burst=4,
+                 chunk_size=16, chunk_chars=1000, retries=4, backoff=1, timeout=5):
+        self.lang_src = lang_src
+        self.lang_tgt = lang_tgt
+        self.url_suffix = url_suffix
+        self.url = url if url else google_url.format(url_suffix)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.chunk_chars = chunk_chars
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.bucket = TokenBucket(rate, burst)
+        self.stopped = threading.Event()
+        self.sessions = threading.local()
+
+    # Translates all texts and calls callback with a dict of {text: translation} for every finished batch
+    # The batches are handed to the callback in the order of the texts, always from the thread that called this.
+    # Raises a GoogleTranslationError if the translation had to be stopped, after all finished batches were handed over
+    def translate(self, texts, callback):
+        chunks = self.create_chunks(texts)
+        if not chunks:
+            return
+
+        self.stopped.clear()
+        results = [None] * len(chunks)
+        next_chunk = 0
+        error = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as executor:
+            futures = {executor.submit(self.translate_chunk, chunk): i for i, chunk in enumerate(chunks)}
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except GoogleTranslationError as e:
+                    # Stop all remaining work, there is no point in hammering Google any further
+                    if not error:
+                        error = e
+                    self.stopped.set()
+                    continue
+
+                # Hand over all batches that are finished up to the first one that isn't
+                while next_chunk < len(chunks) and results[next_chunk] is not None:
+                    callback(results[next_chunk])
+                    next_chunk += 1
+
+        if error:
+            # Don't lose the batches that finished after the failed one
+            for result in results[next_chunk:]:
+                if result:
+                    callback(result)
+            raise error
+
+    # Splits the texts into batches of a limited number of lines and characters
+    def create_chunks(self, texts):
+        chunks = []
+        chunk = []
+        chunk_chars = 0
+        for text in texts:
+            if '\n' in text:
+                # Texts with line breaks can't be batched, they are sent on their own
+                chunks.append([text])
+                continue
+
+            if chunk and (len(chunk) >= self.chunk_size or chunk_chars + len(text) + 1 > self.chunk_chars):
+                chunks.append(chunk)
+                chunk = []
+                chunk_chars = 0
+
+            chunk.append(text)
+            chunk_chars += len(text) + 1
+
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    # Translates a batch as a single multi line request
+    # If Google doesn't keep the lines intact, the texts of the batch are translated one by one instead
+    def translate_chunk(self, chunk):
+        if len(chunk) > 1:
+            lines = self.request('\n'.join(chunk)).split('\n')
+            if len(lines) == len(chunk):
+                return {text: line.strip() for text, line in zip(chunk, lines)}
+
+        return {text: self.request(text).strip() for text in chunk}
+
+    # Sends a single request, retrying it with exponential backoff on temporary errors
+    def request(self, text):
+        tries = 0
+        while True:
+            if self.stopped.is_set():
+                raise GoogleTranslationError(ERROR_OTHER, 'Translation was stopped')
+
+            self.bucket.acquire()
+            try:
+                return self.send(text)
+            except GoogleTranslationError as e:
+                tries += 1
+                if not e.is_temporary() or tries > self.retries:
+                    raise e
+
+                wait_time = self.backoff * 2 ** (tries - 1)
+                wait_time += random.uniform(0, wait_time / 2)
+                print('GOOGLE REQUEST FAILED (' + e.kind + '), RETRY', tries, 'IN', round(wait_time, 2), 'SECONDS')
+
+                # Stop waiting if another worker already gave up
+                if self.stopped.wait(wait_time):
+                    raise e
+
+    def get_session(self):
+        session = getattr(self.sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.sessions.session = session
+        return session
+
+    def send(self, text):
+        parameter = [[text, self.lang_src, self.lang_tgt, True], [1]]
+        rpc = [[[google_rpc, json.dumps(parameter, separators=(',', ':')), None, 'generic']]]
+        data = 'f.req={}&'.format(quote(json.dumps(rpc, separators=(',', ':'))))
+        headers = {
+            'Referer': 'http://translate.google.{}/'.format(self.url_suffix),
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64) '
+                          'AppleWebKit/537.36 (KHTML, like Gecko) '
+                          'Chrome/47.0.2526.106 Safari/537.36',
+            'Content-Type': 'application/x-www-form-urlencoded;charset=utf-8',
+        }
+
+        try:
+            response = self.get_session().post(self.url, data=data, headers=headers, timeout=self.timeout, verify=False)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionRefusedError) as e:
+            raise GoogleTranslationError(ERROR_CONNECTION, str(e))
+        except requests.exceptions.RequestException as e:
+            raise GoogleTranslationError(ERROR_OTHER, str(e))
+
+        if response.status_code == 403:
+            raise GoogleTranslationError(ERROR_NO_ACCESS, 'Error 403')
+        if response.status_code == 429 or response.status_code == 503:
+            raise GoogleTranslationError(ERROR_BANNED, 'Error ' + str(response.status_code))
+        if response.status_code != 200:
+            raise GoogleTranslationError(ERROR_OTHER, 'Error ' + str(response.status_code) + ': ' + response.text[:500])
+
+        for line in response.iter_lines(chunk_size=1024):
+            line = line.decode('utf-8')
+            if google_rpc in line:
+                return self.parse_response(line, text)
+
+        # Google sends a captcha page instead of the translation if it thinks that it's getting spammed
+        if 'Please try your request again later' in response.text or 'captcha' in response.text.lower():
+            raise GoogleTranslationError(ERROR_BANNED, 'Please try your request again later')
+        raise GoogleTranslationError(ERROR_API_CHANGED, response.text[:500])
+
+    @staticmethod
+    def parse_response(line, text):
+        try:
+            response = json.loads(json.loads(line + ']')[0][2])
+            translation = response[1][0][0]
+
+            # A translation with multiple sentences or lines is split up into parts, which have to be put back together
+            if len(translation) > 5 and translation[5]:
+                return ''.join(sentence[0] for sentence in translation[5] if sentence and sentence[0])
+
+            return translation[0] if translation[0] else text
+        except (ValueError, TypeError, IndexError, KeyError) as e:
+            raise GoogleTranslationError(ERROR_API_CHANGED, str(e))
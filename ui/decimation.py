@@ -179,6 +179,8 @@ class DecimationPanel(ToolPanel, bpy.types.Panel):
         row.operator(Decimation.AutoDecimatePresetQuest.bl_idname)
         row = col.row(align=True)
         row.prop(context.scene, 'max_tris')
+        row = col.row(align=True)
+        row.operator(Decimation.DecimationPreviewButton.bl_idname, icon='VIEWZOOM')
         col.separator()
         col.label(text=t('DecimationPanel.warn.notIfBaking'), icon='INFO')
         row = col.row(align=True)
@@ -683,7 +683,7 @@ def clean_addon_dir():
     folders = [f for f in os.listdir(resources_folder) if os.path.isdir(os.path.join(resources_folder, f))]
 
     for f in files:
-        if f == 'settings.json' or f == 'dictionary_google.json':
+        if f == 'settings.json' or f == 'dictionary_google.json' or f == 'dictionary_google_journal.txt':
             continue
         file = os.path.join(resources_folder, f)
         try: